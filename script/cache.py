@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from sqlite3 import connect
+from json import dumps, loads
+from threading import Lock
+from time import time
+
+
+DAY = 86400
+# Time to live, in seconds, of the data retrieved from each source
+DEFAULT_TTL = {
+    "doi": 365 * DAY,
+    "crossref": 30 * DAY,
+    "datacite": 30 * DAY,
+    "orcid": 7 * DAY
+}
+# Time to live, in seconds, of negative results (e.g. DOIs not found)
+DEFAULT_NEGATIVE_TTL = DAY
+DEFAULT_MAX_SIZE = 1000000
+# Time, in seconds, to wait for the other processes (e.g. the workers of cnc.py) sharing the cache to release it
+BUSY_TIMEOUT = 60
+# Number of items read from the cache after which their access times are stored
+TOUCH_SIZE = 1000
+
+
+class ResponseCache(object):
+    def __init__(self, path, ttl=None, negative_ttl=DEFAULT_NEGATIVE_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.lock = Lock()
+        self.touched = {}  # (source, key) -> time of the last access not stored yet
+        # In WAL mode readers do not block the writer, and each change is committed at once, so that no write
+        # transaction is kept open while the data are retrieved from the services
+        self.conn = connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (source TEXT, key TEXT, value TEXT, expires REAL, "
+                          "accessed REAL, PRIMARY KEY (source, key)) WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, source, key):
+        with self.lock:
+            now = time()
+            row = self.conn.execute("SELECT value, expires FROM cache WHERE source = ? AND key = ?",
+                                    (source, key)).fetchone()
+            if row is None:
+                return False, None
+            elif row[1] < now:
+                self.conn.execute("DELETE FROM cache WHERE source = ? AND key = ?", (source, key))
+                self.touched.pop((source, key), None)
+                self.size -= 1
+                self.__changed()
+                return False, None
+            else:
+                # The access times are only used for evicting items, thus they are stored in batches
+                self.touched[(source, key)] = now
+                if len(self.touched) >= TOUCH_SIZE:
+                    self.__touch()
+                return True, loads(row[0])
+
+    def put(self, source, key, value, negative=False):
+        with self.lock:
+            now = time()
+            expires = now + (self.negative_ttl if negative else self.ttl.get(source, self.negative_ttl))
+            # Replacements are counted as well, the actual size is recomputed before evicting
+            self.conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                              (source, key, dumps(value), expires, now))
+            self.touched.pop((source, key), None)
+            self.size += 1
+            if self.size > self.max_size:
+                self.__evict()
+            self.__changed()
+
+    def __evict(self):
+        # Remove the least recently used tenth of the cache, so as to not evict at every new item
+        self.__touch()
+        self.conn.execute("DELETE FROM cache WHERE expires < ?", (time(),))
+        to_remove = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - int(self.max_size * 0.9)
+        if to_remove > 0:
+            self.conn.execute("DELETE FROM cache WHERE (source, key) IN "
+                              "(SELECT source, key FROM cache ORDER BY accessed LIMIT ?)", (to_remove,))
+        self.size = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        self.conn.commit()
+
+    def __touch(self):
+        self.conn.executemany("UPDATE cache SET accessed = ? WHERE source = ? AND key = ?",
+                              ((accessed, source, key) for (source, key), accessed in self.touched.items()))
+        self.touched = {}
+        self.conn.commit()
+
+    def __changed(self):
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.__touch()
+                self.conn.close()
+                self.conn = None
@@ -15,26 +15,49 @@
 # SOFTWARE.
 
 from argparse import ArgumentParser
-from script.oci import OCIManager, Citation
-from requests import get
-from json import loads, load
+from script.oci import OCIManager, Citation, CSV_FIELDS, CSV_PROV_FIELDS
+from script.ociindex import OCIIndex, OCITable, OCIFilter
+from script.cache import ResponseCache, DAY, DEFAULT_MAX_SIZE
+from script.session import HTTPSession, DEFAULT_SESSION
+from script.manifest import ManifestManager
+from script.compact import open_text
+from json import loads, load, dumps, JSONDecoder, JSONDecodeError
+from itertools import chain
 from re import sub, findall
 from urllib.parse import unquote, quote
 from datetime import datetime
 from csv import DictReader, DictWriter
-from os.path import isdir, exists
-from os import walk, sep, makedirs
+from os.path import isdir, exists, dirname
+from os import walk, sep, makedirs, fsync, remove, replace
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from collections import Counter
+from zlib import crc32
+from tempfile import mkdtemp
+from shutil import rmtree, copyfileobj
 
 
 HTTP_HEADERS = {"User-Agent": "CROCI / Create New Citations (via OpenCitations - "
                               "http://opencitations.net; mailto:contact@opencitations.net)"}
 BASE_URL = "http://dx.doi.org/"
+CROSSREF_API = "https://api.crossref.org/"
+CROSSREF_BATCH_SIZE = 50
+BUFFER_SIZE = 10000
+SCHOLIX_CHUNK_SIZE = 1048576
 CROCI_BASE = "https://w3id.org/oc/index/croci/"
+# The classes implementing the index of the existing OCIs, and the name of their file in the data directory
+INDEX_FORMATS = {
+    "sqlite": (OCIIndex, "oci.db"),
+    "table": (OCITable, "oci.table")
+}
 
 
 class DOIManager(object):
-    def __init__(self):
+    def __init__(self, cache=None, session=None):
         self.api = "https://doi.org/api/handles/"
+        self.valid = {}
+        self.cache = cache
+        self.session = DEFAULT_SESSION if session is None else session
 
     def normalize(self, doi_entity):
         try:
@@ -45,30 +68,45 @@ class DOIManager(object):
 
     def call_doi(self, doi_entity):
         doi = self.normalize(doi_entity)
-        r = get(self.api + quote(doi), headers=HTTP_HEADERS, timeout=30)
+        r = self.session.get(self.api + quote(doi), headers=HTTP_HEADERS, timeout=30)
         if r.status_code == 200:
             r.encoding = "utf-8"
             json_res = loads(r.text)
             return json_res.get("responseCode")
+        elif r.status_code == 404:
+            return 100  # Handle not found
 
     def is_valid(self, doi_entity):
-        result = self.call_doi(doi_entity)
-        return result == 1
+        doi = self.normalize(doi_entity)
+        if doi not in self.valid:
+            found, value = self.cache.get("doi", doi) if self.cache is not None else (False, None)
+            if not found:
+                code = self.call_doi(doi)
+                value = code == 1
+                # Only the answers of the service are cached, not the errors in contacting it
+                if self.cache is not None and code is not None:
+                    self.cache.put("doi", doi, value, not value)
+            self.valid[doi] = value
+        return self.valid[doi]
 
 
 class DataCiteManager(object):
-    def __init__(self):
+    def __init__(self, cache=None, session=None):
         self.date = {}
         self.api = "https://api.datacite.org/works/%s"
         self.dm = DOIManager()
+        self.cache = cache
+        self.session = DEFAULT_SESSION if session is None else session
 
     def call_datacite(self, doi_entity):
         doi = self.dm.normalize(doi_entity)
-        r = get(self.api + quote(doi), headers=HTTP_HEADERS, timeout=30)
+        r = self.session.get(self.api % quote(doi), headers=HTTP_HEADERS, timeout=30)
         if r.status_code == 200:
             r.encoding = "utf-8"
             json_res = loads(r.text)
             return json_res
+        elif r.status_code == 404:
+            return {}
 
     def __get_date(self, json_obj):
         return json_obj.get("published")
@@ -81,8 +119,14 @@ class DataCiteManager(object):
     def __get_item(self, doi_entity, c):
         doi = self.dm.normalize(doi_entity)
         if doi not in c:
-            json_obj = self.call_datacite(doi)
-            self.date[doi] = self.__get_date(json_obj["data"]["attributes"])
+            found, value = self.cache.get("datacite", doi) if self.cache is not None else (False, None)
+            if not found:
+                json_obj = self.call_datacite(doi)
+                if json_obj and json_obj.get("data") and json_obj["data"].get("attributes"):
+                    value = self.__get_date(json_obj["data"]["attributes"])
+                if self.cache is not None and json_obj is not None:
+                    self.cache.put("datacite", doi, value, value is None)
+            self.date[doi] = value
         return c.get(doi)
 
     def get_date(self, doi_entity):
@@ -90,20 +134,33 @@ class DataCiteManager(object):
 
 
 class CrossrefManager(object):
-    def __init__(self):
+    def __init__(self, cache=None, session=None, api_base=CROSSREF_API):
         self.issn = {}
         self.date = {}
         self.orcid = {}
-        self.api = "https://api.crossref.org/works/%s"
+        self.api = api_base + "works/%s"
+        self.batch_api = api_base + "works?filter=%s&select=DOI,ISSN,issued,author,type&rows=%s"
         self.dm = DOIManager()
+        self.cache = cache
+        self.session = DEFAULT_SESSION if session is None else session
 
     def call_crossref(self, doi_entity):
         doi = self.dm.normalize(doi_entity)
-        r = get(self.api + quote(doi), headers=HTTP_HEADERS, timeout=30)
+        r = self.session.get(self.api % quote(doi), headers=HTTP_HEADERS, timeout=30)
         if r.status_code == 200:
             r.encoding = "utf-8"
             json_res = loads(r.text)
             return json_res.get("message")
+        elif r.status_code == 404:
+            return {}
+
+    def call_crossref_batch(self, dois):
+        r = self.session.get(self.batch_api % (quote(",".join("doi:" + doi for doi in dois)), len(dois)),
+                             headers=HTTP_HEADERS, timeout=30)
+        if r.status_code == 200:
+            r.encoding = "utf-8"
+            json_res = loads(r.text)
+            return json_res.get("message", {}).get("items", [])
 
     @staticmethod
     def contains(obj, key, value):
@@ -164,17 +221,45 @@ class CrossrefManager(object):
 
     def __get_item(self, doi_entity, c):
         doi = self.dm.normalize(doi_entity)
-        if doi not in c:
-            json_obj = self.call_crossref(doi)
-            self.issn[doi] = self.__get_issn(json_obj)
-            self.date[doi] = self.__get_date(json_obj)
-            self.orcid[doi] = self.__get_orcid(json_obj)
+        if doi not in c and not self.__get_cached(doi):
+            self.__set_item(doi, self.call_crossref(doi))
         return c.get(doi)
 
+    def __get_cached(self, doi):
+        found, value = self.cache.get("crossref", doi) if self.cache is not None else (False, None)
+        if found:
+            self.issn[doi], self.date[doi], self.orcid[doi] = value
+        return found
+
+    def __set_item(self, doi, json_obj):
+        value = [self.__get_issn(json_obj), self.__get_date(json_obj), self.__get_orcid(json_obj)]
+        if self.cache is not None and json_obj is not None:
+            self.cache.put("crossref", doi, value, not json_obj)
+        self.issn[doi], self.date[doi], self.orcid[doi] = value
+
+    def prefetch(self, doi_entities, batch_size=CROSSREF_BATCH_SIZE):
+        dois = []
+        for doi in set(self.dm.normalize(doi_entity) for doi_entity in doi_entities):
+            # Commas cannot be used in filter values, thus such DOIs are retrieved one at a time when needed
+            if doi and "," not in doi and doi not in self.issn and not self.__get_cached(doi):
+                dois.append(doi)
+
+        for idx in range(0, len(dois), batch_size):
+            batch = dois[idx:idx + batch_size]
+            items = self.call_crossref_batch(batch)
+            if items is not None:
+                json_objs = {}
+                for item in items:
+                    if item.get("DOI"):
+                        json_objs[item["DOI"].lower()] = item
+                # The DOIs not returned are not in Crossref
+                for doi in batch:
+                    self.__set_item(doi, json_objs.get(doi, {}))
+
     def share_issn(self, doi_entity_1, doi_entity_2):
         result = False
 
-        doi_entity_1_issns = self.get_issn(doi_entity_1)
+        doi_entity_1_issns = list(self.get_issn(doi_entity_1))
         doi_entity_2_issns = self.get_issn(doi_entity_2)
         while not result and doi_entity_1_issns:
             result = doi_entity_1_issns.pop(0) in doi_entity_2_issns
@@ -184,7 +269,7 @@ class CrossrefManager(object):
     def share_orcid(self, doi_entity_1, doi_entity_2):
         result = False
 
-        doi_entity_1_orcid = self.get_orcid(doi_entity_1)
+        doi_entity_1_orcid = list(self.get_orcid(doi_entity_1))
         doi_entity_2_orcid = self.get_orcid(doi_entity_2)
         while not result and doi_entity_1_orcid:
             result = doi_entity_1_orcid.pop(0) in doi_entity_2_orcid
@@ -193,7 +278,7 @@ class CrossrefManager(object):
 
 
 class ORCIDManager(object):
-    def __init__(self, key, m_list=[]):
+    def __init__(self, key, m_list=[], cache=None, session=None):
         self.orcid = {}
         self.api = "https://pub.orcid.org/v2.1/search?q="
         self.dm = DOIManager()
@@ -202,25 +287,31 @@ class ORCIDManager(object):
             self.header["Authorization"] = "Bearer %s" % key
         self.header.update(HTTP_HEADERS)
         self.m_list = m_list
+        self.cache = cache
+        self.session = DEFAULT_SESSION if session is None else session
 
     def call_orcid(self, doi_entity):
         doi = self.dm.normalize(doi_entity)
-        r = get(self.api + quote("doi-self:\"%s\" OR doi-self:\"%s\"" % (doi, doi.upper())),
-                headers=self.header, timeout=30)
+        r = self.session.get(self.api + quote("doi-self:\"%s\" OR doi-self:\"%s\"" % (doi, doi.upper())),
+                             headers=self.header, timeout=30)
         if r.status_code == 200:
             r.encoding = "utf-8"
             json_res = loads(r.text)
-            return json_res.get("result")
+            return json_res.get("result") or []
 
     def get_orcid(self, doi_entity):
         doi = self.dm.normalize(doi_entity)
         if doi not in self.orcid:
-            json_obj = self.call_orcid(doi)
-            result = []
-            for item in json_obj:
-                orcid = item.get("orcid-identifier")
-                if orcid:
-                    result.append(orcid["path"])
+            found, result = self.cache.get("orcid", doi) if self.cache is not None else (False, None)
+            if not found:
+                json_obj = self.call_orcid(doi)
+                result = []
+                for item in json_obj or []:
+                    orcid = item.get("orcid-identifier")
+                    if orcid:
+                        result.append(orcid["path"])
+                if self.cache is not None and json_obj is not None:
+                    self.cache.put("orcid", doi, result, not json_obj)
             self.orcid[doi] = result
         for m in self.m_list:
             if doi in m.orcid:
@@ -233,7 +324,7 @@ class ORCIDManager(object):
     def share_orcid(self, doi_entity_1, doi_entity_2):
         result = False
 
-        doi_entity_1_orcid = self.get_orcid(doi_entity_1)
+        doi_entity_1_orcid = list(self.get_orcid(doi_entity_1))
         doi_entity_2_orcid = self.get_orcid(doi_entity_2)
         while not result and doi_entity_1_orcid:
             result = doi_entity_1_orcid.pop(0) in doi_entity_2_orcid
@@ -243,28 +334,49 @@ class ORCIDManager(object):
 
 class CSVManager(object):
     @staticmethod
-    def open_csv(fd_path, metadata=False, delimiter=","):
-        result = []
-
+    def get_csv_paths(fd_path, extension=".csv"):
         f_paths = set()
         if exists(fd_path):
             if isdir(fd_path):
                 for cur_dir, cur_subdir, cur_files in walk(fd_path):
                     for cur_file in cur_files:
-                        if cur_file.endswith(".csv"):
+                        if cur_file.endswith(extension) or cur_file.endswith(extension + ".gz"):
                             f_paths.add(cur_dir + sep + cur_file)
             else:
-                if fd_path.endswith(".csv"):
+                if fd_path.endswith(extension) or fd_path.endswith(extension + ".gz"):
                     f_paths.add(fd_path)
 
-        for f_path in f_paths:
-            meta = {}
-            with open(f_path) as f:
-                cur_citations = list(DictReader(f, delimiter=delimiter))
-                if metadata:
-                    with open(f_path.replace(".csv", ".json")) as mf:
-                        meta = load(mf)
-                result.append((cur_citations, meta))
+        return f_paths
+
+    @staticmethod
+    def iter_csv(fd_path, metadata=False, delimiter=","):
+        for f_path in CSVManager.get_csv_paths(fd_path):
+            meta = CSVManager.get_metadata(f_path) if metadata else {}
+            for row in CSVManager.iter_rows(f_path, delimiter):
+                yield row, meta
+
+    @staticmethod
+    def iter_rows(f_path, delimiter=","):
+        # The shards created by compact.py are compressed
+        with open_text(f_path) as f:
+            for row in DictReader(f, delimiter=delimiter):
+                yield row
+
+    @staticmethod
+    def get_metadata(f_path, extension=".csv"):
+        if f_path.endswith(".gz"):
+            f_path = f_path[:-3]
+        with open(f_path.replace(extension, ".json")) as mf:
+            return load(mf)
+
+    @staticmethod
+    def open_csv(fd_path, metadata=False, delimiter=","):
+        result = []
+
+        for f_path in CSVManager.get_csv_paths(fd_path):
+            cur_citations = list(CSVManager.iter_rows(f_path, delimiter))
+            meta = CSVManager.get_metadata(f_path) if metadata else {}
+            result.append((cur_citations, meta))
 
         return result
 
@@ -285,16 +397,95 @@ class CSVManager(object):
         return result
 
     @staticmethod
-    def store_row(o, t, csv_obj, rdf_graph, is_prov=False):
+    def open_index(fd_path, index_path=None, rebuild=False, index_format="sqlite", use_filter=True, read_only=False):
+        index_class, index_file = INDEX_FORMATS[index_format]
+        if index_path is None:
+            index_path = fd_path + sep + index_file
+
+        # The index is built in a temporary file, renamed only once complete, so that a build that is
+        # interrupted is started again in the following run instead of leaving a partial index
+        is_built = not read_only and (rebuild or not exists(index_path))
+        if is_built:
+            tmp_path = index_path + ".tmp"
+            for f_path in (tmp_path, tmp_path + "-journal", tmp_path + ".log"):
+                if exists(f_path):
+                    remove(f_path)
+            tmp_index = index_class(tmp_path)
+            tmp_index.update(row["oci"] for row, meta in CSVManager.iter_csv(fd_path))
+            tmp_index.close()
+            replace(tmp_path, index_path)
+
+        index = index_class(index_path, read_only)
+        if use_filter:
+            index = OCIFilter(index, is_built)
+
+        return index
+
+    @staticmethod
+    def get_output_paths(o, t, is_prov=False):
         d_path = o + sep + "csv" + sep + t[:7].replace("-", sep) + sep
         r_path = o + sep + "rdf" + sep + t[:7].replace("-", sep) + sep
 
         if is_prov:
-            header = ["oci", "agent", "source", "datetime"]
+            header = CSV_PROV_FIELDS
             d_path = d_path.replace(o + sep, o + sep + ".." + sep + "prov" + sep)
             r_path = r_path.replace(o + sep, o + sep + ".." + sep + "prov" + sep)
         else:
-            header = ["oci", "citing", "cited", "creation", "timespan", "journal_sc", "author_sc"]
+            header = CSV_FIELDS
+
+        return d_path, r_path, header
+
+    @staticmethod
+    def get_run_files(o, t):
+        # All the files written by the run started at time t, with a flag saying if they have an header
+        result = []
+
+        for is_prov in (False, True):
+            d_path, r_path, header = CSVManager.get_output_paths(o, t, is_prov)
+            for f_path, has_header in ((d_path + t + ".csv", True), (r_path + t + ".ttl", False)):
+                if exists(f_path):
+                    result.append((f_path, has_header))
+
+        return result
+
+    @staticmethod
+    def get_nt(rdf_graph):
+        # The RDF data can be either an rdflib graph or a string already serialised in N-Triples
+        if isinstance(rdf_graph, str):
+            return rdf_graph
+        else:
+            return Citation.format_rdf(rdf_graph, "nt")
+
+    @staticmethod
+    def merge_output(src_o, o, t):
+        for is_prov in (False, True):
+            src_d_path, src_r_path, header = CSVManager.get_output_paths(src_o, t, is_prov)
+            d_path, r_path, header = CSVManager.get_output_paths(o, t, is_prov)
+
+            for src_path, f_path, has_header in ((src_d_path + t + ".csv", d_path + t + ".csv", True),
+                                                 (src_r_path + t + ".ttl", r_path + t + ".ttl", False)):
+                if exists(src_path):
+                    if not exists(dirname(f_path)):
+                        makedirs(dirname(f_path))
+                    f_exists = exists(f_path)
+                    with open(src_path, "rb") as sf, open(f_path, "ab") as f:
+                        if has_header and f_exists:
+                            sf.readline()
+                        copyfileobj(sf, f)
+                        f.flush()
+                        fsync(f.fileno())
+
+    @staticmethod
+    def iter_output_ocis(o, t):
+        d_path = CSVManager.get_output_paths(o, t, False)[0] + t + ".csv"
+        if exists(d_path):
+            with open(d_path) as f:
+                for row in DictReader(f):
+                    yield row["oci"]
+
+    @staticmethod
+    def store_row(o, t, csv_obj, rdf_graph, is_prov=False, index=None):
+        d_path, r_path, header = CSVManager.get_output_paths(o, t, is_prov)
 
         if not exists(d_path):
             makedirs(d_path)
@@ -311,8 +502,219 @@ class CSVManager(object):
 
         t_path = r_path + t + ".ttl"
         with open(t_path, "a") as f:
-            rdf_string = Citation.format_rdf(rdf_graph, "nt")
-            f.write(rdf_string)
+            f.write(CSVManager.get_nt(rdf_graph))
+
+        if index is not None and not is_prov:
+            index.add(csv_obj["oci"])
+
+
+class ScholixManager(object):
+    @staticmethod
+    def iter_scholix(fd_path):
+        for f_path in CSVManager.get_csv_paths(fd_path, ".scholix"):
+            f_meta = CSVManager.get_metadata(f_path, ".scholix")
+            metas = {}
+            with open_text(f_path) as f:
+                for link in ScholixManager.iter_json_array(f):
+                    try:
+                        row, agent = ScholixManager.get_row(link)
+                    except Exception as e:  # A malformed link is skipped, without stopping the whole file
+                        print("WARNING: a link in '%s' cannot be processed (%s)" % (f_path, e))
+                        continue
+                    if agent is None:
+                        meta = f_meta
+                    else:
+                        if agent not in metas:
+                            metas[agent] = dict(f_meta)
+                            metas[agent]["agent"] = agent
+                        meta = metas[agent]
+                    yield row, meta
+
+    @staticmethod
+    def iter_json_array(f, chunk_size=SCHOLIX_CHUNK_SIZE):
+        # It parses the items of a JSON array one at a time, without loading the whole file in memory.
+        # 'expected' is what can follow: the array ('['), an item or its end ('item]'), an item only
+        # ('item', after a comma) or a separator (',]', after an item)
+        decoder = JSONDecoder()
+        buffer = f.read(chunk_size)
+        is_eof = not buffer
+        expected = "["
+        idx = 0
+        while True:
+            while idx < len(buffer) and buffer[idx].isspace():
+                idx += 1
+
+            if idx == len(buffer):
+                if is_eof:
+                    raise ValueError("The JSON array is not complete.")
+                buffer = f.read(chunk_size)
+                is_eof = not buffer
+                idx = 0
+            elif expected == "[":
+                if buffer[idx] != "[":
+                    raise ValueError("The JSON data do not contain an array.")
+                expected = "item]"
+                idx += 1
+            elif buffer[idx] == "]" and expected in ("item]", ",]"):
+                ScholixManager.check_end(f, buffer[idx + 1:], chunk_size)
+                return
+            elif expected == ",]":
+                if buffer[idx] != ",":
+                    raise ValueError("Expecting ',' delimiter in the JSON array.")
+                expected = "item"
+                idx += 1
+            elif buffer[idx] in ",]":
+                raise ValueError("Expecting an item instead of '%s' in the JSON array." % buffer[idx])
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, idx)
+                    # An item is complete only if followed by a separator, otherwise (e.g. in case of
+                    # numbers) it could continue in the next chunk
+                    next_idx = end
+                    while next_idx < len(buffer) and buffer[next_idx].isspace():
+                        next_idx += 1
+                    if not is_eof and (next_idx == len(buffer) or buffer[next_idx] not in ",]"):
+                        end = None
+                except JSONDecodeError:
+                    if is_eof:
+                        raise
+                    end = None
+
+                if end is None:
+                    chunk = f.read(chunk_size)
+                    buffer = buffer[idx:] + chunk
+                    is_eof = not chunk
+                    idx = 0
+                else:
+                    yield item
+                    expected = ",]"
+                    idx = end
+
+    @staticmethod
+    def check_end(f, rest, chunk_size=SCHOLIX_CHUNK_SIZE):
+        # Only whitespaces can follow the array
+        while True:
+            if rest.strip():
+                raise ValueError("Extra data after the JSON array.")
+            rest = f.read(chunk_size)
+            if not rest:
+                break
+
+    @staticmethod
+    def get_list(value):
+        # Some Scholix fields (e.g. the identifiers) may contain either an object or a list of objects
+        if isinstance(value, list):
+            return [item for item in value if isinstance(item, dict)]
+        elif isinstance(value, dict):
+            return [value]
+        else:
+            return []
+
+    @staticmethod
+    def get_row(link):
+        source, target = link.get("Source") or {}, link.get("Target") or {}
+        if (link.get("RelationshipType") or {}).get("Name", "").lower() in ("isreferencedby", "iscitedby"):
+            source, target = target, source
+
+        agent = None
+        for provider in ScholixManager.get_list(link.get("LinkProvider")):
+            for identifier in ScholixManager.get_list(provider.get("Identifier")):
+                if agent is None and identifier.get("IDScheme", "").lower() == "orcid" and identifier.get("ID"):
+                    agent = identifier.get("IDURL") or "https://orcid.org/" + identifier["ID"]
+
+        return {
+            "citing_id": ScholixManager.get_doi(source),
+            "citing_publication_date": source.get("PublicationDate") or "",
+            "cited_id": ScholixManager.get_doi(target),
+            "cited_publication_date": target.get("PublicationDate") or ""
+        }, agent
+
+    @staticmethod
+    def get_doi(obj):
+        for identifier in ScholixManager.get_list(obj.get("Identifier")):
+            if identifier.get("IDScheme", "").lower() == "doi" and identifier.get("ID"):
+                return identifier["ID"]
+        return ""
+
+
+class DataWriter(object):
+    # The OCIs of the rows stored are added to the index once written in the files. If the index contains only the
+    # OCIs of this run, those existing before it can be specified as well (exi_ocis), so that the writer knows all
+    # the citations already stored
+    def __init__(self, o, t, buffer_size=BUFFER_SIZE, index=None, exi_ocis=None):
+        self.o = o
+        self.t = t
+        self.buffer_size = buffer_size
+        self.index = index
+        self.exi_ocis = exi_ocis
+        self.files = {}  # path -> (file, buffer, CSV writer on the buffer or None)
+        self.buffered = 0
+        self.ocis = set()
+
+    def __contains__(self, oci):
+        return oci in self.ocis or (self.index is not None and oci in self.index) or \
+            (self.exi_ocis is not None and oci in self.exi_ocis)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __get_file(self, f_path, header=None):
+        if f_path not in self.files:
+            d_path = f_path[:f_path.rindex(sep) + 1]
+            if not exists(d_path):
+                makedirs(d_path)
+
+            f_exists = exists(f_path)
+            buffer = StringIO()
+            dw = None
+            if header is not None:
+                dw = DictWriter(buffer, header)
+                if not f_exists:
+                    dw.writeheader()
+            self.files[f_path] = open(f_path, "a"), buffer, dw
+
+        return self.files[f_path]
+
+    def store_row(self, csv_obj, rdf_graph, is_prov=False):
+        d_path, r_path, header = CSVManager.get_output_paths(self.o, self.t, is_prov)
+
+        f, buffer, dw = self.__get_file(d_path + self.t + ".csv", header)
+        dw.writerow(csv_obj)
+
+        f, buffer, dw = self.__get_file(r_path + self.t + ".ttl")
+        buffer.write(CSVManager.get_nt(rdf_graph))
+
+        if not is_prov:
+            self.ocis.add(csv_obj["oci"])
+
+        self.buffered += 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        for f, buffer, dw in self.files.values():
+            f.write(buffer.getvalue())
+            f.flush()
+            buffer.seek(0)
+            buffer.truncate()
+        self.buffered = 0
+
+        # The index is updated only once the related rows are actually in the files
+        if self.index is not None:
+            for oci in self.ocis:
+                self.index.add(oci)
+            self.index.commit()
+        self.ocis = set()
+
+    def close(self):
+        self.flush()
+        for f, buffer, dw in self.files.values():
+            fsync(f.fileno())
+            f.close()
+        self.files = {}
 
 
 def get_date(doi, d, m_list):
@@ -326,6 +728,186 @@ def get_date(doi, d, m_list):
     return clean_d
 
 
+def iter_input(f_path):
+    return chain(CSVManager.iter_csv(f_path, metadata=True), ScholixManager.iter_scholix(f_path))
+
+
+def collect_dois(citations, doim, ocim, exi_ocis):
+    dois = set()
+    date_dois = set()
+
+    for citation in citations:
+        citing_doi, cited_doi = doim.normalize(citation["citing_id"]), doim.normalize(citation["cited_id"])
+        if citing_doi and cited_doi and \
+                ocim.get_oci(citing_doi, cited_doi, "050").replace("oci:", "") not in exi_ocis:
+            dois.add(citing_doi)
+            dois.add(cited_doi)
+            if not get_date(citing_doi, citation["citing_publication_date"], []):
+                date_dois.add(citing_doi)
+            if not get_date(cited_doi, citation["cited_publication_date"], []):
+                date_dois.add(cited_doi)
+
+    return dois, date_dois
+
+
+def prefetch(dois, date_dois, doim, cm, dm, om, concurrency):
+    # One pool per service, so as to bound the number of concurrent requests sent to each host
+    l_dois = list(dois)
+    with ThreadPoolExecutor(concurrency) as doi_pool, ThreadPoolExecutor(concurrency) as crossref_pool, \
+            ThreadPoolExecutor(concurrency) as orcid_pool:
+        wait([doi_pool.submit(call_safely, doim.is_valid, doi) for doi in l_dois] +
+             [crossref_pool.submit(call_safely, cm.prefetch, l_dois[idx:idx + CROSSREF_BATCH_SIZE])
+              for idx in range(0, len(l_dois), CROSSREF_BATCH_SIZE)] +
+             [orcid_pool.submit(call_safely, om.get_orcid, doi) for doi in l_dois])
+
+    # DataCite is queried only for the dates that Crossref was not able to provide
+    with ThreadPoolExecutor(concurrency) as datacite_pool:
+        wait([datacite_pool.submit(call_safely, dm.get_date, doi)
+              for doi in date_dois if doim.valid.get(doi) and not cm.date.get(doi)])
+
+
+def call_safely(f, *args):
+    try:
+        return f(*args)
+    except Exception:  # Errors are raised again when the same data are requested during the ingestion
+        return None
+
+
+def create_managers(args):
+    cache = None
+    if args.cache:
+        print("Open the cache")
+        cache = ResponseCache(args.cache, {s: int(d) * DAY for s, d in (t.split(":") for t in args.cache_ttl)},
+                              max_size=args.cache_size)
+
+    session = HTTPSession(pool_size=max(10, args.concurrency))
+
+    print("Create the DOI Manager")
+    doim = DOIManager(cache, session)
+
+    print("Create the Crossref Manager")
+    cm = CrossrefManager(cache, session, args.crossref_api)
+
+    print("Create the DataCite Manager")
+    dm = DataCiteManager(cache, session)
+
+    print("Create the ORCID Manager")
+    om = ORCIDManager(args.orcid, [cm], cache, session)
+
+    return cache, session, doim, cm, dm, om
+
+
+def process_citations(citations, rejected, doim, cm, dm, om, ocim, cur_time, writer, counter):
+    for new_citation, new_meta in citations:
+        counter["all"] += 1
+        try:
+            process_citation(new_citation, new_meta, rejected, doim, cm, dm, om, ocim, cur_time, writer, counter)
+        except Exception as e:
+            print(e)
+
+
+def process_citation(new_citation, new_meta, rejected, doim, cm, dm, om, ocim, cur_time, writer, counter):
+    # The citations already stored are known by the writer, while those rejected since their DOIs do not exist
+    # are kept in 'rejected', so that any duplicate is reported as already processed
+    citing_doi, cited_doi = \
+        doim.normalize(new_citation["citing_id"]), doim.normalize(new_citation["cited_id"])
+    if citing_doi and cited_doi:
+        oci = ocim.get_oci(citing_doi, cited_doi, "050").replace("oci:", "")
+        if oci not in rejected and oci not in writer:
+            if doim.is_valid(citing_doi) and doim.is_valid(cited_doi):
+                print("Create citation data for 'oci:%s' between DOI '%s' and DOI '%s', from '%s'" %
+                      (oci, citing_doi, cited_doi, new_meta["source"]))
+                citing_pub_date, cited_pub_date = \
+                    get_date(citing_doi, new_citation["citing_publication_date"], [cm, dm]), \
+                    get_date(cited_doi, new_citation["cited_publication_date"], [cm, dm])
+                cit = Citation(oci,
+                               BASE_URL + quote(citing_doi), citing_pub_date,
+                               BASE_URL + quote(cited_doi), cited_pub_date,
+                               None, None,
+                               new_meta["agent"], new_meta["source"], cur_time,
+                               "CROCI", "doi", BASE_URL + "([[XXX__decode]])", "reference",
+                               cm.share_issn(citing_doi, cited_doi),
+                               om.share_orcid(citing_doi, cited_doi))
+
+                # Store in CSV and RDF
+                writer.store_row(cit.as_row(), cit.get_citation_nt(CROCI_BASE, False, False, False))
+                writer.store_row(cit.as_prov_row(), cit.get_citation_prov_nt(CROCI_BASE), True)
+                counter["new"] += 1
+            else:
+                print("WARNING: some DOIs, among '%s' and '%s', do not exist" % (citing_doi, cited_doi))
+                rejected.add(oci)
+                counter["existence"] += 1
+        else:
+            print("WARNING: the citation between DOI '%s' and DOI '%s' has been already processed" %
+                  (citing_doi, cited_doi))
+            counter["present"] += 1
+    else:
+        print("WARNING: some DOIs, among '%s' and '%s', is syntactically incorrect" %
+              (citing_doi, cited_doi))
+        counter["syntax"] += 1
+
+
+def split_input(inputs, shards, doim, ocim, counter):
+    for f in inputs:
+        print("\nSplitting the citations in '%s'" % f)
+        positions = [shard.tell() for shard in shards]
+        f_counter = Counter()
+        try:
+            for new_citation, new_meta in iter_input(f):
+                citing_doi, cited_doi = \
+                    doim.normalize(new_citation["citing_id"]), doim.normalize(new_citation["cited_id"])
+                if citing_doi and cited_doi:
+                    oci = ocim.get_oci(citing_doi, cited_doi, "050").replace("oci:", "")
+                    shards[crc32(oci.encode("utf-8")) % len(shards)].write(dumps([new_citation, new_meta]) + "\n")
+                else:
+                    print("WARNING: some DOIs, among '%s' and '%s', is syntactically incorrect" %
+                          (citing_doi, cited_doi))
+                    f_counter["all"] += 1
+                    f_counter["syntax"] += 1
+        except Exception as e:  # e.g. errors in reading the input files
+            print(e)
+            # The citations of the file already split are removed from the shards
+            for shard, position in zip(shards, positions):
+                shard.seek(position)
+                shard.truncate()
+        else:
+            counter.update(f_counter)
+
+
+def iter_shard(shard_path):
+    with open(shard_path) as f:
+        for line in f:
+            citation, meta = loads(line)
+            yield citation, meta
+
+
+def process_shard(shard_path, o, cur_time, index_path, args):
+    exi_ocis = CSVManager.open_index(o, index_path, False, args.index_format, not args.no_filter, True)
+    cache, session, doim, cm, dm, om = create_managers(args)
+    ocim = OCIManager(lookup_file=args.lookup)
+
+    if args.concurrency > 0:
+        dois, date_dois = collect_dois((citation for citation, meta in iter_shard(shard_path)), doim, ocim, exi_ocis)
+        prefetch(dois, date_dois, doim, cm, dm, om, args.concurrency)
+
+    counter = Counter()
+    # Each shard is written in its own directory and does not update the index, since the outputs
+    # of all the shards are merged (and indexed) by the main process. The OCIs of the shard are kept
+    # in a temporary index of their own
+    makedirs(o, exist_ok=True)
+    new_ocis = OCIIndex(dirname(o) + sep + "new_oci.db")
+    with DataWriter(o, cur_time, args.buffer_size, new_ocis, exi_ocis) as writer:
+        process_citations(iter_shard(shard_path), set(), doim, cm, dm, om, ocim, cur_time, writer, counter)
+
+    new_ocis.close()
+    exi_ocis.close()
+    session.close()
+    if cache is not None:
+        cache.close()
+
+    return counter
+
+
 if __name__ == "__main__":
     arg_parser = ArgumentParser("cnc.py (Create New Citations",
                                 description="This tool allows one to take a four column CSV file describing"
@@ -335,97 +917,122 @@ if __name__ == "__main__":
                                             "final CSV file.")
 
     arg_parser.add_argument("-i", "--input", required=True, nargs="+",
-                            help="The input CSV with new citation data.")
+                            help="The input CSV (or Scholix) files with new citation data.")
     arg_parser.add_argument("-d", "--data", required=True,
                             help="The directory containing all the CSV files already added in CROCI.")
     arg_parser.add_argument("-o", "--orcid", default=None,
                             help="ORCID API key to be used to query them.")
     arg_parser.add_argument("-l", "--lookup", required=True,
                             help="The lookup table for producing OCIs.")
+    arg_parser.add_argument("-x", "--index", default=None,
+                            help="The file containing the index of the OCIs already added in CROCI. If it does not "
+                                 "exist, it is created from the CSV files in the data directory. By default, it is "
+                                 "the file 'oci.db' (or 'oci.table') in the data directory.")
+    arg_parser.add_argument("-f", "--index_format", default="sqlite", choices=sorted(INDEX_FORMATS),
+                            help="The format of the index: an SQLite database ('sqlite', default, file 'oci.db'), "
+                                 "or a sorted binary table memory-mapped at start ('table', file 'oci.table'), "
+                                 "which uses less memory and disk space.")
+    arg_parser.add_argument("-r", "--rebuild_index", default=False, action="store_true",
+                            help="Rebuild the index of the OCIs from the CSV files in the data directory.")
+    arg_parser.add_argument("-n", "--no_filter", default=False, action="store_true",
+                            help="Do not use the Bloom filter of the OCIs (file '<index>.bloom', created next to "
+                                 "the index) that avoids querying the index for most of the new citations.")
+    arg_parser.add_argument("-k", "--cache", default=None,
+                            help="The file where to keep, across runs, the data retrieved from the DOI, Crossref, "
+                                 "DataCite and ORCID services.")
+    arg_parser.add_argument("-t", "--cache_ttl", default=[], nargs="+",
+                            help="The time to live, in days, of the cached data of each service, expressed as "
+                                 "'service:days' (services: doi, crossref, datacite, orcid).")
+    arg_parser.add_argument("-m", "--cache_size", default=DEFAULT_MAX_SIZE, type=int,
+                            help="The maximum number of items to keep in the cache.")
+    arg_parser.add_argument("-a", "--crossref_api", default=CROSSREF_API,
+                            help="The base URL of the Crossref REST API.")
+    arg_parser.add_argument("-b", "--buffer_size", default=BUFFER_SIZE, type=int,
+                            help="The number of rows to keep in memory before writing them in the output files.")
+    arg_parser.add_argument("-c", "--concurrency", default=0, type=int,
+                            help="If greater than zero, all the DOIs of the new citations are collected from the "
+                                 "input files and checked and enriched with metadata in advance, using at most the "
+                                 "specified number of concurrent requests per service.")
+    arg_parser.add_argument("-w", "--workers", default=1, type=int,
+                            help="The number of processes among which the new citations are split (according to "
+                                 "their OCIs) and processed in parallel.")
 
     args = arg_parser.parse_args()
 
-    print("Retrieve new citation data")
-    exi_citations = CSVManager.list_citations(CSVManager.open_csv(args.data))
+    print("Open the index of existing citation data")
+    exi_ocis = CSVManager.open_index(args.data, args.index, args.rebuild_index, args.index_format, not args.no_filter)
 
-    print("Retrieve existing citation data")
-    exi_ocis = CSVManager.create_set_from_csv(exi_citations, "oci")
-
-    print("Create the DOI Manager")
-    doim = DOIManager()
-
-    print("Create the Crossref Manager")
-    cm = CrossrefManager()
-
-    print("Create the DataCite Manager")
-    dm = DataCiteManager()
-
-    print("Create the ORCID Manager")
-    om = ORCIDManager(args.orcid, [cm])
+    cache, session, doim, cm, dm, om = create_managers(args)
 
     print("Create the OCI Manager")
     ocim = OCIManager(lookup_file=args.lookup)
     cur_time = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
-    citations_already_present = 0
-    new_citations_added = 0
-    error_in_dois_syntax = 0
-    error_in_dois_existence = 0
-    all_citations = 0
+    counter = Counter()
 
-    for f in args.input:
+    if args.workers > 1:
+        tmp_dir = mkdtemp(prefix="cnc_", dir=args.data + sep + "..")
+        shard_paths = [tmp_dir + sep + str(idx) + ".jsonl" for idx in range(args.workers)]
+        shard_dirs = [tmp_dir + sep + str(idx) + sep + "data" for idx in range(args.workers)]
         try:
-            if isdir(f):
-                print("\nProcessing files in '%s'" % f)
-            else:
-                print("\nProcessing file '%s'" % f)
-            all_new_citations = CSVManager.open_csv(f, metadata=True)
-            for new_citations, new_meta in all_new_citations:
-                all_citations += len(new_citations)
-                for new_citation in new_citations:
-                    citing_doi, cited_doi = \
-                        doim.normalize(new_citation["citing_id"]), doim.normalize(new_citation["cited_id"])
-                    if citing_doi and cited_doi:
-                        oci = ocim.get_oci(citing_doi, cited_doi, "050").replace("oci:", "")
-                        if oci not in exi_ocis:
-                            exi_ocis.add(oci)
-                            if doim.is_valid(citing_doi) and doim.is_valid(cited_doi):
-                                print("Create citation data for 'oci:%s' between DOI '%s' and DOI '%s', from '%s'" %
-                                      (oci, citing_doi, cited_doi, new_meta["source"]))
-                                citing_pub_date, cited_pub_date = \
-                                    get_date(citing_doi, new_citation["citing_publication_date"], [cm, dm]), \
-                                    get_date(cited_doi, new_citation["cited_publication_date"], [cm, dm])
-                                cit = Citation(oci,
-                                               BASE_URL + quote(citing_doi), citing_pub_date,
-                                               BASE_URL + quote(cited_doi), cited_pub_date,
-                                               None, None,
-                                               new_meta["agent"], new_meta["source"], cur_time,
-                                               "CROCI", "doi", BASE_URL + "([[XXX__decode]])", "reference",
-                                               cm.share_issn(citing_doi, cited_doi),
-                                               om.share_orcid(citing_doi, cited_doi))
-
-                                # Store in CSV and RDF
-                                cit_json = loads(cit.get_citation_json())
-                                cit_rdf = cit.get_citation_rdf(CROCI_BASE, False, False, False)
-                                cit_json_prov = loads(cit.get_citation_json_prov())
-                                cit_rdf_prov = cit.get_citation_prov_rdf(CROCI_BASE)
-                                CSVManager.store_row(args.data, cur_time, cit_json, cit_rdf)
-                                CSVManager.store_row(args.data, cur_time, cit_json_prov, cit_rdf_prov, True)
-                                new_citations_added += 1
-                            else:
-                                print("WARNING: some DOIs, among '%s' and '%s', do not exist" % (citing_doi, cited_doi))
-                                error_in_dois_existence += 1
-                        else:
-                            print("WARNING: the citation between DOI '%s' and DOI '%s' has been already processed" %
-                                  (citing_doi, cited_doi))
-                            citations_already_present += 1
-                    else:
-                        print("WARNING: some DOIs, among '%s' and '%s', is syntactically incorrect" %
-                              (citing_doi, cited_doi))
-                        error_in_dois_syntax += 1
-        except Exception as e:
-            print(e.message)
-
+            # The citations with the same OCI always go in the same shard, so duplicates are detected exactly
+            shards = [open(shard_path, "w") for shard_path in shard_paths]
+            split_input(args.input, shards, doim, ocim, counter)
+            for shard in shards:
+                shard.close()
+
+            print("\nProcessing the citations with %s workers" % args.workers)
+            with ProcessPoolExecutor(args.workers) as pool:
+                for shard_counter in pool.map(process_shard, shard_paths, shard_dirs, [cur_time] * args.workers,
+                                              [exi_ocis.path] * args.workers, [args] * args.workers):
+                    counter.update(shard_counter)
+
+            print("Merge the outputs of the workers")
+            for shard_dir in shard_dirs:
+                CSVManager.merge_output(shard_dir, args.data, cur_time)
+            # A single update for all the shards, since each update of a table rewrites it entirely
+            exi_ocis.update(chain.from_iterable(
+                CSVManager.iter_output_ocis(shard_dir, cur_time) for shard_dir in shard_dirs))
+        finally:
+            rmtree(tmp_dir)
+    else:
+        if args.concurrency > 0:
+            print("Prefetch DOI data")
+            all_dois = set()
+            all_date_dois = set()
+            for f in args.input:
+                try:
+                    f_dois, f_date_dois = collect_dois(
+                        (citation for citation, meta in iter_input(f)), doim, ocim, exi_ocis)
+                    all_dois.update(f_dois)
+                    all_date_dois.update(f_date_dois)
+                except Exception:
+                    # The DOIs of this file are not prefetched, and the error is reported when processing it
+                    pass
+            prefetch(all_dois, all_date_dois, doim, cm, dm, om, args.concurrency)
+
+        rejected = set()
+        with DataWriter(args.data, cur_time, args.buffer_size, exi_ocis) as writer:
+            for f in args.input:
+                if isdir(f):
+                    print("\nProcessing files in '%s'" % f)
+                else:
+                    print("\nProcessing file '%s'" % f)
+                try:
+                    process_citations(iter_input(f), rejected, doim, cm, dm, om, ocim, cur_time, writer, counter)
+                except Exception as e:  # e.g. errors in reading the input files
+                    print(e)
+
+    exi_ocis.close()
+    session.close()
+    if cache is not None:
+        cache.close()
+
+    print("Store the manifest of the files created")
+    ManifestManager.store(args.data, cur_time, CSVManager.get_run_files(args.data, cur_time), counter)
+
+    new_citations_added, citations_already_present, error_in_dois_syntax, error_in_dois_existence, all_citations = \
+        counter["new"], counter["present"], counter["syntax"], counter["existence"], counter["all"]
     print("\n# Summary\nNumber of new citations added: %s\nNumber of citations already present in CROCI: %s\nNumber "
           "of citations not added due to a wrong DOI specification: %s (syntax error) and %s (not found "
           "error)\nNumber of citations not processed due to an exception: %s" %
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from argparse import ArgumentParser
+from csv import reader, writer
+from datetime import datetime
+from heapq import merge
+from json import dump
+from re import compile
+from os import walk, sep, makedirs, remove, rmdir, replace, fsync, listdir
+from os.path import exists, isdir, abspath, dirname
+from tempfile import mkdtemp
+from shutil import rmtree, move
+import gzip
+from script.manifest import ManifestManager
+
+SHARD_SIZE = 1000000
+RUN_SIZE = 1000000
+COMPACTED_DIR = "compacted"
+INDEX_FILE = "index.json"
+OCI_IN_IRI = compile("^<[^>]*/(?:ci/|id/ci-)([0-9]+-[0-9]+)>")
+
+
+def open_text(f_path, mode="r", encoding=None):
+    # The compacted shards are compressed with gzip, while the files written by cnc.py are plain text
+    if f_path.endswith(".gz"):
+        return gzip.open(f_path, mode + "t", encoding=encoding)
+    else:
+        return open(f_path, mode, encoding=encoding)
+
+
+def get_paths(fd_path, extension):
+    f_paths = []
+    for cur_dir, cur_subdir, cur_files in walk(fd_path):
+        cur_subdir.sort()
+        for cur_file in sorted(cur_files):
+            if cur_file.endswith(extension) or cur_file.endswith(extension + ".gz"):
+                f_paths.append(cur_dir + sep + cur_file)
+    return f_paths
+
+
+class CSVFormat(object):
+    extension = ".csv"
+    newline = ""
+
+    def __init__(self):
+        self.header = None
+        self.oci_idx = None
+
+    def iter_records(self, f_path):
+        with open_text(f_path) as f:
+            rows = reader(f)
+            header = next(rows, None)
+            if header is not None:
+                if self.header is None:
+                    self.header = header
+                    self.oci_idx = header.index("oci")
+                elif header != self.header:
+                    raise ValueError("The file '%s' has an header different from the other files." % f_path)
+                for row in rows:
+                    yield row
+
+    def get_key(self, record):
+        # Identical records are adjacent once sorted, and only one of them is kept
+        return record[self.oci_idx], record
+
+    def write_header(self, f):
+        writer(f).writerow(self.header)
+
+    @staticmethod
+    def read_run(f):
+        return reader(f)
+
+    @staticmethod
+    def write_records(f, records):
+        writer(f).writerows(records)
+
+
+class NTFormat(object):
+    extension = ".ttl"
+    newline = None
+
+    @staticmethod
+    def iter_records(f_path):
+        with open_text(f_path) as f:
+            for line in f:
+                if line.strip():
+                    yield line if line.endswith("\n") else line + "\n"
+
+    @staticmethod
+    def get_key(record):
+        # The triples are sorted by the OCI of the citation (or of its identifier) they describe
+        oci_match = OCI_IN_IRI.match(record)
+        return oci_match.group(1) if oci_match else "", record
+
+    @staticmethod
+    def write_header(f):
+        pass
+
+    @staticmethod
+    def read_run(f):
+        return f
+
+    @staticmethod
+    def write_records(f, records):
+        f.writelines(records)
+
+
+def sort_runs(f_paths, f_format, tmp_dir, run_size):
+    # External sort: the records are sorted in runs of at most run_size records, stored in temporary files
+    run_paths = []
+    buffer = []
+
+    def store_run():
+        buffer.sort(key=f_format.get_key)
+        run_path = tmp_dir + sep + "run_%s" % len(run_paths)
+        with open(run_path, "w", newline=f_format.newline) as f:
+            f_format.write_records(f, buffer)
+        run_paths.append(run_path)
+        buffer.clear()
+
+    for f_path in f_paths:
+        for record in f_format.iter_records(f_path):
+            buffer.append(record)
+            if len(buffer) >= run_size:
+                store_run()
+    if buffer:
+        store_run()
+
+    return run_paths
+
+
+def write_shards(run_paths, f_format, out_dir, shard_size):
+    shards = []
+    run_files = [open(run_path, newline=f_format.newline) for run_path in run_paths]
+    try:
+        shard = None
+        previous = None
+        for record in merge(*[f_format.read_run(f) for f in run_files], key=f_format.get_key):
+            if record == previous:
+                continue
+            previous = record
+
+            if shard is None or shard["rows"] >= shard_size:
+                if shard is not None:
+                    shard_file.close()
+                shard = {"path": "%06d%s.gz" % (len(shards), f_format.extension), "first": None, "rows": 0}
+                shards.append(shard)
+                shard_file = gzip.open(out_dir + sep + shard["path"], "wt", newline=f_format.newline)
+                f_format.write_header(shard_file)
+
+            oci = f_format.get_key(record)[0]
+            if shard["first"] is None:
+                shard["first"] = oci
+            shard["last"] = oci
+            shard["rows"] += 1
+            f_format.write_records(shard_file, (record,))
+
+        if shard is not None:
+            shard_file.close()
+    finally:
+        for f in run_files:
+            f.close()
+
+    return shards
+
+
+def compact(fd_path, f_format, shard_size=SHARD_SIZE, run_size=RUN_SIZE, keep=False, tmp_dir=None):
+    # All the files (including the shards of previous compactions) are merged into a new set of shards, stored in
+    # 'compacted/<time>' together with the index of the OCIs they contain, and then removed. The temporary files
+    # are stored outside the directory compacted (by default, in the temporary directory of the system)
+    compacted_path = fd_path + sep + COMPACTED_DIR
+    f_paths = get_paths(fd_path, f_format.extension)
+    if not f_paths:
+        return None
+    old_index_paths = get_paths(compacted_path, INDEX_FILE) if exists(compacted_path) else []
+
+    t = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    tmp_dir = mkdtemp(prefix="compact_", dir=tmp_dir)
+    try:
+        print("Sorting %s files in '%s'" % (len(f_paths), fd_path))
+        run_paths = sort_runs(f_paths, f_format, tmp_dir, run_size)
+
+        out_dir = tmp_dir + sep + "shards"
+        makedirs(out_dir)
+        shards = write_shards(run_paths, f_format, out_dir, shard_size)
+
+        if not exists(compacted_path):
+            makedirs(compacted_path)
+        gen_path = compacted_path + sep + t
+        move(out_dir, gen_path)
+        # The index is written last, since it marks the compaction as complete
+        index_path = gen_path + sep + INDEX_FILE
+        with open(index_path + ".tmp", "w") as f:
+            dump({"time": t, "shards": shards}, f, indent=4)
+            f.flush()
+            fsync(f.fileno())
+        replace(index_path + ".tmp", index_path)
+    finally:
+        rmtree(tmp_dir)
+
+    print("%s records stored in %s shards in '%s'" % (sum(shard["rows"] for shard in shards), len(shards), gen_path))
+
+    if not keep:
+        # The manifests written by cnc.py in the directory 'manifest' next to the data directory stop listing the
+        # files removed, whose records are now in the new shards
+        manifest_dir = ManifestManager.get_manifest_dir(dirname(abspath(fd_path)))
+        m_paths = ManifestManager.remove_files(manifest_dir, f_paths)
+        if m_paths:
+            print("%s manifests in '%s' updated" % (len(m_paths), manifest_dir))
+        for f_path in f_paths + old_index_paths:
+            remove(f_path)
+        remove_empty_dirs(fd_path)
+
+    return gen_path
+
+
+def remove_empty_dirs(fd_path):
+    for cur_dir, cur_subdir, cur_files in walk(fd_path, topdown=False):
+        if cur_dir != fd_path and not listdir(cur_dir):
+            rmdir(cur_dir)
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser("compact.py", description="Merge the CSV and N-Triples files created by cnc.py in "
+                                                          "a directory into a few gzip-compressed shards sorted by "
+                                                          "OCI. It must not run while cnc.py is adding citations.")
+    arg_parser.add_argument("-i", "--input", required=True, nargs="+",
+                            help="The data and/or provenance directories to compact.")
+    arg_parser.add_argument("-s", "--shard_size", default=SHARD_SIZE, type=int,
+                            help="The maximum number of rows (or triples) in each shard.")
+    arg_parser.add_argument("-r", "--run_size", default=RUN_SIZE, type=int,
+                            help="The maximum number of rows (or triples) sorted in memory at the same time.")
+    arg_parser.add_argument("-k", "--keep", default=False, action="store_true",
+                            help="Keep the original files after the compaction.")
+    arg_parser.add_argument("-t", "--tmp_dir", default=None,
+                            help="The directory where to store the temporary files, outside the directories "
+                                 "to compact (default: the temporary directory of the system).")
+
+    args = arg_parser.parse_args()
+
+    for fd_path in args.input:
+        for sub_dir, f_format in (("csv", CSVFormat()), ("rdf", NTFormat())):
+            if isdir(fd_path + sep + sub_dir):
+                compact(fd_path + sep + sub_dir, f_format, args.shard_size, args.run_size, args.keep,
+                        args.tmp_dir)
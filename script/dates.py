@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from datetime import datetime, date, timedelta
+from calendar import monthrange
+from functools import lru_cache
+from re import compile
+from dateutil.relativedelta import relativedelta
+from dateutil.parser import parse
+
+
+DEFAULT_DATE = datetime(1970, 1, 1, 0, 0)
+DATE_CACHE_SIZE = 100000
+ISO_DATE = compile("^([1-9][0-9]{3})(?:-([0-9]{2})(?:-([0-9]{2}))?)?$")
+DURATION = compile("^-?P([0-9]+Y)?([0-9]+M)?([0-9]+D)?$")
+
+
+class DateManager(object):
+    @staticmethod
+    def parse_iso(date_string):
+        # A 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' date, with the missing month and day taken from DEFAULT_DATE as
+        # dateutil does; anything else (or an invalid date) is left to dateutil
+        date_match = ISO_DATE.match(date_string)
+        if date_match:
+            year, month, day = date_match.groups()
+            try:
+                return date(int(year), int(month) if month else DEFAULT_DATE.month,
+                            int(day) if day else DEFAULT_DATE.day)
+            except ValueError:
+                pass
+
+    @staticmethod
+    def add_months(d, months):
+        # The same as adding relativedelta(months=months) to a date, i.e. clamping the day to the end of the month
+        year, month = divmod(d.year * 12 + d.month - 1 + months, 12)
+        month += 1
+        return d.replace(year=year, month=month, day=min(d.day, monthrange(year, month)[1]))
+
+    @staticmethod
+    def get_delta(d1, d2):
+        # The years, months and days of relativedelta(d1, d2), following the same algorithm
+        months = (d1.year - d2.year) * 12 + (d1.month - d2.month)
+        shifted = DateManager.add_months(d2, months)
+        increment = 1 if d1 < d2 else -1
+        while (d1 > shifted) if d1 < d2 else (d1 < shifted):
+            months += increment
+            shifted = DateManager.add_months(d2, months)
+
+        sign = -1 if months < 0 else 1
+        years, months = divmod(months * sign, 12)
+        return years * sign, months * sign, (d1 - shifted).days
+
+    @staticmethod
+    def format_duration(years, months, days, consider_months, consider_days):
+        result = ""
+        if years < 0 or \
+                (years == 0 and months < 0 and consider_months) or \
+                (years == 0 and months == 0 and days < 0 and consider_days):
+            result += "-"
+        result += "P%sY" % abs(years)
+
+        if consider_months:
+            result += "%sM" % abs(months)
+
+        if consider_days:
+            result += "%sD" % abs(days)
+
+        return result
+
+    @staticmethod
+    @lru_cache(maxsize=DATE_CACHE_SIZE)
+    def get_duration(citing_pub_date, cited_pub_date):
+        # The timespan between the publication of the citing and cited entities, both specifying at least the year
+        citing_contains_months = len(citing_pub_date) >= 7
+        cited_contains_months = len(cited_pub_date) >= 7
+        citing_contains_days = len(citing_pub_date) >= 10
+        cited_contains_days = len(cited_pub_date) >= 10
+
+        # Handling incomplete dates
+        citing_complete_pub_date = citing_pub_date[:10]
+        cited_complete_pub_date = cited_pub_date[:10]
+        if citing_contains_months and not cited_contains_months:
+            cited_complete_pub_date += citing_pub_date[4:7]
+        elif not citing_contains_months and cited_contains_months:
+            citing_complete_pub_date += cited_pub_date[4:7]
+        if citing_contains_days and not cited_contains_days:
+            cited_complete_pub_date += citing_pub_date[7:]
+        elif not citing_contains_days and cited_contains_days:
+            citing_complete_pub_date += cited_pub_date[7:]
+
+        citing_pub_datetime = DateManager.parse_iso(citing_complete_pub_date)
+        cited_pub_datetime = DateManager.parse_iso(cited_complete_pub_date)
+        if citing_pub_datetime is not None and cited_pub_datetime is not None:
+            years, months, days = DateManager.get_delta(citing_pub_datetime, cited_pub_datetime)
+        else:
+            delta = relativedelta(parse(citing_complete_pub_date, default=DEFAULT_DATE),
+                                  parse(cited_complete_pub_date, default=DEFAULT_DATE))
+            years, months, days = delta.years, delta.months, delta.days
+
+        return DateManager.format_duration(
+            years, months, days,
+            citing_contains_months and cited_contains_months,
+            citing_contains_days and cited_contains_days)
+
+    @staticmethod
+    @lru_cache(maxsize=DATE_CACHE_SIZE)
+    def get_date(creation_date, duration):
+        # The publication date of the cited entity, obtained by subtracting the timespan from the creation date
+        years, months, days = (int(item[:-1]) if item else 0 for item in DURATION.findall(duration)[0])
+        if duration.startswith("-"):
+            sign = 1
+        else:
+            sign = -1
+
+        d = DateManager.parse_iso(creation_date)
+        result = None
+        if d is not None:
+            try:
+                result = DateManager.add_months(d, sign * (years * 12 + months)) + timedelta(days=sign * days)
+            except (ValueError, OverflowError):
+                result = None  # Out of the supported range, handled by dateutil as before
+        if result is None:
+            delta = relativedelta(years=years, months=months, days=days)
+            d = parse(creation_date, default=DEFAULT_DATE)
+            result = d + delta if sign > 0 else d - delta
+
+        if "D" in duration or len(creation_date) >= 10:
+            cut = 10
+        elif "M" in duration or len(creation_date) >= 7:
+            cut = 7
+        else:
+            cut = 4
+
+        return result.strftime('%Y-%m-%d')[:cut]
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from json import load, dump
+from hashlib import sha256
+from datetime import datetime
+from os import makedirs, replace, fsync, listdir, sep
+from os.path import abspath, exists, relpath, join, dirname
+
+MANIFEST_DIR = "manifest"
+READ_SIZE = 1048576
+
+
+class ManifestManager(object):
+    # Each run of cnc.py lists the files it has written in a JSON manifest, stored in the directory 'manifest'
+    # next to the data directory, so that the following steps can process only the files added since a given run
+    @staticmethod
+    def get_manifest_dir(o):
+        return abspath(o + sep + ".." + sep + MANIFEST_DIR)
+
+    @staticmethod
+    def get_file_info(f_path, has_header=False):
+        checksum = sha256()
+        lines = 0
+        size = 0
+        with open(f_path, "rb") as f:
+            for block in iter(lambda: f.read(READ_SIZE), b""):
+                checksum.update(block)
+                lines += block.count(b"\n")
+                size += len(block)
+
+        return {"rows": max(lines - 1, 0) if has_header else lines, "bytes": size, "sha256": checksum.hexdigest()}
+
+    @staticmethod
+    def store(o, t, files, summary=None):
+        manifest_dir = ManifestManager.get_manifest_dir(o)
+        if not exists(manifest_dir):
+            makedirs(manifest_dir)
+
+        manifest = {
+            "time": t,
+            "created": datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            "summary": {} if summary is None else dict(summary),
+            "files": []
+        }
+        for f_path, has_header in files:
+            entry = {"path": relpath(abspath(f_path), dirname(manifest_dir)).replace(sep, "/")}
+            entry.update(ManifestManager.get_file_info(f_path, has_header))
+            manifest["files"].append(entry)
+
+        m_path = manifest_dir + sep + t + ".json"
+        ManifestManager.__write(m_path, manifest)
+
+        return m_path
+
+    @staticmethod
+    def __write(m_path, manifest):
+        # The manifest is written in a temporary file and then renamed, so that readers never see it incomplete
+        tmp_path = m_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            dump(manifest, f, indent=4)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp_path, m_path)
+
+    @staticmethod
+    def remove_files(manifest_dir, f_paths):
+        # The files about to be removed (e.g. by compact.py) are moved from the list of the files of the manifests
+        # to the one of the files removed, so that the following steps do not look for them
+        removed = set(abspath(f_path) for f_path in f_paths)
+        m_paths = []
+        if exists(manifest_dir):
+            for m_file in sorted(listdir(manifest_dir)):
+                if m_file.endswith(".json"):
+                    m_path = manifest_dir + sep + m_file
+                    with open(m_path) as f:
+                        manifest = load(f)
+                    files = []
+                    for entry in manifest["files"]:
+                        if ManifestManager.get_path(manifest_dir, entry) in removed:
+                            manifest.setdefault("removed", []).append(entry["path"])
+                        else:
+                            files.append(entry)
+                    if len(files) < len(manifest["files"]):
+                        manifest["files"] = files
+                        ManifestManager.__write(m_path, manifest)
+                        m_paths.append(m_path)
+
+        return m_paths
+
+    @staticmethod
+    def get_path(manifest_dir, entry):
+        return abspath(join(dirname(abspath(manifest_dir)), *entry["path"].split("/")))
+
+    @staticmethod
+    def iter_manifests(manifest_dir, since=None):
+        # The manifests of the runs following the one at time 'since' (excluded), from the oldest one
+        manifests = []
+        if exists(manifest_dir):
+            for m_file in listdir(manifest_dir):
+                if m_file.endswith(".json"):
+                    with open(manifest_dir + sep + m_file) as f:
+                        manifest = load(f)
+                    if since is None or manifest["time"] > since:
+                        manifests.append(manifest)
+
+        return sorted(manifests, key=lambda manifest: manifest["time"])
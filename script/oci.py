@@ -15,28 +15,30 @@
 # SOFTWARE.
 
 from argparse import ArgumentParser
-from re import match, findall, sub
+from re import match, findall, sub, compile
 from urllib.parse import quote, unquote
 from csv import DictReader
 from rdflib import Graph, RDF, RDFS, XSD, URIRef, Literal, Namespace
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-from dateutil.parser import parse
 from json import dumps, load, loads, JSONDecodeError
 from csv import DictWriter
 from io import StringIO
-from SPARQLWrapper import SPARQLWrapper, JSON
 from os.path import exists
 from collections import deque
-from requests import get
 from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, chain
+from functools import lru_cache, partial
+from sys import byteorder
+from script.session import DEFAULT_SESSION
+from script.dates import DateManager, DEFAULT_DATE
+from script.sparql import DEFAULT_SPARQL, SPARQL_BATCH_SIZE, BatchQuery
 
 
 REFERENCE_CITATION_TYPE = "reference"
 SUPPLEMENT_CITATION_TYPE = "supplement"
 DEFAULT_CITATION_TYPE = REFERENCE_CITATION_TYPE
 CITATION_TYPES = (REFERENCE_CITATION_TYPE, SUPPLEMENT_CITATION_TYPE)
-DEFAULT_DATE = datetime(1970, 1, 1, 0, 0)
 AGENT_NAME = "OpenCitations"
 USER_AGENT = "OCI / %s (via OpenCitations - http://opencitations.net; mailto:contact@opencitations.net)" % AGENT_NAME
 URL = "https://github.com/opencitations/oci/blob/master/oci.py"
@@ -45,7 +47,29 @@ W = "WARNING"
 E = "ERROR"
 I = "INFO"
 PREFIX_REGEX = "0[1-9]+0"
+INVALID_URI_CHARS = '<>" {}|\\^`'
 VALIDATION_REGEX = "^%s[0-9]+$" % PREFIX_REGEX
+RESOLVER_BATCH_SIZE = 1000
+ACCESS_CACHE_SIZE = 10000
+FUNCTION_CALL = compile("^([^\\(]+)\\((.*)\\)$")
+FUNCTION_PARTS = compile("([^\\(]+)\\((.*)\\)")
+INDEX_ACCESS = compile("\\[[0-9]+\\]")
+INDEX_VALUE = compile("\\[([0-9]+)\\]")
+FILTER_ACCESS = compile("^\\[(.+)\\]$")
+CITING_PLACEHOLDER = compile("\\[\\[CITING\\]\\]")
+CITED_PLACEHOLDER = compile("\\[\\[CITED\\]\\]")
+SPACES = compile("\\s+")
+PLAIN_TAG = compile("[A-Za-z0-9_\\-]+")
+CODE = compile("(9*[0-8][0-9])")
+ID_SHAPE_PLACEHOLDER = compile("\\[\\[[^\\]]+\\]\\]")
+SEPARATOR = "\n"
+UNKNOWN = b"x"
+CODE_OR_SEPARATOR = compile("9*[0-8][0-9]|%s" % SEPARATOR)
+CSV_FIELDS = ["oci", "citing", "cited", "creation", "timespan", "journal_sc", "author_sc"]
+CSV_PROV_FIELDS = ["oci", "agent", "source", "datetime"]
+AUTHOR_SC = 1
+JOURNAL_SC = 2
+QUERY_FIELDS = ("citing", "cited", "citing_date", "cited_date", "creation", "timespan")
 FORMATS = {
     "xml": "xml",
     "rdfxml": "xml",
@@ -99,6 +123,11 @@ class Citation(object):
     __had_primary_source = URIRef(__prov_base + "hadPrimarySource")
     __generated_at_time = URIRef(__prov_base + "generatedAtTime")
 
+    # The citations are immutable records, whose attributes are stored in slots instead of a dictionary
+    __slots__ = ("oci", "citing_url", "cited_url", "duration", "creation_date", "author_sc", "journal_sc",
+                 "citing_pub_date", "cited_pub_date", "citation_type", "prov_agent_url", "source", "prov_date",
+                 "service_name", "id_type", "id_shape")
+
     def __init__(self,
                  oci, citing_url, citing_pub_date,
                  cited_url, cited_pub_date,
@@ -106,58 +135,58 @@ class Citation(object):
                  prov_agent_url, source, prov_date,
                  service_name, id_type, id_shape, citation_type,
                  journal_sc=False, author_sc=False):
-        self.oci = oci
-        self.citing_url = citing_url
-        self.cited_url = cited_url
-        self.duration = timespan
-        self.creation_date = creation
-        self.author_sc = "yes" if author_sc else "no"
-        self.journal_sc = "yes" if journal_sc else "no"
-        self.citing_pub_date = citing_pub_date[:10] if citing_pub_date else citing_pub_date
-        self.cited_pub_date = cited_pub_date[:10] if cited_pub_date else cited_pub_date
-        self.citation_type = citation_type if citation_type in CITATION_TYPES else DEFAULT_CITATION_TYPE
+        citing_pub_date, cited_pub_date, creation, timespan = \
+            Citation.get_dates(citing_pub_date, cited_pub_date, creation, timespan)
+        Citation.__set_values(self, (
+            oci, citing_url, cited_url, timespan, creation,
+            "yes" if author_sc else "no", "yes" if journal_sc else "no",
+            citing_pub_date, cited_pub_date,
+            citation_type if citation_type in CITATION_TYPES else DEFAULT_CITATION_TYPE,
+            prov_agent_url, source, prov_date, service_name, id_type, id_shape))
 
-        if self.contains_years(citing_pub_date):
-            self.creation_date = citing_pub_date[:10]
-
-            if self.contains_years(cited_pub_date):
-                citing_contains_months = Citation.contains_months(citing_pub_date)
-                cited_contains_months = Citation.contains_months(cited_pub_date)
-                citing_contains_days = Citation.contains_days(citing_pub_date)
-                cited_contains_days = Citation.contains_days(cited_pub_date)
-
-                # Handling incomplete dates
-                citing_complete_pub_date = self.creation_date
-                cited_complete_pub_date = cited_pub_date[:10]
-                if citing_contains_months and not cited_contains_months:
-                    cited_complete_pub_date += citing_pub_date[4:7]
-                elif not citing_contains_months and cited_contains_months:
-                    citing_complete_pub_date += cited_pub_date[4:7]
-                if citing_contains_days and not cited_contains_days:
-                    cited_complete_pub_date += citing_pub_date[7:]
-                elif not citing_contains_days and cited_contains_days:
-                    citing_complete_pub_date += cited_pub_date[7:]
-
-                citing_pub_datetime = parse(citing_complete_pub_date, default=DEFAULT_DATE)
-                cited_pub_datetime = parse(cited_complete_pub_date, default=DEFAULT_DATE)
-                delta = relativedelta(citing_pub_datetime, cited_pub_datetime)
-                self.duration = Citation.get_duration(
-                    delta,
-                    citing_contains_months and cited_contains_months,
-                    citing_contains_days and cited_contains_days)
-
-        if not self.citing_pub_date and self.creation_date:
-            self.citing_pub_date = self.creation_date
-
-        if self.creation_date and self.duration:
-            self.cited_pub_date = Citation.get_date(self.creation_date, self.duration)
-
-        self.prov_agent_url = prov_agent_url
-        self.source = source
-        self.prov_date = prov_date
-        self.service_name = service_name
-        self.id_type = id_type
-        self.id_shape = id_shape
+    def __setattr__(self, name, value):
+        raise AttributeError("Citations are immutable, thus '%s' cannot be set." % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("Citations are immutable, thus '%s' cannot be deleted." % name)
+
+    def __reduce__(self):
+        return Citation.from_values, (self.get_values(),)
+
+    @staticmethod
+    def __set_values(citation, values):
+        for name, value in zip(Citation.__slots__, values):
+            object.__setattr__(citation, name, value)
+
+    def get_values(self):
+        return tuple(getattr(self, name) for name in Citation.__slots__)
+
+    @staticmethod
+    def from_values(values):
+        # A citation with the values of its slots already computed, e.g. as returned by get_values
+        citation = object.__new__(Citation)
+        Citation.__set_values(citation, values)
+        return citation
+
+    @staticmethod
+    def get_dates(citing_pub_date, cited_pub_date, creation, timespan):
+        # The publication dates of the citing and cited entities, the creation date and the timespan of a citation
+        citing_date = citing_pub_date[:10] if citing_pub_date else citing_pub_date
+        cited_date = cited_pub_date[:10] if cited_pub_date else cited_pub_date
+
+        if Citation.contains_years(citing_pub_date):
+            creation = citing_pub_date[:10]
+
+            if Citation.contains_years(cited_pub_date):
+                timespan = DateManager.get_duration(citing_pub_date, cited_pub_date)
+
+        if not citing_date and creation:
+            citing_date = creation
+
+        if creation and timespan:
+            cited_date = Citation.get_date(creation, timespan)
+
+        return citing_date, cited_date, creation, timespan
 
     @staticmethod
     def set_ns(g):
@@ -227,6 +256,106 @@ class Citation(object):
 
         return citation_graph, citation, citation_corpus_id
 
+    def get_citation_nt(self, baseurl, include_oci=True, include_label=True, include_prov=True):
+        citation_corpus_id = "ci/" + self.oci.replace("oci:", "")
+        citation = Citation.__nt_uri(baseurl + citation_corpus_id)
+        triples = []
+
+        if include_label:
+            triples.append((citation, Citation.__nt_uri(RDFS.label),
+                            Citation.__nt_literal("citation %s [%s]" % (self.oci, citation_corpus_id))))
+        triples.append((citation, Citation.__nt_uri(RDF.type), Citation.__nt_uri(self.__citation)))
+        if self.author_sc == "yes":
+            triples.append((citation, Citation.__nt_uri(RDF.type), Citation.__nt_uri(self.__author_self_citation)))
+        if self.journal_sc == "yes":
+            triples.append((citation, Citation.__nt_uri(RDF.type), Citation.__nt_uri(self.__journal_self_citation)))
+
+        triples.append((citation, Citation.__nt_uri(self.__has_citing_entity), Citation.__nt_uri(self.citing_url)))
+        triples.append((citation, Citation.__nt_uri(self.__has_cited_entity), Citation.__nt_uri(self.cited_url)))
+
+        if self.creation_date is not None:
+            if Citation.contains_days(self.creation_date):
+                xsd_type = XSD.date
+            elif Citation.contains_months(self.creation_date):
+                xsd_type = XSD.gYearMonth
+            else:
+                xsd_type = XSD.gYear
+
+            triples.append((citation, Citation.__nt_uri(self.__has_citation_creation_date),
+                            Citation.__nt_literal(self.creation_date, xsd_type)))
+            if self.duration is not None:
+                triples.append((citation, Citation.__nt_uri(self.__has_citation_time_span),
+                                Citation.__nt_literal(Citation.__nt_duration(self.duration), XSD.duration)))
+
+        result = Citation.__nt_rows(triples)
+
+        if include_oci:
+            result += self.get_oci_nt(baseurl, include_label, include_prov)
+
+        if include_prov:
+            result += self.get_citation_prov_nt(baseurl)
+
+        return result
+
+    def get_citation_prov_nt(self, baseurl):
+        return Citation.__nt_rows(self.__get_prov_triples(
+            Citation.__nt_uri(baseurl + "ci/" + self.oci.replace("oci:", ""))))
+
+    def get_oci_nt(self, baseurl, include_label=True, include_prov=True):
+        identifier_local_id = "ci-" + self.oci.replace("oci:", "")
+        identifier_corpus_id = "id/" + identifier_local_id
+        identifier = Citation.__nt_uri(baseurl + identifier_corpus_id)
+        triples = []
+
+        if include_label:
+            triples.append((identifier, Citation.__nt_uri(RDFS.label),
+                            Citation.__nt_literal("identifier %s [%s]" % (identifier_local_id, identifier_corpus_id))))
+        triples.append((identifier, Citation.__nt_uri(RDF.type), Citation.__nt_uri(self.__identifier)))
+        triples.append((identifier, Citation.__nt_uri(self.__uses_identifier_scheme), Citation.__nt_uri(self.__oci)))
+        triples.append((identifier, Citation.__nt_uri(self.__has_literal_value), Citation.__nt_literal(self.oci)))
+
+        if include_prov:
+            triples.extend(self.__get_prov_triples(identifier))
+
+        return Citation.__nt_rows(triples)
+
+    def __get_prov_triples(self, entity):
+        return [(entity, Citation.__nt_uri(self.__was_attributed_to), Citation.__nt_uri(self.prov_agent_url)),
+                (entity, Citation.__nt_uri(self.__had_primary_source), Citation.__nt_uri(self.source)),
+                (entity, Citation.__nt_uri(self.__generated_at_time),
+                 Citation.__nt_literal(self.prov_date, XSD.dateTime))]
+
+    @staticmethod
+    def __nt_uri(uri):
+        # Same check done by rdflib when serialising URIs
+        if any(c in uri for c in INVALID_URI_CHARS):
+            raise ValueError("'%s' does not look like a valid URI, it cannot be serialised in N-Triples." % uri)
+        return "<%s>" % uri
+
+    @staticmethod
+    def __nt_literal(value, datatype=None):
+        literal = '"%s"' % value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"').replace("\r", "\\r")
+        if datatype is not None:
+            literal += "^^<%s>" % datatype
+        return literal
+
+    @staticmethod
+    def __nt_duration(duration):
+        # Zero components are dropped, as rdflib does when normalising xsd:duration literals
+        if match("^-?P([0-9]+Y)?([0-9]+M)?([0-9]+D)?$", duration):
+            result = "".join(item for item in findall("[0-9]+[YMD]", duration) if int(item[:-1]))
+            if result:
+                return ("-P" if duration.startswith("-") else "P") + result
+            else:
+                return "P0D"
+        else:
+            return duration
+
+    @staticmethod
+    def __nt_rows(triples):
+        # Duplicated triples are removed, as it happens when they are added to an rdflib graph
+        return "".join("%s %s %s .\n" % triple for triple in dict.fromkeys(triples))
+
     def get_oci_rdf(self, baseurl, include_label=True, include_prov=True):
         identifier_graph, identifier, identifier_local_id, identifier_corpus_id = self.__get_oci_rdf_entity(baseurl)
 
@@ -263,22 +392,8 @@ class Citation(object):
 
         return identifier_graph, identifier, identifier_local_id, identifier_corpus_id
 
-    def get_citation_csv(self):
-        s_res = StringIO()
-        writer = DictWriter(s_res, ["oci", "citing", "cited", "creation", "timespan", "journal_sc", "author_sc"])
-        writer.writeheader()
-        writer.writerow(loads(self.get_citation_json()))
-        return s_res.getvalue()
-
-    def get_citation_csv_prov(self):
-        s_res = StringIO()
-        writer = DictWriter(s_res, ["oci", "agent", "source", "datetime"])
-        writer.writeheader()
-        writer.writerow(loads(self.get_citation_json_prov()))
-        return s_res.getvalue()
-
-    def get_citation_json(self):
-        result = {
+    def as_row(self):
+        return {
             "oci": self.oci.replace("oci:", ""),
             "citing": self.get_id(self.citing_url),
             "cited": self.get_id(self.cited_url),
@@ -288,17 +403,48 @@ class Citation(object):
             "author_sc": self.author_sc
         }
 
-        return dumps(result, indent=4, ensure_ascii=False)
-
-    def get_citation_json_prov(self):
-        result = {
+    def as_prov_row(self):
+        return {
             "oci": self.oci.replace("oci:", ""),
             "agent": self.prov_agent_url,
             "source": self.source,
             "datetime": self.prov_date
         }
 
-        return dumps(result, indent=4, ensure_ascii=False)
+    def get_citation_csv(self):
+        s_res = StringIO()
+        Citation.write_csv((self,), s_res)
+        return s_res.getvalue()
+
+    def get_citation_csv_prov(self):
+        s_res = StringIO()
+        Citation.write_csv((self,), s_res, True)
+        return s_res.getvalue()
+
+    def get_citation_json(self):
+        return dumps(self.as_row(), indent=4, ensure_ascii=False)
+
+    def get_citation_json_prov(self):
+        return dumps(self.as_prov_row(), indent=4, ensure_ascii=False)
+
+    @staticmethod
+    def get_rows(citations, is_prov=False):
+        # The rows of a list of citations or of a CitationBatch, the latter being read directly from its columns
+        if isinstance(citations, CitationBatch):
+            return citations.as_prov_rows() if is_prov else citations.as_rows()
+        else:
+            return (citation.as_prov_row() if is_prov else citation.as_row() for citation in citations)
+
+    @staticmethod
+    def write_csv(citations, f, is_prov=False, header=True):
+        writer = DictWriter(f, CSV_PROV_FIELDS if is_prov else CSV_FIELDS)
+        if header:
+            writer.writeheader()
+        writer.writerows(Citation.get_rows(citations, is_prov))
+
+    @staticmethod
+    def write_json_lines(citations, f, is_prov=False):
+        f.writelines(dumps(row, ensure_ascii=False) + "\n" for row in Citation.get_rows(citations, is_prov))
 
     def get_citation_scholix(self):
         if self.citation_type == REFERENCE_CITATION_TYPE:
@@ -343,10 +489,24 @@ class Citation(object):
         return dumps(result, indent=4, ensure_ascii=False)
 
     def get_id(self, entity_url):
-        decode = "XXX__decode]]" in self.id_shape
-        entity_regex = sub("\[\[[^\]]+\]\]", ".+", self.id_shape)
-        entity_token = sub(entity_regex, "\\1", entity_url)
-        return unquote(entity_token) if decode else entity_token
+        return Citation.get_id_extractor(self.id_shape)(entity_url)
+
+    @staticmethod
+    @lru_cache(maxsize=ACCESS_CACHE_SIZE)
+    def get_id_extractor(id_shape):
+        # The function returning the identifier contained in an entity URL having the shape specified, shared by all
+        # the citations of the same service so as to compile its regular expression only once
+        entity_regex = compile(ID_SHAPE_PLACEHOLDER.sub(".+", id_shape))
+        if entity_regex.groups:
+            # Same as the replacement '\\1', without parsing it at every call
+            extract = partial(entity_regex.sub, lambda entity_match: entity_match.group(1) or "")
+        else:
+            extract = partial(entity_regex.sub, "\\1")
+
+        if "XXX__decode]]" in id_shape:
+            return lambda entity_url: unquote(extract(entity_url))
+        else:
+            return extract
 
     @staticmethod
     def contains_years(date):
@@ -362,47 +522,11 @@ class Citation(object):
 
     @staticmethod
     def get_duration(delta, consider_months, consider_days):
-        result = ""
-        if delta.years < 0 or \
-                (delta.years == 0 and delta.months < 0 and consider_months) or \
-                (delta.years == 0 and delta.months == 0 and delta.days < 0 and consider_days):
-            result += "-"
-        result += "P%sY" % abs(delta.years)
-
-        if consider_months:
-            result += "%sM" % abs(delta.months)
-
-        if consider_days:
-            result += "%sD" % abs(delta.days)
-
-        return result
+        return DateManager.format_duration(delta.years, delta.months, delta.days, consider_months, consider_days)
 
     @staticmethod
     def get_date(creation_date, duration):
-        params = {}
-        for item in findall("^-?P([0-9]+Y)?([0-9]+M)?([0-9]+D)?$", duration)[0]:
-            if "Y" in item:
-                params["years"] = int(item[:-1])
-            elif "M" in item:
-                params["months"] = int(item[:-1])
-            elif "D" in item:
-                params["days"] = int(item[:-1])
-
-        delta = relativedelta(**params)
-        d = parse(creation_date, default=DEFAULT_DATE)
-        if duration.startswith("-"):
-            result = d + delta
-        else:
-            result = d - delta
-
-        if "D" in duration or Citation.contains_days(creation_date):
-            cut = 10
-        elif "M" in duration or Citation.contains_months(creation_date):
-            cut = 7
-        else:
-            cut = 4
-
-        return result.strftime('%Y-%m-%d')[:cut]
+        return DateManager.get_date(creation_date, duration)
 
     @staticmethod
     def format_rdf(g, f="text/turtle"):
@@ -412,9 +536,229 @@ class Citation(object):
         return g.serialize(format=cur_format, encoding="utf-8").decode("utf-8")
 
 
+class CitationBatch(object):
+    # A columnar container of the citations coming from the same service: the data of each citation are stored in
+    # parallel lists (and the self-citation flags in a bytearray), and Citation objects are created only when needed
+    def __init__(self, service_name, id_type, id_shape, citation_type=DEFAULT_CITATION_TYPE):
+        self.service_name = service_name
+        self.id_type = id_type
+        self.id_shape = id_shape
+        self.citation_type = citation_type if citation_type in CITATION_TYPES else DEFAULT_CITATION_TYPE
+
+        self.oci = []
+        self.citing_url = []
+        self.cited_url = []
+        self.duration = []
+        self.creation_date = []
+        self.citing_pub_date = []
+        self.cited_pub_date = []
+        self.prov_agent_url = []
+        self.source = []
+        self.prov_date = []
+        self.flags = bytearray()
+
+    def __len__(self):
+        return len(self.oci)
+
+    def __getitem__(self, idx):
+        flags = self.flags[idx]
+        return Citation.from_values((
+            self.oci[idx], self.citing_url[idx], self.cited_url[idx], self.duration[idx], self.creation_date[idx],
+            "yes" if flags & AUTHOR_SC else "no", "yes" if flags & JOURNAL_SC else "no",
+            self.citing_pub_date[idx], self.cited_pub_date[idx], self.citation_type,
+            self.prov_agent_url[idx], self.source[idx], self.prov_date[idx],
+            self.service_name, self.id_type, self.id_shape))
+
+    def __iter__(self):
+        for idx in range(len(self.oci)):
+            yield self[idx]
+
+    def add(self, oci, citing_url, citing_pub_date, cited_url, cited_pub_date, creation, timespan,
+            prov_agent_url, source, prov_date, journal_sc=False, author_sc=False):
+        # Same parameters (and same computation of the dates) of Citation, except the service data
+        citing_pub_date, cited_pub_date, creation, timespan = \
+            Citation.get_dates(citing_pub_date, cited_pub_date, creation, timespan)
+        self.__append(oci, citing_url, cited_url, timespan, creation, citing_pub_date, cited_pub_date,
+                      prov_agent_url, source, prov_date,
+                      (AUTHOR_SC if author_sc else 0) | (JOURNAL_SC if journal_sc else 0))
+
+    def append(self, citation):
+        if (citation.service_name, citation.id_type, citation.id_shape, citation.citation_type) != \
+                (self.service_name, self.id_type, self.id_shape, self.citation_type):
+            raise ValueError("The citation '%s' does not come from the service of the batch." % citation.oci)
+
+        self.__append(citation.oci, citation.citing_url, citation.cited_url, citation.duration,
+                      citation.creation_date, citation.citing_pub_date, citation.cited_pub_date,
+                      citation.prov_agent_url, citation.source, citation.prov_date,
+                      (AUTHOR_SC if citation.author_sc == "yes" else 0) |
+                      (JOURNAL_SC if citation.journal_sc == "yes" else 0))
+
+    def __append(self, oci, citing_url, cited_url, duration, creation_date, citing_pub_date, cited_pub_date,
+                 prov_agent_url, source, prov_date, flags):
+        self.oci.append(oci)
+        self.citing_url.append(citing_url)
+        self.cited_url.append(cited_url)
+        self.duration.append(duration)
+        self.creation_date.append(creation_date)
+        self.citing_pub_date.append(citing_pub_date)
+        self.cited_pub_date.append(cited_pub_date)
+        self.prov_agent_url.append(prov_agent_url)
+        self.source.append(source)
+        self.prov_date.append(prov_date)
+        self.flags.append(flags)
+
+    def clear(self):
+        for column in (self.oci, self.citing_url, self.cited_url, self.duration, self.creation_date,
+                       self.citing_pub_date, self.cited_pub_date, self.prov_agent_url, self.source, self.prov_date):
+            column.clear()
+        self.flags.clear()
+
+    def as_rows(self):
+        get_id = Citation.get_id_extractor(self.id_shape)
+        for oci, citing, cited, creation, timespan, flags in zip(
+                self.oci, map(get_id, self.citing_url), map(get_id, self.cited_url),
+                self.creation_date, self.duration, self.flags):
+            yield {
+                "oci": oci.replace("oci:", ""),
+                "citing": citing,
+                "cited": cited,
+                "creation": creation,
+                "timespan": timespan,
+                "journal_sc": "yes" if flags & JOURNAL_SC else "no",
+                "author_sc": "yes" if flags & AUTHOR_SC else "no"
+            }
+
+    def as_prov_rows(self):
+        for oci, agent, source, prov_date in zip(self.oci, self.prov_agent_url, self.source, self.prov_date):
+            yield {
+                "oci": oci.replace("oci:", ""),
+                "agent": agent,
+                "source": source,
+                "datetime": prov_date
+            }
+
+    def get_citation_csv(self):
+        s_res = StringIO()
+        Citation.write_csv(self, s_res)
+        return s_res.getvalue()
+
+    def get_citation_csv_prov(self):
+        s_res = StringIO()
+        Citation.write_csv(self, s_res, True)
+        return s_res.getvalue()
+
+    def get_citation_json(self):
+        return dumps(list(self.as_rows()), indent=4, ensure_ascii=False)
+
+    def get_citation_json_prov(self):
+        return dumps(list(self.as_prov_rows()), indent=4, ensure_ascii=False)
+
+    def get_citation_scholix(self):
+        return CitationBatch.__json_array(citation.get_citation_scholix() for citation in self)
+
+    def get_citation_nt(self, baseurl, include_oci=True, include_label=True, include_prov=True):
+        return "".join(citation.get_citation_nt(baseurl, include_oci, include_label, include_prov)
+                       for citation in self)
+
+    def get_citation_prov_nt(self, baseurl):
+        return "".join(citation.get_citation_prov_nt(baseurl) for citation in self)
+
+    @staticmethod
+    def __json_array(objects):
+        # The same JSON that dumps(..., indent=4) returns for the list of all the objects
+        result = ",\n".join(objects).replace("\n", "\n    ")
+        return "[\n    %s\n]" % result if result else "[]"
+
+
+class OCICodec(object):
+    def __init__(self, lookup, inverse_lookup):
+        self.lookup = lookup
+        self.inverse_lookup = inverse_lookup
+        self.table = str.maketrans({char: code for char, code in inverse_lookup.items() if len(char) == 1})
+        # The translation can be checked only if all the codes are made of digits and all the digits are encoded,
+        # since any character without a code is left untouched in the result
+        self.is_checkable = all(code.isascii() and code.isdigit() for code in inverse_lookup.values()) and \
+            all(digit in inverse_lookup for digit in "0123456789")
+        # Many identifiers are processed at once by joining them with a separator that is left untouched
+        self.is_joinable = all(SEPARATOR not in item for item in chain(inverse_lookup, lookup.values()))
+
+        # When all the codes have two digits, the first and the second digits of the codes of the ASCII characters
+        # are obtained with two byte translations, while any character without a code is marked as unknown
+        self.digit_tables = None
+        if self.is_joinable and inverse_lookup and \
+                all(len(code) == 2 and code.isascii() and code.isdigit() for code in inverse_lookup.values()):
+            first, second = bytearray(UNKNOWN * 256), bytearray(UNKNOWN * 256)
+            for char, code in inverse_lookup.items():
+                if len(char) == 1 and ord(char) < 128:
+                    first[ord(char)], second[ord(char)] = code.encode("ascii")
+            first[ord(SEPARATOR)] = second[ord(SEPARATOR)] = ord(SEPARATOR)
+            self.digit_tables = bytes(first), bytes(second)
+
+        # The characters of all the two-digit codes not starting with 9, indexed by the value of their two bytes
+        self.pair_table = [None] * 65536
+        for code in ("%02d" % n for n in range(90)):
+            self.pair_table[int.from_bytes(code.encode("ascii"), byteorder)] = lookup.get(code, code)
+        self.pair_table[int.from_bytes((SEPARATOR * 2).encode("ascii"), byteorder)] = SEPARATOR
+
+    def encode(self, doi):
+        doi = doi.replace("10.", "")
+        result = doi.translate(self.table)
+        if self.is_checkable and (result.isdigit() and result.isascii() or not result):
+            return result
+        else:  # It raises a KeyError for the first character that has no code
+            return "".join(map(self.inverse_lookup.__getitem__, doi))
+
+    def decode(self, s):
+        codes = CODE.findall(s)
+        return "10." + "".join(map(self.lookup.get, codes, codes))
+
+    def encode_many(self, dois):
+        dois = list(dois)
+        if dois and self.is_joinable:
+            joined = SEPARATOR.join(dois)
+            if joined.count(SEPARATOR) == len(dois) - 1:
+                joined = joined.replace("10.", "")
+                if self.digit_tables is not None and joined.isascii():
+                    data = joined.encode("ascii")
+                    result = bytearray(2 * len(data))
+                    result[0::2] = data.translate(self.digit_tables[0])
+                    result[1::2] = data.translate(self.digit_tables[1])
+                    if UNKNOWN not in result:
+                        return result.decode("ascii").split(SEPARATOR * 2)
+                elif self.is_checkable:
+                    result = joined.translate(self.table)
+                    digits = result.replace(SEPARATOR, "")
+                    if not digits or (digits.isdigit() and digits.isascii()):
+                        return result.split(SEPARATOR)
+
+        return [self.encode(doi) for doi in dois]
+
+    def decode_many(self, l):
+        l = list(l)
+        if l and self.is_joinable:
+            joined = (SEPARATOR * 2).join(l)
+            if joined.count(SEPARATOR) == 2 * (len(l) - 1):
+                if all(not len(s) % 2 for s in l) and "9" not in joined[0::2] and joined.isascii():
+                    # Only two-digit codes (all starting at even positions), that are decoded two bytes at a time
+                    try:
+                        result = "".join(map(self.pair_table.__getitem__,
+                                             memoryview(joined.encode("ascii")).cast("H")))
+                        return ["10." + s for s in result.split(SEPARATOR)]
+                    except TypeError:
+                        pass  # Some characters are not digits
+
+                codes = CODE_OR_SEPARATOR.findall(joined)
+                return ["10." + s for s in "".join(map(self.lookup.get, codes, codes)).split(SEPARATOR * 2)]
+
+        return [self.decode(s) for s in l]
+
+
 class OCIManager(object):
-    def __init__(self, oci_string=None, lookup_file=None, conf_file=None, doi_1=None, doi_2=None, prefix=""):
+    def __init__(self, oci_string=None, lookup_file=None, conf_file=None, doi_1=None, doi_2=None, prefix="",
+                 session=None, shared=None, sparql=None):
         self.is_valid = None
+        self.session = DEFAULT_SESSION if session is None else session
+        self.sparql = DEFAULT_SPARQL if sparql is None else sparql
         self.messages = []
         self.f = {
             "decode": self.__decode,
@@ -424,25 +768,30 @@ class OCIManager(object):
             "remove": OCIManager.__remove,
             "normdate": OCIManager.__normdate,
             "datestrings": OCIManager.__datestrings,
-            "api": OCIManager.__call_api,
+            "api": self.__call_api,
             "avoid_prefix_removal": OCIManager.__avoid_prefix_removal
         }
-        self.lookup = {}
-        self.inverse_lookup = {}
-        if lookup_file is not None and exists(lookup_file):
-            with open(lookup_file) as f:
-                reader = DictReader(f)
-                for row in reader:
-                    self.lookup[row["code"]] = row["c"]
-                    self.inverse_lookup[row["c"]] = row["code"]
-        else:
-            self.add_message("__init__", W, "No lookup file has been found (path: '%s')." % lookup_file)
-        self.conf = None
-        if conf_file is not None and exists(conf_file):
-            with open(conf_file) as f:
-                self.conf = load(f)
-        else:
-            self.add_message("__init__", W, "No configuration file has been found (path: '%s')." % lookup_file)
+        if shared is None:
+            self.lookup = {}
+            self.inverse_lookup = {}
+            if lookup_file is not None and exists(lookup_file):
+                with open(lookup_file) as f:
+                    reader = DictReader(f)
+                    for row in reader:
+                        self.lookup[row["code"]] = row["c"]
+                        self.inverse_lookup[row["c"]] = row["code"]
+            else:
+                self.add_message("__init__", W, "No lookup file has been found (path: '%s')." % lookup_file)
+            self.conf = None
+            if conf_file is not None and exists(conf_file):
+                with open(conf_file) as f:
+                    self.conf = load(f)
+            else:
+                self.add_message("__init__", W, "No configuration file has been found (path: '%s')." % lookup_file)
+            self.codec = OCICodec(self.lookup, self.inverse_lookup)
+        else:  # Reuse the lookup and the configuration already loaded by another manager
+            self.lookup, self.inverse_lookup, self.conf = shared.lookup, shared.inverse_lookup, shared.conf
+            self.codec = shared.codec
 
         if oci_string:
             self.oci = oci_string.lower().strip()
@@ -453,28 +802,19 @@ class OCIManager(object):
             self.add_message("__init__", W, "No OCI specified!")
 
     def __decode(self, s):
-        result = []
-
-        for code in findall("(9*[0-8][0-9])", s):
-            if code in self.lookup:
-                result.append(self.lookup[code])
-            else:
-                result.append(code)
-
-        return "10." + "".join(result)
-
-    def __decode_inverse(self, doi):
-        result = []
-
-        for char in doi.replace("10.", ""):
-            result.append(self.inverse_lookup[char])
-
-        return "".join(result)
+        return self.codec.decode(s)
 
     def get_oci(self, doi_1, doi_2, prefix):
-        self.oci = "oci:%s%s-%s%s" % (prefix, self.__decode_inverse(doi_1), prefix, self.__decode_inverse(doi_2))
+        self.oci = "oci:%s%s-%s%s" % (prefix, self.codec.encode(doi_1), prefix, self.codec.encode(doi_2))
         return self.oci
 
+    def get_ocis(self, doi_pairs, prefix):
+        # The OCIs of many citations at once, without changing the OCI of the manager
+        doi_pairs = list(doi_pairs)
+        citing = self.codec.encode_many([doi_1 for doi_1, doi_2 in doi_pairs])
+        cited = self.codec.encode_many([doi_2 for doi_1, doi_2 in doi_pairs])
+        return ["oci:%s%s-%s%s" % (prefix, citing_id, prefix, cited_id) for citing_id, cited_id in zip(citing, cited)]
+
     @staticmethod
     def __join(l, j_value=""):
         if type(l) is list:
@@ -510,7 +850,32 @@ class OCIManager(object):
 
         return result
 
-    def __execute_query(self, citing_entity, cited_entity):
+    def __get_service_ids(self, item, citing_entity, cited_entity):
+        citing = sub("^%s(.+)$" % PREFIX_REGEX, "\\1", citing_entity)
+        cited = sub("^%s(.+)$" % PREFIX_REGEX, "\\1", cited_entity)
+
+        for f_name in item["preprocess"] if "preprocess" in item else []:
+            citing = self.f[f_name](citing)
+            cited = self.f[f_name](cited)
+
+        return citing, cited
+
+    @staticmethod
+    def __is_service_usable(item, citing_entity, cited_entity):
+        prefix = item["prefix"] if "prefix" in item else []
+        return item.get("use_it") == "yes" and all(sub("^(%s).+$" % PREFIX_REGEX, "\\1", p) in prefix
+                                                   for p in (citing_entity, cited_entity))
+
+    def get_first_service(self):
+        # The position and the configuration of the first service to query for the OCI, with the identifiers
+        # of the citing and cited entities to use in its queries
+        if self.conf is not None and self.validate():
+            citing_entity, cited_entity = self.oci.replace("oci:", "").split("-")
+            for idx, item in enumerate(self.conf["services"]):
+                if OCIManager.__is_service_usable(item, citing_entity, cited_entity):
+                    return (idx, item) + self.__get_service_ids(item, citing_entity, cited_entity)
+
+    def __execute_query(self, citing_entity, cited_entity, sparql_answers=None):
         result = None
 
         if self.conf is None:
@@ -518,48 +883,31 @@ class OCIManager(object):
                                                    "file has been specified.")
         else:
             try:
-                i = iter(self.conf["services"])
+                i = iter(enumerate(self.conf["services"]))
                 while result is None:
-                    item = next(i)
-                    name, query, api, tp, use_it, preprocess, prefix, id_type, id_shape, citation_type = \
-                        item.get("name"), item.get("query"), item.get("api"), item.get("tp"), item.get("use_it"), \
-                        item["preprocess"] if "preprocess" in item else [], \
-                        item["prefix"] if "prefix" in item else [], item.get("id_type"), item.get("id_shape"), \
+                    idx, item = next(i)
+                    name, query, api, tp, id_type, id_shape, citation_type = \
+                        item.get("name"), item.get("query"), item.get("api"), item.get("tp"), \
+                        item.get("id_type"), item.get("id_shape"), \
                         item["citation_type"] if "citation_type" in item else DEFAULT_CITATION_TYPE
 
-                    if use_it == "yes" and all(sub("^(%s).+$" % PREFIX_REGEX, "\\1", p) in prefix
-                                               for p in (citing_entity, cited_entity)):
-                        citing = sub("^%s(.+)$" % PREFIX_REGEX, "\\1", citing_entity)
-                        cited = sub("^%s(.+)$" % PREFIX_REGEX, "\\1", cited_entity)
-
-                        for f_name in preprocess:
-                            citing = self.f[f_name](citing)
-                            cited = self.f[f_name](cited)
+                    if OCIManager.__is_service_usable(item, citing_entity, cited_entity):
+                        citing, cited = self.__get_service_ids(item, citing_entity, cited_entity)
 
                         if tp is None:
                             rest_query = api.replace("[[CITING]]", quote(citing)).replace("[[CITED]]", quote(cited))
-                            structured_res, type_res = OCIManager.__call_api(rest_query)
+                            structured_res, type_res = self.__call_api(rest_query)
                             if structured_res:
-                                result = self.__read_api_data(structured_res, type_res, query.get("citing"),
-                                                              citing, cited, api), \
-                                         self.__read_api_data(structured_res, type_res, query.get("cited"),
-                                                              citing, cited, api), \
-                                         self.__read_api_data(structured_res, type_res, query.get("citing_date"),
-                                                              citing, cited, api), \
-                                         self.__read_api_data(structured_res, type_res, query.get("cited_date"),
-                                                              citing, cited, api), \
-                                         self.__read_api_data(structured_res, type_res, query.get("creation"),
-                                                              citing, cited, api), \
-                                         self.__read_api_data(structured_res, type_res, query.get("timespan"),
-                                                              citing, cited, api), \
-                                         rest_query, name, id_type, id_shape, citation_type
+                                result = self.__read_api_fields(structured_res, type_res, query,
+                                                                citing, cited, api) + \
+                                         (rest_query, name, id_type, id_shape, citation_type)
                         else:
-                            sparql = SPARQLWrapper(tp)
                             sparql_query = sub("\\[\\[CITED\\]\\]", cited, sub("\\[\\[CITING\\]\\]", citing, query))
 
-                            sparql.setQuery(sparql_query)
-                            sparql.setReturnFormat(JSON)
-                            q_res = sparql.query().convert()["results"]["bindings"]
+                            if sparql_answers is not None and idx in sparql_answers:  # Already retrieved in batch
+                                q_res = [sparql_answers[idx]] if sparql_answers[idx] is not None else []
+                            else:
+                                q_res = self.sparql(tp, sparql_query)
                             if len(q_res) > 0:
                                 answer = q_res[0]
                                 result = answer["citing"]["value"], \
@@ -575,12 +923,11 @@ class OCIManager(object):
 
         return result
 
-    @staticmethod
-    def __call_api(u):
+    def __call_api(self, u):
         structured_res = None
         type_res = None
 
-        res = get(u, headers={"User-Agent": USER_AGENT}, timeout=30)
+        res = self.session.get(u, headers={"User-Agent": USER_AGENT}, timeout=30)
 
         if res.status_code == 200:
             res.encoding = "utf-8"
@@ -595,82 +942,195 @@ class OCIManager(object):
 
         return structured_res, type_res
 
-    def __read_api_data(self, data, type_format, access_list, citing, cited, api):
+    def __read_api_fields(self, data, type_format, query, citing, cited, api):
+        # All the fields are read from the same response, and the operations shared by their access paths
+        # (e.g. the same first steps in the tree) are executed only once
+        memo = {}
+        return tuple(self.__read_api_data(data, type_format, query.get(field), citing, cited, api, memo)
+                     for field in QUERY_FIELDS)
+
+    def __read_api_data(self, data, type_format, access_list, citing, cited, api, memo=None):
         result = None
 
         if data and access_list:
-            access_queue = deque(access_list)
-            while result is None and access_queue:
-                access_string = access_queue.popleft()
-                access_operations = deque(access_string.split("::"))
-
-                access_operation = access_operations.popleft()
-                if citing:
-                    access_operation = sub("\[\[CITING\]\]", citing, access_operation)
-                if cited:
-                    access_operation = sub("\[\[CITED\]\]", cited, access_operation)
-
-                f_to_execute = []
-                if "->" in access_operation:
-                    for idx, item in enumerate(access_operation.split("->")):
-                        if idx:
-                            f_to_execute.append(item)
-                        else:
-                            access_operation = item
-                if match("^([^\(]+)\((.*)\)$", access_operation):
-                    f_name, f_params = findall("([^\(]+)\((.*)\)", access_operation)[0]
-                    f_params = f_params.split(",") if f_params else []
-                    result = self.f[f_name](*f_params)
-                    if type(result) is tuple:
-                        result, type_format = result
-                elif match("\[[0-9]+\]", access_operation):
-                    cur_n = int(sub("\[([0-9]+)\]", "\\1", access_operation))
-                    if type(data) is list and cur_n < len(data):
-                        result = data[cur_n]
-                elif match("^\[.+\]$", access_operation) and "==" in access_operation:
-                    left, right = sub("^\[(.+)\]$", "\\1", access_operation).split("==")
-                    if type(data) is list:
-                        list_queue = deque(data)
-                        while result is None and list_queue:
-                            item = list_queue.popleft()
-                            item_value = item.get(left)
-                            if item_value is not None and item_value.lower() == right.lower():
-                                result = item
-                else:
-                    if type_format == "json":
-                        result = data.get(access_operation)
-                    elif type_format == "xml":
-                        el = None
+            for access_path in OCIManager.compile_access_list(tuple(access_list)):
+                # As in the recursive definition of the access paths, the type of the data changed by the functions
+                # of the first operation of a path is retained when trying the following paths
+                result, type_format = self.__follow_access_path(data, type_format, access_path, citing, cited, memo)
+                if result is not None:
+                    break
 
-                        if match("^({.+})?%s$" % access_operation, data.tag):
-                            el = data
-                        else:
-                            children = deque(data)
-                            while el is None and children:
-                                child = children.popleft()
-                                if match("^({.+})?%s$" % access_operation, child.tag):
-                                    el = child
-
-                        result = el
-
-                if result is not None and not access_operations and type_format == "xml":
-                    result = sub("\s+", " ", result.text).strip()
-
-                if f_to_execute and result is not None:
-                    for f in f_to_execute:
-                        f_name, f_params = findall("([^\(]+)\((.*)\)", f)[0]
-                        f_params = f_params.split(",") if f_params else []
-                        f_params.insert(0, result)
-                        result = self.f[f_name](*f_params)
-                        if type(result) is tuple:
-                            result, type_format = result
-
-                if access_operations:
-                    result = self.__read_api_data(result, type_format, ["::".join(access_operations)],
-                                                  citing, cited, api)
+        return result
+
+    def __follow_access_path(self, data, type_format, access_path, citing, cited, memo):
+        start_type_format = type_format
+        first_type_format = type_format
+        last_idx = len(access_path) - 1
+
+        for idx, (access_string, operation, prefix) in enumerate(access_path):
+            if idx and not data:
+                return None, first_type_format
+
+            if memo is None or idx == last_idx:
+                data, type_format = self.__run_access_operation(
+                    data, type_format, access_string, operation, idx == last_idx, citing, cited, memo)
+            else:
+                key = (start_type_format, prefix)
+                if key not in memo:
+                    memo[key] = self.__run_access_operation(
+                        data, type_format, access_string, operation, False, citing, cited, memo)
+                data, type_format = memo[key]
+
+            if not idx:
+                first_type_format = type_format
+
+        return data, first_type_format
+
+    def __run_access_operation(self, data, type_format, access_string, operation, is_last, citing, cited, memo):
+        if operation is None:  # The operation depends on the identifiers of the citing and cited entities
+            if citing:
+                access_string = CITING_PLACEHOLDER.sub(citing, access_string)
+            if cited:
+                access_string = CITED_PLACEHOLDER.sub(cited, access_string)
+            operation = OCIManager.compile_access_operation(access_string)
+
+        kind, value, f_to_execute = operation
+        result = None
+        if kind == "function":
+            f_name, f_params = value
+            result = self.f[f_name](*f_params)
+            if type(result) is tuple:
+                result, type_format = result
+        elif kind == "index":
+            if type(data) is list and value < len(data):
+                result = data[value]
+        elif kind == "filter":
+            left, right = value
+            if type(data) is list:
+                for item in data:
+                    item_value = item.get(left)
+                    if item_value is not None and item_value.lower() == right:
+                        result = item
+                        break
+        elif kind == "error":
+            raise value[0](*value[1])
+        elif type_format == "json":
+            result = data.get(value)
+        elif type_format == "xml":
+            result = OCIManager.__find_element(data, value, memo)
+
+        if result is not None and is_last and type_format == "xml":
+            result = SPACES.sub(" ", result.text).strip()
+
+        if f_to_execute and result is not None:
+            for f_name, f_params in f_to_execute:
+                if f_params is None:
+                    raise IndexError("list index out of range")
+                result = self.f[f_name](result, *f_params)
+                if type(result) is tuple:
+                    result, type_format = result
+
+        return result, type_format
+
+    @staticmethod
+    def __find_element(el, tag, memo):
+        el_tag = el.tag
+        if memo is not None and PLAIN_TAG.fullmatch(tag) and type(el_tag) is str and "\n" not in el_tag:
+            if OCIManager.__get_local_tag(el_tag) == tag:
+                return el
+
+            # The children are indexed by local name once per element, so that further lookups on the same
+            # element do not scan all its children again
+            key = ("children", id(el))
+            if key not in memo:
+                memo[key] = el, OCIManager.__index_children(el)
+            children = memo[key][1]
+            if children is not None:
+                return children.get(tag)
+
+        tag_regex = OCIManager.compile_tag_regex(tag)
+        if tag_regex.match(el_tag):
+            return el
+        for child in el:
+            if tag_regex.match(child.tag):
+                return child
+
+    @staticmethod
+    def __index_children(el):
+        result = {}
+
+        for child in el:
+            if type(child.tag) is not str or "\n" in child.tag:
+                return None  # Not indexable, the children are matched against the tag regex as usual
+        for child in el:
+            local_tag = OCIManager.__get_local_tag(child.tag)
+            if local_tag is not None and local_tag not in result:
+                result[local_tag] = child
 
         return result
 
+    @staticmethod
+    def __get_local_tag(tag):
+        # The local name matched by the expression '^({.+})?name$', i.e. with an optional non-empty namespace
+        if tag.startswith("{"):
+            ns_end = tag.rfind("}")
+            return tag[ns_end + 1:] if ns_end > 1 else None
+        return tag
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def compile_access_list(access_list):
+        result = []
+
+        for access_string in access_list:
+            access_path = []
+            for access_operation in access_string.split("::"):
+                if "[[CITING]]" in access_operation or "[[CITED]]" in access_operation:
+                    access_path.append((access_operation, None))
+                else:
+                    access_path.append((access_operation, OCIManager.compile_access_operation(access_operation)))
+            result.append(tuple(
+                (access_operation, operation, tuple(item[0] for item in access_path[:idx + 1]))
+                for idx, (access_operation, operation) in enumerate(access_path)))
+
+        return tuple(result)
+
+    @staticmethod
+    @lru_cache(maxsize=ACCESS_CACHE_SIZE)
+    def compile_access_operation(access_operation):
+        f_to_execute = []
+        if "->" in access_operation:
+            for idx, item in enumerate(access_operation.split("->")):
+                if idx:
+                    f_parts = FUNCTION_PARTS.findall(item)
+                    if f_parts:
+                        f_name, f_params = f_parts[0]
+                        f_to_execute.append((f_name, tuple(f_params.split(",")) if f_params else ()))
+                    else:
+                        f_to_execute.append((item, None))
+                else:
+                    access_operation = item
+        f_to_execute = tuple(f_to_execute)
+
+        try:
+            if FUNCTION_CALL.match(access_operation):
+                f_name, f_params = FUNCTION_PARTS.findall(access_operation)[0]
+                return "function", (f_name, tuple(f_params.split(",")) if f_params else ()), f_to_execute
+            elif INDEX_ACCESS.match(access_operation):
+                return "index", int(INDEX_VALUE.sub("\\1", access_operation)), f_to_execute
+            elif FILTER_ACCESS.match(access_operation) and "==" in access_operation:
+                left, right = FILTER_ACCESS.sub("\\1", access_operation).split("==")
+                return "filter", (left, right.lower()), f_to_execute
+            else:
+                return "key", access_operation, f_to_execute
+        except ValueError as e:  # Malformed operations fail only when they are actually executed
+            return "error", (type(e), e.args), f_to_execute
+
+    @staticmethod
+    @lru_cache(maxsize=ACCESS_CACHE_SIZE)
+    def compile_tag_regex(tag):
+        return compile("^({.+})?%s$" % tag)
+
     def validate(self):
         if self.is_valid is None:
             if not self.oci.startswith("oci:"):
@@ -707,12 +1167,12 @@ class OCIManager(object):
 
         return self.is_valid
 
-    def get_citation_object(self):
+    def get_citation_object(self, sparql_answers=None):
         if self.validate():
             citing_entity_local_id = sub("^oci:([0-9]+)-([0-9]+)$", "\\1", self.oci)
             cited_entity_local_id = sub("^oci:([0-9]+)-([0-9]+)$", "\\2", self.oci)
 
-            res = self.__execute_query(citing_entity_local_id, cited_entity_local_id)
+            res = self.__execute_query(citing_entity_local_id, cited_entity_local_id, sparql_answers)
             if res is not None:
                 citing_url, cited_url, full_citing_pub_date, full_cited_pub_date, \
                 creation, timespan, sparql_query_url, name, id_type, id_shape, citation_type = res
@@ -738,21 +1198,27 @@ class OCIManager(object):
     def get_citation_data(self, f="json"):
         citation = self.get_citation_object()
         if citation:
-            result = None
-            cur_format = "json"
-            if f in FORMATS:
-                cur_format = FORMATS[f]
-
-            if cur_format == "json":
-                result = citation.get_citation_json()
-            elif cur_format == "csv":
-                result = citation.get_citation_csv()
-            elif cur_format == "scholix":
-                result = citation.get_citation_scholix()
-            else:  # RDF format
-                result = Citation.format_rdf(citation.get_citation_rdf(BASE_URL), cur_format)
+            return OCIManager.format_citation(citation, f)
 
-            return result
+    @staticmethod
+    def format_citation(citation, f="json"):
+        result = None
+        cur_format = "json"
+        if f in FORMATS:
+            cur_format = FORMATS[f]
+
+        if cur_format == "json":
+            result = citation.get_citation_json()
+        elif cur_format == "csv":
+            result = citation.get_citation_csv()
+        elif cur_format == "scholix":
+            result = citation.get_citation_scholix()
+        elif cur_format == "nt11":
+            result = citation.get_citation_nt(BASE_URL)
+        else:  # RDF format
+            result = Citation.format_rdf(citation.get_citation_rdf(BASE_URL), cur_format)
+
+        return result
 
     def print_messages(self):
         for mes in self.messages:
@@ -762,12 +1228,112 @@ class OCIManager(object):
         self.messages.append({"operation": fun, "type": mes_type, "text": text})
 
 
+class OCIResolver(object):
+    def __init__(self, lookup_file=None, conf_file=None, workers=10, batch_size=RESOLVER_BATCH_SIZE, session=None,
+                 sparql=None, sparql_batch_size=SPARQL_BATCH_SIZE):
+        self.om = OCIManager(lookup_file=lookup_file, conf_file=conf_file, session=session, sparql=sparql)
+        self.session = self.om.session
+        self.sparql = self.om.sparql
+        self.sparql_batch_size = sparql_batch_size
+        self.messages = [mes for mes in self.om.messages if mes["operation"] == "__init__"
+                         and not mes["text"].startswith("No OCI")]
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def get_manager(self, oci_string):
+        return OCIManager(oci_string, session=self.session, shared=self.om, sparql=self.sparql)
+
+    def get_service(self, oci_string):
+        entities = sub("^(oci:)?", "", oci_string.lower().strip()).split("-")
+        prefixes = [sub("^(%s).+$" % PREFIX_REGEX, "\\1", entity) for entity in entities]
+        if self.om.conf is not None:
+            for service in self.om.conf["services"]:
+                if service.get("use_it") == "yes" and all(p in service.get("prefix", []) for p in prefixes):
+                    return service["name"]
+        return ""
+
+    def validate(self, ocis):
+        for oci in ocis:
+            om = self.get_manager(oci)
+            yield om, om.validate()
+
+    def get_citation_objects(self, ocis):
+        # The OCIs are processed in batches, so as to stream the results back without loading all the input, and
+        # each batch is ordered by service so that the queries to the same service are run concurrently
+        ocis = iter(ocis)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            batch = list(islice(ocis, self.batch_size))
+            while batch:
+                managers = {}
+                for oci in batch:
+                    if oci not in managers:  # The same OCI is resolved only once per batch
+                        managers[oci] = self.get_manager(oci)
+                answers = self.__query_triplestores(managers, executor) if self.sparql_batch_size else {}
+                to_resolve = sorted(managers, key=self.get_service)
+                results = dict(zip(to_resolve, executor.map(
+                    OCIResolver.__resolve, [(managers[oci], answers.get(oci)) for oci in to_resolve])))
+                for oci in batch:
+                    yield managers[oci], results[oci]
+                batch = list(islice(ocis, self.batch_size))
+
+    def get_citation_data(self, ocis, f="json"):
+        for om, citation in self.get_citation_objects(ocis):
+            yield om, OCIManager.format_citation(citation, f) if citation else None
+
+    @staticmethod
+    def __resolve(item):
+        om, sparql_answers = item
+        return om.get_citation_object(sparql_answers)
+
+    def __query_triplestores(self, managers, executor):
+        # The citations to retrieve from a triplestore are asked with one query for several OCIs, and the
+        # answers obtained are then used in place of the single queries; the citations that cannot be retrieved
+        # in this way are queried one by one as usual
+        groups = {}
+        for oci, om in managers.items():
+            service = om.get_first_service()
+            if service is not None:
+                idx, item, citing, cited = service
+                batch_query = BatchQuery.get_batch_query(item["query"]) if item.get("tp") is not None else None
+                values = batch_query.get_values(citing, cited) if batch_query is not None else None
+                if values is not None:
+                    groups.setdefault(idx, []).append((oci, values))
+
+        tasks = []
+        for idx, group in groups.items():
+            for start in range(0, len(group) if len(group) > 1 else 0, self.sparql_batch_size):
+                tasks.append((idx, group[start:start + self.sparql_batch_size]))
+
+        result = {}
+        for idx, group, group_answers in executor.map(self.__run_batch_query, tasks):
+            if group_answers is not None:
+                for (oci, values), answer in zip(group, group_answers):
+                    result[oci] = {idx: answer}
+
+        return result
+
+    def __run_batch_query(self, task):
+        idx, group = task
+        item = self.om.conf["services"][idx]
+        batch_query = BatchQuery.get_batch_query(item["query"])
+        try:
+            bindings = self.sparql(item["tp"], batch_query.get_query([values for oci, values in group]))
+            return idx, group, BatchQuery.demultiplex(bindings, len(group))
+        except Exception:
+            return idx, group, None  # The endpoint cannot answer the batch, thus the OCIs will be queried one by one
+
+    def print_messages(self):
+        for mes in self.messages:
+            print("{%s} [%s] %s" % (mes["operation"], mes["type"], mes["text"]))
+
+
 if __name__ == "__main__":
     arg_parser = ArgumentParser("oci.py", description="This script allows one to validate and retrieve citationd data "
                                                       "associated to an OCI (Open Citation Identifier).")
 
-    arg_parser.add_argument("-o", "--oci", dest="oci", required=True,
-                            help="The input OCI to use.")
+    arg_parser.add_argument("-o", "--oci", dest="oci", required=True, nargs="+",
+                            help="The input OCI to use. More than one OCI can be specified, and they are resolved "
+                                 "in batch.")
     arg_parser.add_argument("-l", "--lookup", dest="lookup", default="lookup.csv",
                             help="The lookup file to be used for encoding identifiers.")
     arg_parser.add_argument("-c", "--conf", dest="conf", default="oci.json",
@@ -776,18 +1342,26 @@ if __name__ == "__main__":
                             help="If the format is specified, the script tries to retrieve citation information that "
                                  "will be returned in the requested format. Possible formats: 'csv', 'json', "
                                  "'scholix', 'jsonld', 'ttl', 'rdfxml', 'nt'")
+    arg_parser.add_argument("-w", "--workers", dest="workers", type=int, default=10,
+                            help="The number of queries to the services run concurrently when more than one OCI "
+                                 "is specified.")
+    arg_parser.add_argument("-b", "--sparql_batch_size", dest="sparql_batch_size", type=int,
+                            default=SPARQL_BATCH_SIZE,
+                            help="The number of OCIs retrieved with a single query from the services based on a "
+                                 "triplestore when more than one OCI is specified. Zero disables the batch queries.")
 
     args = arg_parser.parse_args()
 
-    om = OCIManager(args.oci, args.lookup, args.conf)
+    resolver = OCIResolver(args.lookup, args.conf, args.workers, sparql_batch_size=args.sparql_batch_size)
+    resolver.print_messages()
 
-    result = None
     if args.format is None:
-        result = om.validate()
+        results = resolver.validate(args.oci)
     else:
-        result = om.get_citation_data(args.format)
+        results = resolver.get_citation_data(args.oci, args.format)
 
-    om.print_messages()
+    for om, result in results:
+        om.print_messages()
 
-    if result is not None:
-        print(result)
+        if result is not None:
+            print(result)
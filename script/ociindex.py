@@ -0,0 +1,444 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from sqlite3 import connect
+from os import sep, remove, replace, fsync
+from os.path import exists, dirname, abspath
+from mmap import mmap, ACCESS_READ, ACCESS_WRITE
+from struct import Struct
+from re import compile
+from heapq import merge
+from tempfile import mkdtemp
+from shutil import rmtree
+from urllib.parse import quote
+from hashlib import blake2b
+from math import ceil, log
+
+
+COMMIT_SIZE = 10000
+
+
+class OCIIndex(object):
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.is_new = not exists(path)
+        if read_only:
+            self.conn = connect("file:%s?mode=ro" % quote(abspath(path)), uri=True)
+        else:
+            self.conn = connect(path)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS oci (oci TEXT PRIMARY KEY) WITHOUT ROWID")
+            self.conn.commit()
+        self.pending = 0
+
+    def __contains__(self, oci):
+        return self.conn.execute("SELECT 1 FROM oci WHERE oci = ?", (oci,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM oci").fetchone()[0]
+
+    def __iter__(self):
+        for oci, in self.conn.execute("SELECT oci FROM oci"):
+            yield oci
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, oci):
+        self.conn.execute("INSERT OR IGNORE INTO oci VALUES (?)", (oci,))
+        self.pending += 1
+        if self.pending >= COMMIT_SIZE:
+            self.commit()
+
+    def update(self, ocis):
+        self.conn.executemany("INSERT OR IGNORE INTO oci VALUES (?)", ((oci,) for oci in ocis))
+        self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        if self.conn is not None:
+            self.commit()
+            self.conn.close()
+            self.conn = None
+
+
+TABLE_HEADER = Struct(">4sIQ")  # Magic number, size of each record in bytes, number of records
+TABLE_MAGIC = b"OCIT"
+RUN_SIZE = 1000000
+OCI_FORMAT = compile("^[0-9]+-[0-9]+$")
+
+
+class OCITable(object):
+    # The OCIs are stored in a sorted file of fixed-size records, each containing the digits of an OCI packed two
+    # per byte (with 'a' in place of the dash and padded with 'f'), which is memory-mapped and binary searched.
+    # The OCIs added are kept in memory, and in a log file once committed, until they are merged into the table
+    # when it is closed. In read-only mode (e.g. in the workers of cnc.py) the log is read but never changed, and
+    # the table is never rewritten
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.log_path = path + ".log"
+        self.read_only = read_only
+        self.is_new = not exists(path)
+        if self.is_new and not read_only:
+            self.__write(iter(()), 0)
+        self.__open()
+
+        self.pending = set()
+        self.uncommitted = []
+        if exists(self.log_path):
+            with open(self.log_path) as f:
+                self.pending.update(line.strip() for line in f if line.strip())
+
+    def __open(self):
+        self.file = open(self.path, "rb")
+        self.table = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        magic, self.width, self.count = TABLE_HEADER.unpack_from(self.table)
+        if magic != TABLE_MAGIC:
+            raise ValueError("The file '%s' does not contain a table of OCIs." % self.path)
+
+    @staticmethod
+    def get_hex(oci):
+        if not OCI_FORMAT.match(oci):
+            raise ValueError("The string '%s' is not an OCI without prefix." % oci)
+        return oci.replace("-", "a")
+
+    @staticmethod
+    def get_sort_key(hex_oci):
+        # The same order of the packed records, where a shorter OCI is padded with 'f' and thus follows the longer
+        # ones having it as prefix
+        return hex_oci + "g"
+
+    @staticmethod
+    def pack(hex_oci, width):
+        return bytes.fromhex(hex_oci + "f" * (width * 2 - len(hex_oci)))
+
+    def __contains__(self, oci):
+        return oci in self.pending or self.__in_table(oci)
+
+    def __in_table(self, oci):
+        if not OCI_FORMAT.match(oci) or len(oci) > self.width * 2:
+            return False
+
+        key = OCITable.pack(oci.replace("-", "a"), self.width)
+        table = self.table
+        width = self.width
+        lo = 0
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = TABLE_HEADER.size + mid * width
+            if table[start:start + width] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = TABLE_HEADER.size + lo * width
+        return lo < self.count and table[start:start + width] == key
+
+    def __len__(self):
+        return self.count + sum(1 for oci in self.pending if not self.__in_table(oci))
+
+    def __iter__(self):
+        for idx in range(self.count):
+            start = TABLE_HEADER.size + idx * self.width
+            yield self.table[start:start + self.width].hex().rstrip("f").replace("a", "-")
+        for oci in list(self.pending):
+            if not self.__in_table(oci):
+                yield oci
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __check_writable(self):
+        if self.read_only:
+            raise ValueError("The table of OCIs '%s' is open in read-only mode." % self.path)
+
+    def add(self, oci):
+        self.__check_writable()
+        if oci not in self:
+            OCITable.get_hex(oci)
+            self.pending.add(oci)
+            self.uncommitted.append(oci)
+            if len(self.uncommitted) >= COMMIT_SIZE:
+                self.commit()
+
+    def update(self, ocis):
+        # External sort of the new OCIs, in runs of RUN_SIZE OCIs, which are then merged with the table
+        self.__check_writable()
+        tmp_dir = mkdtemp(prefix="ocitable_", dir=dirname(abspath(self.path)))
+        try:
+            run_paths = []
+            buffer = [OCITable.get_hex(oci) for oci in self.pending]
+            max_len = max([self.width * 2] + [len(hex_oci) for hex_oci in buffer])
+            for oci in ocis:
+                hex_oci = OCITable.get_hex(oci)
+                buffer.append(hex_oci)
+                if len(hex_oci) > max_len:
+                    max_len = len(hex_oci)
+                if len(buffer) >= RUN_SIZE:
+                    run_paths.append(OCITable.__store_run(buffer, tmp_dir, len(run_paths)))
+                    buffer = []
+            buffer.sort(key=OCITable.get_sort_key)
+
+            width = (max_len + 1) // 2
+            run_files = [open(run_path) for run_path in run_paths]
+            try:
+                new_records = [(OCITable.pack(hex_oci, width) for hex_oci in buffer)] + \
+                              [(OCITable.pack(line.rstrip("\n"), width) for line in f) for f in run_files]
+                self.__merge(merge(*new_records), width)
+            finally:
+                for f in run_files:
+                    f.close()
+        finally:
+            rmtree(tmp_dir)
+
+        self.pending = set()
+        self.uncommitted = []
+        if exists(self.log_path):
+            remove(self.log_path)
+
+    @staticmethod
+    def __store_run(buffer, tmp_dir, idx):
+        buffer.sort(key=OCITable.get_sort_key)
+        run_path = tmp_dir + sep + "run_%s" % idx
+        with open(run_path, "w") as f:
+            f.writelines(hex_oci + "\n" for hex_oci in buffer)
+        return run_path
+
+    def __iter_records(self, width):
+        # The records of the table, padded to the new width specified
+        padding = b"\xff" * (width - self.width)
+        for idx in range(self.count):
+            start = TABLE_HEADER.size + idx * self.width
+            yield self.table[start:start + self.width] + padding
+
+    def __merge(self, new_records, width):
+        tmp_path = self.path + ".tmp"
+        self.__write(merge(self.__iter_records(width), new_records), width, tmp_path)
+        self.table.close()
+        self.file.close()
+        replace(tmp_path, self.path)
+        self.__open()
+
+    def __write(self, records, width, path=None):
+        count = 0
+        with open(self.path if path is None else path, "wb") as f:
+            f.write(TABLE_HEADER.pack(TABLE_MAGIC, width, 0))
+            previous = None
+            for record in records:
+                if record != previous:
+                    f.write(record)
+                    count += 1
+                    previous = record
+            f.seek(0)
+            f.write(TABLE_HEADER.pack(TABLE_MAGIC, width, count))
+            f.flush()
+            fsync(f.fileno())
+
+    def commit(self):
+        # The OCIs added are stored in the log, so as to not lose them if the process stops before closing the table
+        if self.uncommitted:
+            with open(self.log_path, "a") as f:
+                f.writelines(oci + "\n" for oci in self.uncommitted)
+                f.flush()
+                fsync(f.fileno())
+            self.uncommitted = []
+
+    def close(self):
+        if self.table is not None:
+            self.commit()
+            if self.pending and not self.read_only:
+                self.update(())
+            self.table.close()
+            self.file.close()
+            self.table = None
+
+
+# Magic number, number of bits, number of hash functions, capacity, OCIs added, OCIs in the index when last stored
+FILTER_HEADER = Struct(">4sQIQQQ")
+FILTER_MAGIC = b"OCIF"
+FILTER_ERROR_RATE = 0.01
+FILTER_MIN_CAPACITY = 1000000
+
+
+class OCIFilter(object):
+    # A Bloom filter of the OCIs in an index, which is consulted before it: since most of the citations processed
+    # are new, the index is queried only for the few OCIs that the filter may contain. The filter is memory-mapped
+    # from a file next to the index, and its bits are set before the OCIs are added to the index, so that it never
+    # misses any of them. It is rebuilt from the index when it does not exist, it exceeds its capacity, or the index
+    # has been changed without it (e.g. by a run of cnc.py with --no_filter), i.e. its size is not the one stored
+    # in the filter when last closed. In read-only mode (e.g. in the workers of cnc.py) the filter is never changed,
+    # and it is not used if not valid
+    def __init__(self, index, rebuild=False):
+        self.index = index
+        self.path = index.path
+        self.is_new = index.is_new
+        self.read_only = index.read_only
+        self.filter_path = OCIFilter.get_path(index.path)
+        self.filter = None
+
+        is_valid = not rebuild and not index.is_new and self.__open()
+        # The workers of cnc.py rely on the check done by the main process, which does not change the index meanwhile
+        if is_valid and not self.read_only and self.index_size != len(index):
+            self.__close()
+            is_valid = False
+        if not is_valid and not self.read_only:
+            self.rebuild()
+
+    @staticmethod
+    def get_path(index_path):
+        return index_path + ".bloom"
+
+    def __open(self, path=None):
+        if path is None:
+            path = self.filter_path
+        if not exists(path):
+            return False
+
+        self.file = open(path, "rb" if self.read_only else "r+b")
+        self.filter = mmap(self.file.fileno(), 0, access=ACCESS_READ if self.read_only else ACCESS_WRITE)
+        if len(self.filter) >= FILTER_HEADER.size:
+            magic, self.bits, self.hashes, self.capacity, self.count, self.index_size = \
+                FILTER_HEADER.unpack_from(self.filter)
+            if magic == FILTER_MAGIC and len(self.filter) == FILTER_HEADER.size + (self.bits + 7) // 8:
+                return True
+
+        self.__close()
+        return False
+
+    def __close(self):
+        if self.filter is not None:
+            self.filter.close()
+            self.file.close()
+            self.filter = None
+
+    def rebuild(self):
+        # The new filter is filled in a temporary file, which replaces the old one only when complete
+        index_size = len(self.index)
+        capacity = max(FILTER_MIN_CAPACITY, index_size * 2)
+        bits = int(ceil(-capacity * log(FILTER_ERROR_RATE) / log(2) ** 2))
+        hashes = max(1, int(round(bits / capacity * log(2))))
+
+        tmp_path = self.filter_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILTER_HEADER.pack(FILTER_MAGIC, bits, hashes, capacity, 0, index_size))
+            f.truncate(FILTER_HEADER.size + (bits + 7) // 8)
+
+        self.__close()
+        self.__open(tmp_path)
+        for oci in self.index:
+            self.__set(oci)
+        self.__flush()
+        self.__close()
+        replace(tmp_path, self.filter_path)
+        self.__open()
+
+    def __get_positions(self, oci):
+        # Double hashing on the two halves of a 128-bit digest
+        h = int.from_bytes(blake2b(oci.encode("utf-8"), digest_size=16).digest(), "big")
+        h1 = h >> 64
+        h2 = (h & 0xffffffffffffffff) | 1
+        return [(h1 + idx * h2) % self.bits for idx in range(self.hashes)]
+
+    def __may_contain(self, oci):
+        # The same positions of __get_positions, stopping at the first bit not set
+        h = int.from_bytes(blake2b(oci.encode("utf-8"), digest_size=16).digest(), "big")
+        pos = h >> 64
+        h2 = (h & 0xffffffffffffffff) | 1
+        f = self.filter
+        bits = self.bits
+        for idx in range(self.hashes):
+            cur = pos % bits
+            if not f[FILTER_HEADER.size + (cur >> 3)] & (1 << (cur & 7)):
+                return False
+            pos += h2
+        return True
+
+    def __set(self, oci):
+        f = self.filter
+        is_added = False
+        for pos in self.__get_positions(oci):
+            idx = FILTER_HEADER.size + (pos >> 3)
+            if not f[idx] & (1 << (pos & 7)):
+                f[idx] |= 1 << (pos & 7)
+                is_added = True
+        if is_added:
+            self.count += 1
+
+    def __iter_set(self, ocis):
+        for oci in ocis:
+            self.__set(oci)
+            yield oci
+
+    def __contains__(self, oci):
+        return (self.filter is None or self.__may_contain(oci)) and oci in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __check_writable(self):
+        if self.read_only:
+            raise ValueError("The filter of OCIs '%s' is open in read-only mode." % self.filter_path)
+
+    def add(self, oci):
+        self.__check_writable()
+        self.__set(oci)
+        self.index.add(oci)
+
+    def update(self, ocis):
+        self.__check_writable()
+        self.index.update(self.__iter_set(ocis))
+        self.commit()
+
+    def __flush(self):
+        FILTER_HEADER.pack_into(self.filter, 0, FILTER_MAGIC, self.bits, self.hashes, self.capacity, self.count,
+                                self.index_size)
+        self.filter.flush()
+
+    def commit(self):
+        # The filter is stored before the index, so that it always contains all the OCIs stored in the latter
+        if not self.read_only:
+            self.__flush()
+        self.index.commit()
+        if not self.read_only and self.count > self.capacity:
+            self.rebuild()
+
+    def close(self):
+        if self.index is not None:
+            if not self.read_only:
+                self.commit()
+                self.index_size = len(self.index)
+                self.__flush()
+            self.__close()
+            self.index.close()
+            self.index = None
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from threading import Lock
+from time import time, sleep
+from re import match
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class HTTPSession(object):
+    def __init__(self, pool_size=10, retries=3, backoff=1, timeout=30):
+        self.timeout = timeout
+        self.session = Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS,
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = Lock()
+        self.interval = {}  # The minimum number of seconds between two requests to the same host
+        self.next_request = {}
+
+    def get(self, url, headers=None, timeout=None):
+        return self.request("GET", url, headers=headers, timeout=timeout)
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        return self.request("POST", url, data=data, headers=headers, timeout=timeout)
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        host = urlparse(url).netloc
+        self.__wait(host)
+        res = self.session.request(method, url, data=data, headers=headers,
+                                   timeout=self.timeout if timeout is None else timeout)
+        self.__update_rate_limit(host, res.headers)
+        return res
+
+    def set_rate_limit(self, host, requests_per_second):
+        with self.lock:
+            self.interval[host] = 1.0 / requests_per_second
+
+    def __wait(self, host):
+        with self.lock:
+            interval = self.interval.get(host)
+            if interval is None:
+                return
+            now = time()
+            slot = max(now, self.next_request.get(host, now))
+            self.next_request[host] = slot + interval
+        if slot > now:
+            sleep(slot - now)
+
+    def __update_rate_limit(self, host, headers):
+        # Crossref (and other services) declare the requests allowed per time interval, e.g. 50 every '1s'
+        limit = headers.get("X-Rate-Limit-Limit")
+        interval = headers.get("X-Rate-Limit-Interval")
+        if limit and interval:
+            interval_match = match("^([0-9]+)s?$", interval.strip())
+            if limit.strip().isdigit() and int(limit) > 0 and interval_match:
+                with self.lock:
+                    self.interval[host] = int(interval_match.group(1)) / int(limit)
+
+    def close(self):
+        self.session.close()
+
+
+DEFAULT_SESSION = HTTPSession()
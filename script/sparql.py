@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from SPARQLWrapper import SPARQLWrapper, JSON, GET, POST
+from threading import local, Lock
+from functools import lru_cache
+from json import loads
+from re import compile, IGNORECASE
+
+
+SPARQL_BATCH_SIZE = 100
+MAX_GET_LENGTH = 2000
+ROW_VARIABLE = "oci_row"
+TERM_VARIABLE = "oci_term_%s"
+LITERAL_SUFFIX = "(?:\\^\\^(?:<[^<>\\s]*>|[A-Za-z][\\w.\\-]*:[\\w.\\-]*)|@[A-Za-z]+(?:-[A-Za-z0-9]+)*)?"
+TERM = compile("\"(?:[^\"\\\\\\n]|\\\\.)*\"" + LITERAL_SUFFIX + "|" +
+               "'(?:[^'\\\\\\n]|\\\\.)*'" + LITERAL_SUFFIX + "|" +
+               "<[^<>\"{}|^`\\\\\\s]*>")
+PLACEHOLDER = compile("\\[\\[CIT(?:ING|ED)\\]\\]")
+CITING_PLACEHOLDER = compile("\\[\\[CITING\\]\\]")
+CITED_PLACEHOLDER = compile("\\[\\[CITED\\]\\]")
+UNSUPPORTED = compile("\\b(GROUP\\s+BY|HAVING|OFFSET|MINUS|COUNT|SUM|MIN|MAX|AVG|SAMPLE|GROUP_CONCAT)\\b|#|\"\"\"|'''",
+                      IGNORECASE)
+SELECT = compile("\\bSELECT\\s+((DISTINCT|REDUCED)\\s+)?", IGNORECASE)
+LIMIT = compile("\\bLIMIT\\s+[0-9]+", IGNORECASE)
+
+
+class SPARQLExecutor(object):
+    def __init__(self):
+        # The wrappers are not thread-safe, thus each thread reuses its own wrapper for each endpoint
+        self.local = local()
+
+    def __call__(self, endpoint, query):
+        sparql = self.get_wrapper(endpoint)
+        sparql.setMethod(POST if len(query) > MAX_GET_LENGTH else GET)
+        sparql.setQuery(query)
+        return sparql.query().convert()["results"]["bindings"]
+
+    def get_wrapper(self, endpoint):
+        wrappers = getattr(self.local, "wrappers", None)
+        if wrappers is None:
+            wrappers = self.local.wrappers = {}
+
+        sparql = wrappers.get(endpoint)
+        if sparql is None:
+            sparql = SPARQLWrapper(endpoint)
+            sparql.setReturnFormat(JSON)
+            wrappers[endpoint] = sparql
+
+        return sparql
+
+
+class SPARQLUpdater(SPARQLExecutor):
+    def __call__(self, endpoint, update):
+        sparql = self.get_wrapper(endpoint)
+        sparql.setMethod(POST)
+        sparql.setQuery(update)
+        sparql.query()
+
+
+class GraphExecutor(object):
+    def __init__(self, graph):
+        # It runs the queries on a local rdflib graph in place of the endpoint, e.g. for testing the services
+        self.graph = graph
+        self.lock = Lock()
+
+    def __call__(self, endpoint, query):
+        with self.lock:
+            return loads(self.graph.query(query).serialize(format="json"))["results"]["bindings"]
+
+
+class GraphUpdater(object):
+    def __init__(self, graph):
+        # It runs the updates on a local rdflib dataset in place of the triplestore, e.g. for testing the uploads
+        self.graph = graph
+        self.lock = Lock()
+
+    def __call__(self, endpoint, update):
+        with self.lock:
+            self.graph.update(update)
+
+
+class BatchQuery(object):
+    def __init__(self, query):
+        # All the IRIs and literals containing the placeholders of the query are replaced by variables, that are
+        # bound to the values of each citing and cited entity in a VALUES clause, together with the row number
+        # identifying the pair the bindings returned refer to
+        self.terms = {}
+        if not PLACEHOLDER.search(query) or ROW_VARIABLE in query or TERM_VARIABLE % "" in query:
+            raise ValueError("The query does not use any placeholder or uses the variables of the batch.")
+
+        query = TERM.sub(self.__replace_term, query)
+        skeleton = TERM.sub(lambda m: " " * len(m.group(0)), query)
+        if PLACEHOLDER.search(query) or UNSUPPORTED.search(skeleton) or len(SELECT.findall(skeleton)) != 1:
+            raise ValueError("The query cannot be run in batch.")
+
+        select_end = SELECT.search(skeleton).end()
+        where_start = skeleton.find("{", select_end) + 1
+        where_end = skeleton.rfind("}") + 1
+        if not where_start or where_end <= where_start:
+            raise ValueError("The query does not specify any graph pattern.")
+
+        projection = "" if skeleton[select_end] == "*" else "?%s " % ROW_VARIABLE
+        self.head = query[:select_end] + projection + query[select_end:where_start]
+        self.tail = query[where_start:where_end] + LIMIT.sub("", query[where_end:])
+        self.variables = " ".join(["?" + ROW_VARIABLE] + ["?" + variable for variable in self.terms.values()])
+
+    def __replace_term(self, term_match):
+        term = term_match.group(0)
+        if PLACEHOLDER.search(term):
+            if term not in self.terms:
+                self.terms[term] = TERM_VARIABLE % len(self.terms)
+            return "?" + self.terms[term]
+        else:
+            return term
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_batch_query(query):
+        try:
+            return BatchQuery(query)
+        except ValueError:
+            return None
+
+    def get_values(self, citing, cited):
+        # The same substitutions done for the query of a single citation
+        result = []
+
+        for term in self.terms:
+            value = CITED_PLACEHOLDER.sub(cited, CITING_PLACEHOLDER.sub(citing, term))
+            if not TERM.fullmatch(value):
+                return None  # The identifiers break the term, the citation must be retrieved on its own
+            result.append(value)
+
+        return result
+
+    def get_query(self, values):
+        rows = " ".join("(%s %s)" % (idx, " ".join(row)) for idx, row in enumerate(values))
+        return "%s VALUES (%s) { %s } %s" % (self.head, self.variables, rows, self.tail)
+
+    @staticmethod
+    def demultiplex(bindings, n):
+        # The first answer returned for each row, as for the queries of single citations
+        result = [None] * n
+
+        for binding in bindings:
+            idx = int(binding[ROW_VARIABLE]["value"])
+            if result[idx] is None:
+                result[idx] = binding
+
+        return result
+
+
+DEFAULT_SPARQL = SPARQLExecutor()
+DEFAULT_UPDATE = SPARQLUpdater()
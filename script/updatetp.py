@@ -17,24 +17,321 @@
 __author__ = 'essepuntato'
 
 from datetime import datetime
-from os.path import abspath, isdir, sep
-from os import walk, system
+from os.path import abspath, isdir, sep, exists, getsize
+from os import walk, replace, remove, fsync, close, stat
 from argparse import ArgumentParser
 from glob import glob
 from re import sub
-from os.path import basename
+from json import load, loads, dumps
+from hashlib import sha256
+from threading import Lock
+from tempfile import mkstemp
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import partial
+from urllib.parse import quote
+from time import time, sleep
+from script.sparql import DEFAULT_UPDATE
+from script.session import HTTPSession, RETRY_STATUS
+from script.manifest import ManifestManager
+from script.compact import open_text
+import gzip
 
-from SPARQLWrapper import SPARQLWrapper
+JOURNAL = "updatetp_journal_%s.json"
+READ_SIZE = 1048576
+CHUNK_SIZE = 10000
+UPLOAD_TIMEOUT = 300
+# The N-Triples files created by cnc.py and the shards created by compact.py
+RDF_EXTENSIONS = (".nt", ".ttl", ".nt.gz", ".ttl.gz")
+MODES = ("load", "insert", "graph_store")
 
 
-def add(server, g_url, f_n, date_str, type_file):
-    server = SPARQLWrapper(server)
-    server.method = 'POST'
-    server.setQuery('LOAD <file:' + abspath(f_n) + '> INTO GRAPH <' + g_url + '>')
-    server.query()
+class LoadJournal(object):
+    def __init__(self, path, type_file=None):
+        # The files loaded are identified by their absolute path and the checksum of their content, so as to
+        # reload them if they have been changed after their upload
+        self.path = path
+        self.lock = Lock()
+        self.files = {}
+        self.stats = {}  # path -> (size, modification time) of the files when their checksums were computed
+        if exists(path):
+            self.__load()
 
-    with open("updatetp_report_%s_%s.txt" % (type_file, date_str), "a") as h:
-        h.write("Added file '%s'\n" % f_n)
+        # The files listed in the reports of the previous versions of this script are considered as loaded
+        self.legacy = set()
+        if type_file is not None:
+            for file in glob("updatetp_report_%s_*.txt" % type_file):
+                with open(file) as f:
+                    for line in f.readlines():
+                        self.legacy.add(abspath(sub("^.+'([^']+)'.*$", "\\1", line).strip()))
+
+    def is_loaded(self, f_path, checksum):
+        entry = self.files.get(f_path)
+        if entry is None:
+            return f_path in self.legacy
+        else:
+            return entry["checksum"] == checksum
+
+    def get_checksum(self, f_path, checksum=None):
+        # The checksum recorded is reused if the size and the modification time of the file have not changed
+        # since its upload, so as to not read all the files already loaded at each run
+        f_stat = stat(f_path)
+        self.stats[f_path] = f_stat.st_size, f_stat.st_mtime_ns
+        if checksum is None:
+            entry = self.files.get(f_path)
+            if entry is not None and (entry.get("size"), entry.get("mtime")) == self.stats[f_path]:
+                checksum = entry["checksum"]
+            else:
+                checksum = get_checksum(f_path)
+        return checksum
+
+    def add(self, files, g_url):
+        # The entries are appended to the journal, so as to not rewrite it after each upload
+        with self.lock:
+            date_str = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+            with open(self.path, "a") as f:
+                for f_path, checksum in files:
+                    size, mtime = self.stats.get(f_path, (None, None))
+                    self.files[f_path] = {"checksum": checksum, "graph": g_url, "date": date_str,
+                                          "size": size, "mtime": mtime}
+                    f.write(LoadJournal.__get_line(f_path, self.files[f_path]))
+                f.flush()
+                fsync(f.fileno())
+
+    def __load(self):
+        # One JSON object per line, the last one of each file prevailing. The journal is rewritten if it has been
+        # written as a single JSON object by the previous versions of this script, if its last line has been
+        # truncated, or if most of its lines are outdated
+        with open(self.path) as f:
+            first_line = f.readline()
+            f.seek(0)
+            if first_line.strip() in ("{", "{}"):
+                self.files = load(f)
+                to_save = True
+            else:
+                lines = 0
+                to_save = False
+                for line in f:
+                    if line.strip():
+                        try:
+                            entry = loads(line)
+                            self.files[entry.pop("path")] = entry
+                            lines += 1
+                        except (ValueError, KeyError):
+                            to_save = True
+                to_save = to_save or lines > 2 * len(self.files)
+
+        if to_save:
+            self.__save()
+
+    def __save(self):
+        # Written in a temporary file and then renamed, so as to never leave a truncated journal
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for f_path in sorted(self.files):
+                f.write(LoadJournal.__get_line(f_path, self.files[f_path]))
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp_path, self.path)
+
+    @staticmethod
+    def __get_line(f_path, entry):
+        return dumps(dict(entry, path=f_path), sort_keys=True) + "\n"
+
+
+def get_checksum(f_path):
+    checksum = sha256()
+    with open(f_path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def get_to_upload(all_files, journal, checksums=None):
+    # The files not loaded yet or changed after their upload, with their checksums
+    to_upload = []
+    for f_path in all_files:
+        checksum = journal.get_checksum(f_path, checksums.get(f_path) if checksums else None)
+        if not journal.is_loaded(f_path, checksum):
+            to_upload.append((f_path, checksum))
+    return to_upload
+
+
+def get_batches(files, batch_size):
+    # Consecutive files are grouped until their total size reaches batch_size, the bigger ones are loaded alone
+    batches = []
+    cur_batch = []
+    cur_size = 0
+
+    for f_path, checksum in files:
+        f_size = getsize(f_path)
+        if cur_batch and cur_size + f_size > batch_size:
+            batches.append(cur_batch)
+            cur_batch = []
+            cur_size = 0
+        cur_batch.append((f_path, checksum))
+        cur_size += f_size
+
+    if cur_batch:
+        batches.append(cur_batch)
+
+    return batches
+
+
+def merge_files(files, batch_dir):
+    # It works with N-Triples files, such as the .ttl files created by cnc.py, since their concatenation is
+    # still a valid file, and the compressed shards are decompressed
+    extension = ".ttl" if any(f_path.endswith((".ttl", ".ttl.gz")) for f_path, checksum in files) else ".nt"
+    fd, batch_path = mkstemp(suffix=extension, prefix="updatetp_batch_", dir=batch_dir)
+    close(fd)
+    with open(batch_path, "wb") as out:
+        for f_path, checksum in files:
+            with gzip.open(f_path, "rb") if f_path.endswith(".gz") else open(f_path, "rb") as f:
+                last = b"\n"
+                for block in iter(lambda: f.read(READ_SIZE), b""):
+                    out.write(block)
+                    last = block[-1:]
+                if last != b"\n":
+                    out.write(b"\n")
+    return batch_path
+
+
+def add(server, g_url, f_n, updater=DEFAULT_UPDATE):
+    updater(server, 'LOAD <file:' + abspath(f_n) + '> INTO GRAPH <' + g_url + '>')
+
+
+def add_batch(server, g_url, files, journal, batch_dir=None, updater=DEFAULT_UPDATE):
+    # The triplestore may not read compressed files, thus a compressed shard is loaded through a batch file
+    if len(files) == 1 and not files[0][0].endswith(".gz"):
+        add(server, g_url, files[0][0], updater)
+    else:
+        batch_path = merge_files(files, batch_dir)
+        try:
+            add(server, g_url, batch_path, updater)
+        finally:
+            remove(batch_path)
+    journal.add(files, g_url)
+    return files
+
+
+def upload(server, g_url, all_files, journal, workers=1, batch_size=0, batch_dir=None, updater=DEFAULT_UPDATE):
+    batches = get_batches(all_files, batch_size) if batch_size > 0 else [[f_item] for f_item in all_files]
+    print("%s files to upload in %s loads." % (len(all_files), len(batches)))
+
+    errors = 0
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(add_batch, server, g_url, batch, journal, batch_dir, updater)
+                   for batch in batches]
+        for future in as_completed(futures):
+            try:
+                for f_path, checksum in future.result():
+                    print("Uploaded file '%s'" % f_path)
+            except Exception as e:
+                errors += 1
+                print("ERROR: %s" % e)
+
+    return errors
+
+
+def iter_chunks(f_path, chunk_size):
+    # The triples of an N-Triples file, in lists of at most chunk_size triples
+    chunk = []
+    with open_text(f_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                chunk.append(line if line.endswith("\n") else line + "\n")
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_data(session, server, g_url, triples):
+    update = "INSERT DATA { GRAPH <%s> {\n%s} }" % (g_url, "".join(triples))
+    return session.post(server, data=update.encode("utf-8"),
+                        headers={"Content-Type": "application/sparql-update; charset=utf-8"})
+
+
+def post_graph(session, server, g_url, triples):
+    # Graph Store HTTP Protocol, where server is the URL of the graph store
+    return session.post(server + ("&" if "?" in server else "?") + "graph=" + quote(g_url, safe=""),
+                        data="".join(triples).encode("utf-8"), headers={"Content-Type": "application/n-triples"})
+
+
+def send_chunk(send, session, server, g_url, triples, retries):
+    # Adding the same triples twice does not change the graph, thus the chunks can be sent again safely
+    for attempt in range(retries + 1):
+        try:
+            res = send(session, server, g_url, triples)
+            if res.status_code < 300:
+                return len(triples)
+            error = "HTTP status %s: %s" % (res.status_code, res.text[:200])
+            if res.status_code not in RETRY_STATUS:
+                break
+        except Exception as e:
+            error = str(e)
+        if attempt < retries:
+            sleep(2 ** attempt)
+
+    raise Exception("The upload of %s triples failed (%s)." % (len(triples), error))
+
+
+def upload_stream(server, g_url, all_files, journal, workers=1, chunk_size=CHUNK_SIZE, mode="insert",
+                  session=None, retries=3):
+    # The triples are sent by the workers in chunks, and a file is recorded in the journal only when all its
+    # chunks have been uploaded
+    send = partial(send_chunk, post_graph if mode == "graph_store" else insert_data,
+                   HTTPSession(workers, 0, timeout=UPLOAD_TIMEOUT) if session is None else session,
+                   server, g_url)
+    print("%s files to upload in chunks of %s triples." % (len(all_files), chunk_size))
+
+    start = time()
+    uploaded = [0]
+    failed = set()
+    files = {}  # path -> [checksum, chunks not completed yet]
+    futures = {}
+
+    def finish(f_path):
+        files[f_path][1] -= 1
+        if not files[f_path][1]:
+            checksum = files.pop(f_path)[0]
+            if f_path not in failed:
+                journal.add([(f_path, checksum)], g_url)
+                elapsed = time() - start
+                print("Uploaded file '%s' (%s triples so far, %.0f triples/s)" %
+                      (f_path, uploaded[0], uploaded[0] / elapsed if elapsed else 0))
+
+    def complete(done):
+        for future in done:
+            f_path = futures.pop(future)
+            try:
+                uploaded[0] += future.result()
+            except Exception as e:
+                if f_path not in failed:
+                    failed.add(f_path)
+                    print("ERROR: '%s' not uploaded. %s" % (f_path, e))
+            finish(f_path)
+
+    with ThreadPoolExecutor(workers) as executor:
+        for f_path, checksum in all_files:
+            files[f_path] = [checksum, 1]  # Plus one until all the chunks of the file have been submitted
+            try:
+                for chunk in iter_chunks(f_path, chunk_size):
+                    if len(futures) >= workers * 2:
+                        complete(wait(futures, return_when=FIRST_COMPLETED).done)
+                    files[f_path][1] += 1
+                    futures[executor.submit(send, chunk, retries)] = f_path
+            except Exception as e:
+                failed.add(f_path)
+                print("ERROR: '%s' not uploaded. %s" % (f_path, e))
+            finish(f_path)
+
+        complete(wait(futures).done)
+
+    elapsed = time() - start
+    print("%s triples uploaded in %.1f seconds (%.0f triples/s)." %
+          (uploaded[0], elapsed, uploaded[0] / elapsed if elapsed else 0))
+    return len(failed)
 
 
 if __name__ == "__main__":
@@ -43,20 +340,49 @@ if __name__ == "__main__":
                                                            "the graph enclosing them.")
     arg_parser.add_argument("-s", "--sparql_endpoint",
                             dest="se_url", required=True,
-                            help="The URL of the SPARQL endpoint.")
+                            help="The URL of the SPARQL endpoint (or of the graph store, when the mode "
+                                 "'graph_store' is used).")
     arg_parser.add_argument("-i", "--input_file", dest="input_file", required=True,
                             help="The path to the NT file to upload on the triplestore.")
     arg_parser.add_argument("-g", "--graph", dest="graph_name", required=True,
                             help="The graph URL to associate to the triples.")
     arg_parser.add_argument("-f", "--force", dest="force", default=False, action="store_true",
                             help="Force the creation of the triples associated to the input graph.")
+    arg_parser.add_argument("-m", "--mode", dest="mode", default="load", choices=MODES,
+                            help="How to upload the triples: asking the triplestore to LOAD the files from the "
+                                 "filesystem (default), sending their triples in INSERT DATA updates, or posting "
+                                 "them to a graph store (SPARQL 1.1 Graph Store HTTP Protocol).")
+    arg_parser.add_argument("-w", "--workers", dest="workers", default=1, type=int,
+                            help="The number of requests sent to the triplestore in parallel.")
+    arg_parser.add_argument("-c", "--chunk_size", dest="chunk_size", default=CHUNK_SIZE, type=int,
+                            help="The number of triples sent in each request, in the modes 'insert' and "
+                                 "'graph_store'.")
+    arg_parser.add_argument("-r", "--retries", dest="retries", default=3, type=int,
+                            help="The number of times a request is sent again after a failure, in the modes "
+                                 "'insert' and 'graph_store'.")
+    arg_parser.add_argument("-b", "--batch_size", dest="batch_size", default=0, type=int,
+                            help="If specified, the N-Triples files smaller than this number of bytes are "
+                                 "concatenated into batches of at most that size, each loaded with one request.")
+    arg_parser.add_argument("-d", "--batch_dir", dest="batch_dir", default=None,
+                            help="The directory where to store the batches and the decompressed shards created by "
+                                 "compact.py, that must be readable by the triplestore (default: the temporary "
+                                 "directory of the system).")
+    arg_parser.add_argument("-n", "--manifest", dest="manifest", default=None,
+                            help="The directory of the manifests written by cnc.py. If specified, only the files "
+                                 "listed in the manifests and contained in the input directory are uploaded, "
+                                 "without scanning the whole input directory.")
+    arg_parser.add_argument("-t", "--since", dest="since", default=None,
+                            help="Used with the manifests, consider only the runs of cnc.py started after this "
+                                 "time (e.g. '2019-06-01T00:00:00').")
+    arg_parser.add_argument("-j", "--journal", dest="journal", default=None,
+                            help="The file recording the files already uploaded, in JSON lines (default: "
+                                 "'%s' in the current directory)." % (JOURNAL % "<data|prov>"))
 
     args = arg_parser.parse_args()
 
     SE_URL = args.se_url
     INPUT_FILE = args.input_file
     GRAPH_URL = args.graph_name
-    date_str = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
     type_file = "prov" if "prov" + sep in INPUT_FILE else "data"
 
     if not args.force and type_file == "prov" and type_file not in GRAPH_URL:
@@ -69,28 +395,45 @@ if __name__ == "__main__":
 
     print("# Process starts")
 
-    already_done = set()
-    for file in glob("updatetp_report_%s_*.txt" % type_file):
-        with open(file) as f:
-            for line in f.readlines():
-                already_done.add(basename(sub("^.+'([^']+)'.*$", "\\1", line)).strip())
+    journal = LoadJournal(JOURNAL % type_file if args.journal is None else args.journal, type_file)
 
     all_files = []
-    if isdir(INPUT_FILE):
+    checksums = {}
+    if args.manifest is not None:
+        # The checksums computed by cnc.py are reused, so as to not read the files before uploading them
+        input_path = abspath(INPUT_FILE)
+        last_time = None
+        for manifest in ManifestManager.iter_manifests(args.manifest, args.since):
+            for entry in manifest["files"]:
+                cur_file_abs_path = ManifestManager.get_path(args.manifest, entry)
+                if (cur_file_abs_path == input_path or cur_file_abs_path.startswith(input_path + sep)) and \
+                        cur_file_abs_path.endswith(RDF_EXTENSIONS):
+                    if exists(cur_file_abs_path):
+                        all_files.append(cur_file_abs_path)
+                        checksums[cur_file_abs_path] = entry["sha256"]
+                    else:
+                        print("WARNING: the file '%s' listed in the manifest does not exist" % cur_file_abs_path)
+            last_time = manifest["time"]
+        if last_time is not None:
+            print("Files listed in the manifests until the run of '%s'." % last_time)
+    elif isdir(INPUT_FILE):
         for cur_dir, cur_subdir, cur_files in walk(INPUT_FILE):
-            for cur_file in cur_files:
-                cur_file_abs_path = cur_dir + sep + cur_file
-                if basename(cur_file_abs_path) not in already_done and \
-                        (cur_file_abs_path.endswith(".nt") or cur_file_abs_path.endswith(".ttl")):
+            cur_subdir.sort()
+            for cur_file in sorted(cur_files):
+                cur_file_abs_path = abspath(cur_dir + sep + cur_file)
+                if cur_file_abs_path.endswith(RDF_EXTENSIONS):
                     all_files.append(cur_file_abs_path)
     else:
-        all_files.append(INPUT_FILE)
+        all_files.append(abspath(INPUT_FILE))
 
-    print("%s files to upload." % str(len(all_files)))
+    to_upload = get_to_upload(all_files, journal, checksums)
 
-    for idx, cur_file in enumerate(all_files):
-        print("\nUploading file '%s'" % cur_file)
-        add(SE_URL, GRAPH_URL, cur_file, date_str, type_file)
-        print("Done.")
+    if args.mode == "load":
+        errors = upload(SE_URL, GRAPH_URL, to_upload, journal, args.workers, args.batch_size, args.batch_dir)
+    else:
+        errors = upload_stream(SE_URL, GRAPH_URL, to_upload, journal, args.workers, args.chunk_size, args.mode,
+                               retries=args.retries)
+    if errors:
+        print("%s uploads failed, run the script again to upload the remaining files." % errors)
 
-    print("# Process ends")
\ No newline at end of file
+    print("# Process ends")
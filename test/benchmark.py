@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+from argparse import ArgumentParser
+from json import loads
+from timeit import repeat
+from xml.etree import ElementTree
+from script.oci import OCICodec, Citation, QUERY_FIELDS
+from test.test_oci import create_manager, read_api_data, get_lookups, get_dois, encode, decode, get_id, \
+    get_citations, UncachedCitation, JSON_DATA, XML_DATA, JSON_QUERY, XML_QUERY, CITING, CITED, API, ID_SHAPES
+
+
+def measure(name, f, number, baseline=None, size=1):
+    # The best of some repetitions, in microseconds per call (or per item, if the call processes many of
+    # them), compared with the baseline if specified
+    result = min(repeat(f, number=number, repeat=5)) / number / size * 1000000
+    if baseline is None:
+        print("%-40s %10.2f us" % (name, result))
+    else:
+        print("%-40s %10.2f us (%.1fx)" % (name, result, baseline / result))
+    return result
+
+
+def access_benchmark(number):
+    om = create_manager()
+    read_data = om._OCIManager__read_api_data
+    read_fields = om._OCIManager__read_api_fields
+    # A large XML response, where the elements looked for follow many others
+    big_xml = XML_DATA.replace("<p:article>", "<p:article>" + "<p:keyword>k</p:keyword>" * 500, 1)
+
+    for name, type_format, data, query in (("JSON", "json", loads(JSON_DATA), JSON_QUERY),
+                                           ("XML", "xml", ElementTree.fromstring(XML_DATA), XML_QUERY),
+                                           ("large XML", "xml", ElementTree.fromstring(big_xml), XML_QUERY)):
+        print("\nAll the fields of a %s response" % name)
+        baseline = measure("interpreted", lambda: [read_api_data(
+            om, data, type_format, query[field], CITING, CITED, API) for field in QUERY_FIELDS], number)
+        measure("compiled", lambda: [read_data(
+            data, type_format, query[field], CITING, CITED, API) for field in QUERY_FIELDS], number, baseline)
+        measure("compiled, with shared operations", lambda: read_fields(
+            data, type_format, query, CITING, CITED, API), number, baseline)
+
+
+def codec_benchmark(number):
+    size = 100000
+    for name, (lookup, inverse_lookup) in zip(("two-digit codes", "codes of different length"), get_lookups()):
+        codec = OCICodec(lookup, inverse_lookup)
+        dois = get_dois(list(inverse_lookup), size, 0)
+        codes = codec.encode_many(dois)
+        repetitions = max(1, number // 1000)
+
+        print("\nEncoding of %s identifiers, with %s" % (size, name))
+        baseline = measure("per character", lambda: [encode(inverse_lookup, doi) for doi in dois],
+                           repetitions, size=size)
+        measure("encode", lambda: [codec.encode(doi) for doi in dois], repetitions, baseline, size)
+        measure("encode_many", lambda: codec.encode_many(dois), repetitions, baseline, size)
+
+        print("\nDecoding of %s identifiers, with %s" % (size, name))
+        baseline = measure("per code", lambda: [decode(lookup, s) for s in codes], repetitions, size=size)
+        measure("decode", lambda: [codec.decode(s) for s in codes], repetitions, baseline, size)
+        measure("decode_many", lambda: codec.decode_many(codes), repetitions, baseline, size)
+
+
+def id_benchmark(number):
+    id_shape = ID_SHAPES[0]
+    citations = get_citations(Citation, id_shape)
+    uncached_citations = get_citations(UncachedCitation, id_shape)
+    urls = [citation.citing_url for citation in citations]
+    size = len(citations)
+    repetitions = max(1, number // 10)
+
+    print("\nExtraction of the identifiers from %s entity URLs" % size)
+    baseline = measure("uncached", lambda: [get_id(id_shape, url) for url in urls], repetitions, size=size)
+    measure("cached", lambda: [Citation.get_id_extractor(id_shape)(url) for url in urls],
+            repetitions, baseline, size)
+
+    for name in ("get_citation_json", "get_citation_scholix"):
+        print("\nSerialisation of %s citations with %s" % (size, name))
+        baseline = measure("uncached", lambda: [getattr(citation, name)() for citation in uncached_citations],
+                           repetitions, size=size)
+        measure("cached", lambda: [getattr(citation, name)() for citation in citations], repetitions, baseline, size)
+
+
+BENCHMARKS = {
+    "access": access_benchmark,
+    "codec": codec_benchmark,
+    "id": id_benchmark
+}
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser("benchmark.py",
+                                description="This script measures the time spent by the main operations "
+                                            "implemented in the scripts, comparing it with the one of "
+                                            "the implementations they replaced.")
+    arg_parser.add_argument("-b", "--benchmarks", nargs="+", choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS),
+                            help="The benchmarks to run.")
+    arg_parser.add_argument("-n", "--number", default=1000, type=int,
+                            help="The number of times each operation is repeated in a measure.")
+    args = arg_parser.parse_args()
+
+    for benchmark in args.benchmarks:
+        BENCHMARKS[benchmark](args.number)
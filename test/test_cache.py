@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from json import dumps
+from os import sep
+from tempfile import TemporaryDirectory
+from sqlite3 import connect
+from script.cache import ResponseCache, DAY, TOUCH_SIZE
+from script.cnc import DOIManager, CrossrefManager, DataCiteManager, ORCIDManager
+
+
+class Response(object):
+    def __init__(self, status_code, obj=None):
+        self.status_code = status_code
+        self.text = dumps(obj) if obj is not None else "Not found"
+        self.encoding = None
+
+
+class Session(object):
+    # The responses are chosen by the DOI contained in the URL, and an exception is raised for the DOIs
+    # without any response
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url, headers=None, timeout=None):
+        for doi, response in self.responses.items():
+            if doi in url:
+                return response
+        raise ConnectionError("Service not available")
+
+
+class ManagerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cache = ResponseCache(self.tmp.name + sep + "cache.db")
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def assert_cached(self, source, doi, value, negative):
+        found, cached = self.cache.get(source, doi)
+        self.assertTrue(found)
+        self.assertEqual(value, cached)
+        expires = self.cache.conn.execute("SELECT expires - accessed FROM cache WHERE source = ? AND key = ?",
+                                          (source, doi)).fetchone()[0]
+        self.assertEqual(negative, expires <= DAY + 1)
+
+    def assert_not_cached(self, source, doi):
+        self.assertEqual((False, None), self.cache.get(source, doi))
+
+    def test_doi(self):
+        doim = DOIManager(self.cache, Session({
+            "10.1000/found": Response(200, {"responseCode": 1}),
+            "10.1000/missing": Response(404, {"responseCode": 100}),
+            "10.1000/unavailable": Response(503)}))
+        self.assertTrue(doim.is_valid("10.1000/found"))
+        self.assertFalse(doim.is_valid("10.1000/missing"))
+        self.assertFalse(doim.is_valid("10.1000/unavailable"))
+        self.assertRaises(ConnectionError, doim.is_valid, "10.1000/error")
+
+        self.assert_cached("doi", "10.1000/found", True, False)
+        self.assert_cached("doi", "10.1000/missing", False, True)
+        self.assert_not_cached("doi", "10.1000/unavailable")
+        self.assert_not_cached("doi", "10.1000/error")
+
+    def test_datacite(self):
+        dm = DataCiteManager(self.cache, Session({
+            "10.1000/found": Response(200, {"data": {"attributes": {"published": "2019"}}}),
+            "10.1000/missing": Response(404),
+            "10.1000/unavailable": Response(503)}))
+        self.assertEqual("2019", dm.get_date("10.1000/found"))
+        self.assertIsNone(dm.get_date("10.1000/missing"))
+        self.assertIsNone(dm.get_date("10.1000/unavailable"))
+        self.assertRaises(ConnectionError, dm.get_date, "10.1000/error")
+
+        self.assert_cached("datacite", "10.1000/found", "2019", False)
+        self.assert_cached("datacite", "10.1000/missing", None, True)
+        self.assert_not_cached("datacite", "10.1000/unavailable")
+        self.assert_not_cached("datacite", "10.1000/error")
+
+    def test_crossref(self):
+        item = {"DOI": "10.1000/FOUND", "type": "journal-article", "ISSN": ["1234-5678"],
+                "issued": {"date-parts": [[2019]]}}
+        cm = CrossrefManager(self.cache, Session({
+            "10.1000/single": Response(200, {"message": item}),
+            "10.1000/missing": Response(404),
+            "10.1000/unavailable": Response(503),
+            "filter=": Response(200, {"message": {"items": [item]}})}))
+        cm.prefetch(["10.1000/found", "10.1000/absent"])
+        self.assertEqual(["12345678"], cm.get_issn("10.1000/single"))
+        self.assertEqual([], cm.get_issn("10.1000/missing"))
+        self.assertEqual([], cm.get_issn("10.1000/unavailable"))
+
+        self.assert_cached("crossref", "10.1000/found", [["12345678"], "2019", []], False)
+        self.assert_cached("crossref", "10.1000/absent", [[], None, []], True)
+        self.assert_cached("crossref", "10.1000/single", [["12345678"], "2019", []], False)
+        self.assert_cached("crossref", "10.1000/missing", [[], None, []], True)
+        self.assert_not_cached("crossref", "10.1000/unavailable")
+
+    def test_orcid(self):
+        om = ORCIDManager(None, cache=self.cache, session=Session({
+            "10.1000/found": Response(200, {"result": [{"orcid-identifier": {"path": "0000-0003-0530-4305"}}]}),
+            "10.1000/missing": Response(200, {"result": None}),
+            "10.1000/unavailable": Response(503)}))
+        self.assertEqual(["0000-0003-0530-4305"], om.get_orcid("10.1000/found"))
+        self.assertEqual([], om.get_orcid("10.1000/missing"))
+        self.assertEqual([], om.get_orcid("10.1000/unavailable"))
+
+        self.assert_cached("orcid", "10.1000/found", ["0000-0003-0530-4305"], False)
+        self.assert_cached("orcid", "10.1000/missing", [], True)
+        self.assert_not_cached("orcid", "10.1000/unavailable")
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = self.tmp.name + sep + "cache.db"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get_accessed(self):
+        conn = connect(self.path)
+        result = dict(conn.execute("SELECT key, accessed FROM cache").fetchall())
+        conn.close()
+        return result
+
+    def test_touch(self):
+        cache = ResponseCache(self.path)
+        for idx in range(TOUCH_SIZE):
+            cache.put("doi", str(idx), True)
+        stored = self.get_accessed()
+
+        # The access times are not stored at each hit
+        for idx in range(TOUCH_SIZE - 1):
+            self.assertEqual((True, True), cache.get("doi", str(idx)))
+        self.assertEqual(stored, self.get_accessed())
+
+        cache.get("doi", str(TOUCH_SIZE - 1))
+        touched = self.get_accessed()
+        self.assertTrue(all(touched[key] > stored[key] for key in stored))
+
+        cache.get("doi", "0")
+        self.assertEqual(touched, self.get_accessed())
+        cache.close()
+        self.assertGreater(self.get_accessed()["0"], touched["0"])
+
+    def test_evict(self):
+        cache = ResponseCache(self.path, max_size=10)
+        for idx in range(10):
+            cache.put("doi", str(idx), True)
+        # The items read recently are kept, even if their access times have not been stored yet
+        for idx in range(5):
+            cache.get("doi", str(idx))
+        cache.put("doi", "10", True)
+        self.assertEqual(["5", "6"], [str(idx) for idx in range(11) if not cache.get("doi", str(idx))[0]])
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+from io import StringIO
+from json import dumps, loads
+from os import sep
+from tempfile import TemporaryDirectory
+from script.cnc import DOIManager, split_input
+from script.oci import OCIManager
+
+HEADER = "citing_id,citing_publication_date,cited_id,cited_publication_date\n"
+META = {"agent": "https://orcid.org/0000-0003-0530-4305", "source": "https://doi.org/10.6084/m9.figshare.1"}
+LOOKUP_CHARS = "0123456789abcdefghijklmnopqrstuvwxyz./-_()"
+
+
+def get_rows(first, last):
+    return ["10.1000/citing.%s,2019,10.1000/cited.%s,2018\n" % (idx, idx) for idx in range(first, last)]
+
+
+class SplitInputTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name + sep
+        with open(self.dir + "lookup.csv", "w") as f:
+            f.write("c,code\n")
+            for idx, c in enumerate(LOOKUP_CHARS):
+                f.write("%s,%02d\n" % (c, idx))
+        self.doim = DOIManager()
+        self.ocim = OCIManager(lookup_file=self.dir + "lookup.csv")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def create_input(self, name, rows, meta=True):
+        with open(self.dir + name + ".csv", "w") as f:
+            f.write(HEADER + "".join(rows))
+        if meta:
+            with open(self.dir + name + ".json", "w") as f:
+                f.write(dumps(META))
+        return self.dir + name + ".csv"
+
+    def split(self, inputs, name):
+        shard_paths = [self.dir + name + "_" + str(idx) + ".jsonl" for idx in range(3)]
+        counter = Counter()
+        shards = [open(shard_path, "w") for shard_path in shard_paths]
+        with redirect_stdout(StringIO()) as out:
+            split_input(inputs, shards, self.doim, self.ocim, counter)
+        for shard in shards:
+            shard.close()
+
+        result = []
+        for shard_path in shard_paths:
+            with open(shard_path) as f:
+                result.append([loads(line) for line in f])
+        return result, counter, out.getvalue()
+
+    def test_bad_inputs(self):
+        good_1 = self.create_input("good_1", get_rows(0, 20) + ["wrong,2019,10.1000/cited.x,2018\n"])
+        good_2 = self.create_input("good_2", get_rows(20, 40))
+        # No metadata, thus it fails before any citation is split
+        no_meta = self.create_input("no_meta", get_rows(40, 60), False)
+        # It fails after having split some citations, since the last field is too long to be parsed
+        broken = self.create_input("broken", get_rows(60, 80) + ["wrong,2019,10.1000/cited.y,2018\n"] +
+                                   ["10.1000/citing.z,2019,10.1000/%s,2018\n" % ("z" * 200000)])
+
+        expected, expected_counter, expected_out = self.split([good_1, good_2], "expected")
+        result, counter, out = self.split([no_meta, good_1, broken, good_2], "result")
+
+        self.assertEqual(expected, result)
+        self.assertEqual(expected_counter, counter)
+        self.assertEqual(Counter({"all": 1, "syntax": 1}), counter)
+        self.assertEqual(40, sum(len(shard) for shard in result))
+        self.assertIn("field larger than field limit", out)
+        self.assertIn("no_meta.json", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
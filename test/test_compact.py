@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from json import load
+from os import sep, makedirs, listdir
+from os.path import exists
+from tempfile import TemporaryDirectory
+from script.compact import compact, get_paths, CSVFormat, NTFormat
+from script.manifest import ManifestManager
+
+
+class CompactTest(unittest.TestCase):
+    def setUp(self):
+        # Two runs of cnc.py, each one with its CSV and N-Triples files, listed in its manifest, where the second
+        # run repeats half of the records of the first one
+        self.tmp = TemporaryDirectory()
+        self.data = self.tmp.name + sep + "data"
+        self.manifest_dir = ManifestManager.get_manifest_dir(self.data)
+        self.files = {"csv": [], "rdf": []}
+        for run in range(2):
+            t = "2019-01-0%sT00:00:00" % (run + 1)
+            for sub_dir, extension in (("csv", "csv"), ("rdf", "ttl")):
+                makedirs(self.data + sep + sub_dir + sep + "2019", exist_ok=True)
+                f_path = self.data + sep + sub_dir + sep + "2019" + sep + t + "." + extension
+                with open(f_path, "w") as f:
+                    if sub_dir == "csv":
+                        f.write("oci,citing\n")
+                    for idx in range(3, -1, -1):
+                        oci = "0%s0-0%s0" % (idx, idx + run * (idx // 2))
+                        if sub_dir == "csv":
+                            f.write("%s,%s\n" % (oci, idx))
+                        else:
+                            f.write("<https://w3id.org/oc/index/croci/ci/%s> <http://p> \"%s\" .\n" % (oci, idx))
+                self.files[sub_dir].append(f_path)
+            ManifestManager.store(self.data, t, [(f_path, f_path.endswith(".csv"))
+                                                 for f_paths in self.files.values() for f_path in f_paths[-1:]])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get_manifests(self):
+        return list(ManifestManager.iter_manifests(self.manifest_dir))
+
+    def test_compact(self):
+        for sub_dir, f_format, extension in (("csv", CSVFormat(), ".csv"), ("rdf", NTFormat, ".ttl")):
+            with self.subTest(sub_dir=sub_dir):
+                fd_path = self.data + sep + sub_dir
+                with redirect_stdout(StringIO()):
+                    gen_path = compact(fd_path, f_format, shard_size=3, tmp_dir=self.tmp.name)
+                with open(gen_path + sep + "index.json") as f:
+                    shards = load(f)["shards"]
+                self.assertEqual([3, 3], [shard["rows"] for shard in shards])
+
+                # The records are sorted by OCI and the identical ones are kept once
+                records = []
+                for shard in shards:
+                    records.extend(f_format.iter_records(gen_path + sep + shard["path"]))
+                self.assertEqual(sorted(records, key=f_format.get_key), records)
+                self.assertEqual(6, len(set(str(record) for record in records)))
+                self.assertEqual(get_paths(fd_path, extension), [gen_path + sep + shard["path"]
+                                                                  for shard in shards])
+                # The temporary files are removed
+                self.assertEqual(["data", "manifest"], sorted(listdir(self.tmp.name)))
+
+                # The manifests do not list the files removed anymore
+                for manifest, f_path in zip(self.get_manifests(), self.files[sub_dir]):
+                    self.assertFalse(exists(f_path))
+                    self.assertNotIn(f_path, [ManifestManager.get_path(self.manifest_dir, entry)
+                                              for entry in manifest["files"]])
+                    self.assertIn(f_path, [ManifestManager.get_path(self.manifest_dir, {"path": path})
+                                           for path in manifest["removed"]])
+        self.assertEqual([[], []], [manifest["files"] for manifest in self.get_manifests()])
+
+    def test_keep(self):
+        manifests = self.get_manifests()
+        with redirect_stdout(StringIO()):
+            compact(self.data + sep + "rdf", NTFormat, keep=True)
+        self.assertTrue(all(exists(f_path) for f_path in self.files["rdf"]))
+        self.assertEqual(manifests, self.get_manifests())
+
+
+if __name__ == "__main__":
+    unittest.main()
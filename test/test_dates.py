@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from datetime import date, timedelta
+from functools import lru_cache
+from re import findall
+from dateutil.relativedelta import relativedelta
+from dateutil.parser import parse
+from script.dates import DateManager, DEFAULT_DATE
+
+
+@lru_cache(maxsize=None)
+def parse_date(date_string):
+    return parse(date_string, default=DEFAULT_DATE)
+
+
+def get_duration(citing_pub_date, cited_pub_date):
+    # The timespan as computed with dateutil before DateManager
+    citing_contains_months = len(citing_pub_date) >= 7
+    cited_contains_months = len(cited_pub_date) >= 7
+    citing_contains_days = len(citing_pub_date) >= 10
+    cited_contains_days = len(cited_pub_date) >= 10
+
+    citing_complete_pub_date = citing_pub_date[:10]
+    cited_complete_pub_date = cited_pub_date[:10]
+    if citing_contains_months and not cited_contains_months:
+        cited_complete_pub_date += citing_pub_date[4:7]
+    elif not citing_contains_months and cited_contains_months:
+        citing_complete_pub_date += cited_pub_date[4:7]
+    if citing_contains_days and not cited_contains_days:
+        cited_complete_pub_date += citing_pub_date[7:]
+    elif not citing_contains_days and cited_contains_days:
+        citing_complete_pub_date += cited_pub_date[7:]
+
+    delta = relativedelta(parse_date(citing_complete_pub_date), parse_date(cited_complete_pub_date))
+    return DateManager.format_duration(delta.years, delta.months, delta.days,
+                                       citing_contains_months and cited_contains_months,
+                                       citing_contains_days and cited_contains_days)
+
+
+def get_date(creation_date, duration):
+    # The publication date of the cited entity as computed with dateutil before DateManager
+    params = {}
+    for item in findall("^-?P([0-9]+Y)?([0-9]+M)?([0-9]+D)?$", duration)[0]:
+        if "Y" in item:
+            params["years"] = int(item[:-1])
+        elif "M" in item:
+            params["months"] = int(item[:-1])
+        elif "D" in item:
+            params["days"] = int(item[:-1])
+
+    delta = relativedelta(**params)
+    d = parse_date(creation_date)
+    if duration.startswith("-"):
+        result = d + delta
+    else:
+        result = d - delta
+
+    if "D" in duration or len(creation_date) >= 10:
+        cut = 10
+    elif "M" in duration or len(creation_date) >= 7:
+        cut = 7
+    else:
+        cut = 4
+
+    return result.strftime('%Y-%m-%d')[:cut]
+
+
+def get_result(f, *args):
+    try:
+        return f(*args)
+    except (ValueError, OverflowError) as e:
+        return type(e)
+
+
+# Every day of a leap year and of a common year, and the years and months of the years around them
+FULL_DATES = [(date(2000, 1, 1) + timedelta(days=idx)).isoformat() for idx in range(731)]
+# The first and last days of each month, where the months of different lengths are handled
+MONTH_END_DATES = [d for d in FULL_DATES if d[8:] in ("01", "28", "29", "30", "31")]
+PARTIAL_DATES = [str(year) for year in (1900, 1999, 2000, 2001, 2004)] + \
+                ["%s-%02d" % (year, month) for year in (1900, 1999, 2000, 2001, 2004) for month in range(1, 13)]
+DURATIONS = [sign + "P" + years + months + days
+             for sign in ("", "-")
+             for years in ("0Y", "1Y", "3Y", "100Y")
+             for months in ("", "0M", "1M", "11M", "12M", "13M")
+             for days in ("", "0D", "1D", "28D", "29D", "31D", "366D")]
+
+
+class DatesTest(unittest.TestCase):
+    def assert_same_durations(self, pairs):
+        for citing_pub_date, cited_pub_date in pairs:
+            expected = get_result(get_duration, citing_pub_date, cited_pub_date)
+            result = get_result(DateManager.get_duration, citing_pub_date, cited_pub_date)
+            if result != expected:
+                self.fail("Timespan between '%s' and '%s': '%s' instead of '%s'." %
+                          (citing_pub_date, cited_pub_date, result, expected))
+
+            # The date of the cited entity obtained back from the timespan, as Citation does
+            if isinstance(result, str):
+                expected = get_result(get_date, citing_pub_date[:10], result)
+                result = get_result(DateManager.get_date, citing_pub_date[:10], result)
+                if result != expected:
+                    self.fail("Date of the cited entity of '%s' and '%s': '%s' instead of '%s'." %
+                              (citing_pub_date, cited_pub_date, result, expected))
+
+    def test_full_dates(self):
+        # Both orders are checked, thus including all the cases where the cited entity is published after the citing one
+        self.assert_same_durations((citing, cited) for citing in FULL_DATES for cited in MONTH_END_DATES)
+        self.assert_same_durations((citing, cited) for citing in MONTH_END_DATES for cited in FULL_DATES)
+
+    def test_partial_dates(self):
+        all_dates = PARTIAL_DATES + FULL_DATES
+        self.assert_same_durations((citing, cited) for citing in PARTIAL_DATES for cited in all_dates)
+        self.assert_same_durations((citing, cited) for citing in FULL_DATES for cited in PARTIAL_DATES)
+
+    def test_dates_handled_by_dateutil(self):
+        # Invalid or different formats are still parsed by dateutil, which may raise the same errors as before
+        dates = ["2001-02-29", "2000-02-30", "2000-13", "2001-00", "2000-06-15T12:00", "2000/06", "0999", "9999-12-31"]
+        self.assert_same_durations((citing, cited) for citing in dates for cited in dates + PARTIAL_DATES)
+        self.assert_same_durations((citing, cited) for citing in PARTIAL_DATES for cited in dates)
+
+    def test_dates_from_durations(self):
+        for creation_date in PARTIAL_DATES + FULL_DATES[::7] + ["2000-02-29", "2000-12-31", "2001-02-28"]:
+            for duration in DURATIONS:
+                result = get_result(DateManager.get_date, creation_date, duration)
+                expected = get_result(get_date, creation_date, duration)
+                if result != expected:
+                    self.fail("Date obtained from '%s' and '%s': '%s' instead of '%s'." %
+                              (creation_date, duration, result, expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
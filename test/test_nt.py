@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from itertools import product
+from rdflib import Graph
+from rdflib.compare import isomorphic
+from script.oci import Citation
+
+BASE_URL = "https://w3id.org/oc/index/croci/"
+DATES = [None, "", "2010", "2010-06", "2010-06-15", "2012-02-28", "2008", "2008-11", "2008-11-03", "2014-01-01"]
+
+
+class NTriplesTest(unittest.TestCase):
+    @staticmethod
+    def get_citation(citing_pub_date, cited_pub_date, journal_sc=False, author_sc=False, creation=None,
+                     timespan=None, source="http://api.crossref.org/works/10.1000/a"):
+        return Citation("oci:02001000000360102-02001000000360203",
+                        "http://dx.doi.org/10.1000/a", citing_pub_date,
+                        "http://dx.doi.org/10.1000/b", cited_pub_date,
+                        creation, timespan,
+                        "https://orcid.org/0000-0003-0530-4305", source, "2019-03-01T10:00:00",
+                        "CROCI", "doi", "http://dx.doi.org/([[XXX__decode]])", "reference",
+                        journal_sc, author_sc)
+
+    def assert_isomorphic(self, nt, rdf_graph):
+        nt_graph = Graph()
+        nt_graph.parse(data=nt, format="nt")
+        self.assertTrue(isomorphic(nt_graph, rdf_graph))
+        self.assertEqual(len(nt.splitlines()), len(rdf_graph))
+
+    def test_citation(self):
+        for citing_pub_date, cited_pub_date, journal_sc, author_sc in product(DATES, DATES, (False, True),
+                                                                              (False, True)):
+            cit = NTriplesTest.get_citation(citing_pub_date, cited_pub_date, journal_sc, author_sc)
+            for include_oci, include_label, include_prov in product((False, True), repeat=3):
+                with self.subTest(citing=citing_pub_date, cited=cited_pub_date, journal_sc=journal_sc,
+                                  author_sc=author_sc, oci=include_oci, label=include_label, prov=include_prov):
+                    try:
+                        rdf_graph = cit.get_citation_rdf(BASE_URL, include_oci, include_label, include_prov)
+                    except ValueError:  # Negative timespans that rdflib cannot handle, see test_negative_duration
+                        self.assertTrue(cit.duration.startswith("-"))
+                        continue
+                    self.assert_isomorphic(
+                        cit.get_citation_nt(BASE_URL, include_oci, include_label, include_prov), rdf_graph)
+
+    def test_citation_without_citing_date(self):
+        for creation, timespan in (("2010-06", None), ("2010", "P2Y"), ("2010-06-15", "P1Y2M3D")):
+            cit = NTriplesTest.get_citation(None, None, creation=creation, timespan=timespan)
+            self.assert_isomorphic(cit.get_citation_nt(BASE_URL), cit.get_citation_rdf(BASE_URL))
+
+    def test_prov(self):
+        cit = NTriplesTest.get_citation("2010-06-15", "2008-11")
+        self.assert_isomorphic(cit.get_citation_prov_nt(BASE_URL), cit.get_citation_prov_rdf(BASE_URL))
+
+    def test_identifier(self):
+        cit = NTriplesTest.get_citation("2010-06-15", "2008-11")
+        for include_label, include_prov in product((False, True), repeat=2):
+            with self.subTest(label=include_label, prov=include_prov):
+                self.assert_isomorphic(cit.get_oci_nt(BASE_URL, include_label, include_prov),
+                                       cit.get_oci_rdf(BASE_URL, include_label, include_prov))
+
+    def test_invalid_uri(self):
+        cit = NTriplesTest.get_citation("2010", "2008", source="http://example.org/a b")
+        self.assertRaises(ValueError, cit.get_citation_nt, BASE_URL)
+
+    def test_negative_duration(self):
+        # rdflib cannot represent a duration with negative years and negative days
+        cit = NTriplesTest.get_citation("2010-01-01", "2011-01-04")
+        self.assertEqual(cit.duration, "-P1Y0M3D")
+        self.assertRaises(ValueError, cit.get_citation_rdf, BASE_URL)
+
+        nt = cit.get_citation_nt(BASE_URL)
+        self.assertIn("<http://purl.org/spar/cito/hasCitationTimeSpan> "
+                      "\"-P1Y3D\"^^<http://www.w3.org/2001/XMLSchema#duration> .\n", nt)
+
+
+if __name__ == "__main__":
+    unittest.main()
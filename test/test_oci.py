@@ -0,0 +1,429 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from collections import deque
+from json import dumps, loads
+from os import sep
+from itertools import product
+from random import Random
+from re import match, findall, fullmatch, sub
+from tempfile import TemporaryDirectory
+from xml.etree import ElementTree
+from urllib.parse import unquote
+from script.oci import OCIManager, OCICodec, Citation, QUERY_FIELDS
+
+LOOKUP_CHARS = "0123456789abcdefghijklmnopqrstuvwxyz./-_()"
+CITING = "10.1000/a"
+CITED = "10.1000/b"
+API = "https://api.example.org/works/[[CITING]]"
+JSON_DATA = dumps({"message": {
+    "DOI": "10.1000/A",
+    "issued": {"date-parts": [[2019, 3, 1]]},
+    "created": {"date-time": "2019-03-05T10:00:00Z"},
+    "reference": [
+        {"key": "r1", "DOI": "10.1000/C", "year": "2001"},
+        {"key": "r2", "DOI": "10.1000/B", "year": "2005", "issued": {"date-parts": [[2005, 12]]}},
+        {"key": "r3", "year": "2010"}]}})
+XML_DATA = """<result xmlns:p="http://example.org/p">
+    <p:article>
+        <p:id>  10.1000/a
+        </p:id>
+        <p:date>2019-03-01</p:date>
+        <refs>
+            <ref><id>10.1000/c</id></ref>
+            <ref><id>10.1000/b</id><date>2005</date></ref>
+        </refs>
+    </p:article>
+    <p:article><p:id>10.1000/z</p:id></p:article>
+</result>"""
+# Characters of the identifiers that are not in any lookup table
+OTHER_CHARS = "\u00e9\u2013\u00df\n\t"
+# The access paths of the queries of the services, as in the configuration file
+JSON_QUERY = {
+    "citing": ["message::DOI->shape(http://dx.doi.org/)"],
+    "cited": ["message::reference::[DOI==[[CITED]]]::DOI->shape(http://dx.doi.org/)"],
+    "citing_date": ["message::issued::date-parts::[0]->datestrings()->join(-)"],
+    "cited_date": ["message::reference::[DOI==[[CITED]]]::issued::date-parts::[0]->datestrings()->join(-)",
+                   "message::reference::[DOI==[[CITED]]]::year"],
+    "creation": ["message::created::date-time->normdate()"],
+    "timespan": []
+}
+XML_QUERY = {
+    "citing": ["article::id->shape(http://dx.doi.org/)"],
+    "cited": ["article::refs::ref::id", "decode(010000003735)->remove(10.)"],
+    "citing_date": ["article::date->normdate()"],
+    "cited_date": ["article::refs::ref::date", "article::refs::[1]::date"],
+    "creation": ["result::article::date"],
+    "timespan": ["article::none::date"]
+}
+# Other access paths, some of them failing, that are not in the queries
+JSON_PATHS = [
+    "message", "message::reference", "message::reference::[1]", "message::reference::[3]::DOI",
+    "message::reference::[key==R3]::year", "message::reference::[key==r4]::year", "message::reference::[1]x",
+    "message::DOI->join", "message::none::DOI", "message::DOI::none", "[0]", "[DOI==10.1000/a]",
+    "decode(010000003735)", "shape([[CITING]],http://dx.doi.org/)", "avoid_prefix_removal(02001)->remove(0123)",
+    "message::issued::date-parts::[0]->datestrings()", "message::reference::[DOI==[[CITING]]]::DOI"
+]
+XML_PATHS = [
+    "article", "article::id", "result::article::id", "article::refs::ref", "article::refs::none",
+    "article::{http://example.org/p}id", "article::.*d", "article::p:id", "refs::ref::id", "article::id->join"
+]
+
+
+def read_api_data(om, data, type_format, access_list, citing, cited, api):
+    # The interpretation of the access paths as it was before compiling them, used as reference
+    result = None
+
+    if data and access_list:
+        access_queue = deque(access_list)
+        while result is None and access_queue:
+            access_string = access_queue.popleft()
+            access_operations = deque(access_string.split("::"))
+
+            access_operation = access_operations.popleft()
+            if citing:
+                access_operation = sub("\\[\\[CITING\\]\\]", citing, access_operation)
+            if cited:
+                access_operation = sub("\\[\\[CITED\\]\\]", cited, access_operation)
+
+            f_to_execute = []
+            if "->" in access_operation:
+                for idx, item in enumerate(access_operation.split("->")):
+                    if idx:
+                        f_to_execute.append(item)
+                    else:
+                        access_operation = item
+            if match("^([^\\(]+)\\((.*)\\)$", access_operation):
+                f_name, f_params = findall("([^\\(]+)\\((.*)\\)", access_operation)[0]
+                f_params = f_params.split(",") if f_params else []
+                result = om.f[f_name](*f_params)
+                if type(result) is tuple:
+                    result, type_format = result
+            elif match("\\[[0-9]+\\]", access_operation):
+                cur_n = int(sub("\\[([0-9]+)\\]", "\\1", access_operation))
+                if type(data) is list and cur_n < len(data):
+                    result = data[cur_n]
+            elif match("^\\[.+\\]$", access_operation) and "==" in access_operation:
+                left, right = sub("^\\[(.+)\\]$", "\\1", access_operation).split("==")
+                if type(data) is list:
+                    list_queue = deque(data)
+                    while result is None and list_queue:
+                        item = list_queue.popleft()
+                        item_value = item.get(left)
+                        if item_value is not None and item_value.lower() == right.lower():
+                            result = item
+            else:
+                if type_format == "json":
+                    result = data.get(access_operation)
+                elif type_format == "xml":
+                    el = None
+
+                    if match("^({.+})?%s$" % access_operation, data.tag):
+                        el = data
+                    else:
+                        children = deque(data)
+                        while el is None and children:
+                            child = children.popleft()
+                            if match("^({.+})?%s$" % access_operation, child.tag):
+                                el = child
+
+                    result = el
+
+            if result is not None and not access_operations and type_format == "xml":
+                result = sub("\\s+", " ", result.text).strip()
+
+            if f_to_execute and result is not None:
+                for f in f_to_execute:
+                    f_name, f_params = findall("([^\\(]+)\\((.*)\\)", f)[0]
+                    f_params = f_params.split(",") if f_params else []
+                    f_params.insert(0, result)
+                    result = om.f[f_name](*f_params)
+                    if type(result) is tuple:
+                        result, type_format = result
+
+            if access_operations:
+                result = read_api_data(om, result, type_format, ["::".join(access_operations)], citing, cited, api)
+
+    return result
+
+
+def get_lookups():
+    # Lookup tables with two-digit codes only, with codes starting with 9 as well (i.e. of different length),
+    # with codes that are not digits, and with a character that cannot be joined
+    chars = [chr(code) for code in range(32, 127)] + ["\u00e0", "\u00fc", "\u00f1", "\u03b1", "\u00ae"]
+    result = [
+        dict((char, "%02d" % idx) for idx, char in enumerate(LOOKUP_CHARS)),
+        dict((char, "%02d" % idx if idx < 90 else "9%02d" % (idx - 90)) for idx, char in enumerate(chars)),
+        dict((char, "%02d" % idx if idx < 10 else "a%d" % idx) for idx, char in enumerate(LOOKUP_CHARS)),
+        dict((char, "%02d" % idx) for idx, char in enumerate(LOOKUP_CHARS + "\n"))
+    ]
+    return [(dict((code, char) for char, code in inverse_lookup.items()), inverse_lookup) for inverse_lookup in result]
+
+
+def encode(inverse_lookup, doi):
+    # The encoding character by character, used as reference
+    return "".join(inverse_lookup[char] for char in doi.replace("10.", ""))
+
+
+def decode(lookup, s):
+    # The decoding code by code, used as reference
+    return "10." + "".join(lookup.get(code, code) for code in findall("(9*[0-8][0-9])", s))
+
+
+def get_dois(chars, number, seed, other=0.0):
+    # Random identifiers made of the characters specified and, with the probability specified, of other ones
+    rand = Random(seed)
+    result = []
+    for idx in range(number):
+        doi = "10.%s/" % rand.randint(1000, 99999)
+        for char_idx in range(rand.randint(0, 30)):
+            doi += rand.choice(OTHER_CHARS) if rand.random() < other else rand.choice(chars)
+        result.append(doi)
+    return result
+
+# The shapes of the identifiers of the services and some entity URLs, matching them or not
+ID_SHAPES = [
+    "http://dx.doi.org/([[XXX__decode]])", "https://doi.org/([[XXX__decode]])",
+    "http://www.ncbi.nlm.nih.gov/pubmed/([[XXX]])", "https://w3id.org/oc/corpus/br/([[XXX]])",
+    "http://example.org/(a)?([[XXX]])", "http://example.org/(id/)?[[XXX]]", "http://example.org/[[XXX]]"
+]
+ENTITY_URLS = [
+    "http://dx.doi.org/10.1000/a", "http://dx.doi.org/10.1000/%3Ca%3E%20b", "https://doi.org/10.1000/A(1)",
+    "http://dx.doi.org/", "http://www.ncbi.nlm.nih.gov/pubmed/123456", "https://w3id.org/oc/corpus/br/1-2",
+    "http://example.org/a12", "http://example.org/id/12", "http://example.org/12", "http://other.org/12",
+    "http://dx.doi.org/10.1000/\u00e9%C3%A9", ""
+]
+
+
+def get_id(id_shape, entity_url):
+    # The extraction of the identifier as it was before compiling the shapes, used as reference
+    decode = "XXX__decode]]" in id_shape
+    entity_regex = sub("\\[\\[[^\\]]+\\]\\]", ".+", id_shape)
+    entity_token = sub(entity_regex, "\\1", entity_url)
+    return unquote(entity_token) if decode else entity_token
+
+
+class UncachedCitation(Citation):
+    def get_id(self, entity_url):
+        return get_id(self.id_shape, entity_url)
+
+
+def get_citations(cls, id_shape):
+    return [cls("oci:%s-%s" % (idx, idx + 1), citing_url, "2019-03-01", cited_url, "2018",
+                None, None, "https://orcid.org/0000-0003-0530-4305", "http://api.example.org/works/10.1000/a",
+                "2019-03-05T10:00:00", "Example", "doi", id_shape, "reference", False, False)
+            for idx, (citing_url, cited_url) in enumerate(product(ENTITY_URLS[:-1], ENTITY_URLS[1:]))]
+
+
+def create_manager():
+    with TemporaryDirectory() as tmp:
+        with open(tmp + sep + "lookup.csv", "w") as f:
+            f.write("c,code\n")
+            for idx, c in enumerate(LOOKUP_CHARS):
+                f.write("%s,%02d\n" % (c, idx))
+        return OCIManager(lookup_file=tmp + sep + "lookup.csv")
+
+
+def get_data(type_format):
+    return loads(JSON_DATA) if type_format == "json" else ElementTree.fromstring(XML_DATA)
+
+
+def get_outcome(f, *args):
+    try:
+        return "value", f(*args)
+    except Exception as e:
+        return "error", type(e)
+
+
+def get_access_lists(query, paths):
+    # Each access path alone, each list of the query, and all the paths together in both orders
+    all_paths = [path for field in query for path in query[field]] + paths
+    return [[path] for path in all_paths] + [query[field] for field in query] + [all_paths, all_paths[::-1]]
+
+
+class AccessPathTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.om = create_manager()
+
+    def assert_same_results(self, type_format, query, paths):
+        read = self.om._OCIManager__read_api_data
+        for access_list in get_access_lists(query, paths):
+            for citing, cited in ((CITING, CITED), (CITED, CITING), (None, None)):
+                with self.subTest(access_list=access_list, citing=citing, cited=cited):
+                    expected = get_outcome(read_api_data, self.om, get_data(type_format), type_format,
+                                           access_list, citing, cited, API)
+                    self.assertEqual(expected, get_outcome(read, get_data(type_format), type_format,
+                                                           access_list, citing, cited, API))
+                    self.assertEqual(expected, get_outcome(read, get_data(type_format), type_format,
+                                                           access_list, citing, cited, API, {}))
+
+    def test_json(self):
+        self.assert_same_results("json", JSON_QUERY, JSON_PATHS)
+
+    def test_xml(self):
+        self.assert_same_results("xml", XML_QUERY, XML_PATHS)
+
+    def test_compiled(self):
+        self.assertIs(OCIManager.compile_access_list(tuple(JSON_QUERY["cited"])),
+                      OCIManager.compile_access_list(tuple(JSON_QUERY["cited"])))
+        (first, second, third, fourth), = OCIManager.compile_access_list(tuple(JSON_QUERY["cited"]))
+        self.assertEqual(("message", ("key", "message", ()), ("message",)), first)
+        # The operations with placeholders are compiled once the identifiers are known
+        self.assertEqual(("[DOI==[[CITED]]]", None, ("message", "reference", "[DOI==[[CITED]]]")), third)
+        self.assertEqual(("filter", ("DOI", CITED), ()), OCIManager.compile_access_operation("[DOI==10.1000/B]"))
+        self.assertEqual(("index", 0, (("datestrings", ()), ("join", ("-",)))),
+                         OCIManager.compile_access_operation("[0]->datestrings()->join(-)"))
+        self.assertEqual(("function", ("decode", ("0200",)), ()), OCIManager.compile_access_operation("decode(0200)"))
+        self.assertEqual("error", OCIManager.compile_access_operation("[1]x")[0])
+
+
+class SharedAccessTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.om = create_manager()
+
+    def get_queries(self, type_format, query, paths):
+        # Queries whose fields share the first operations of their access paths, including fields without any
+        # path and paths that find nothing. Since the paths raising an exception stop the whole query, they are
+        # used in a fifth of the queries only
+        result = [query]
+        all_paths = [path for field in query for path in query[field]] + paths
+        safe_paths = [path for path in all_paths if get_outcome(
+            read_api_data, self.om, get_data(type_format), type_format, [path], CITING, CITED, API)[0] == "value"]
+        rand = Random(len(all_paths))
+        for idx in range(100):
+            cur_paths = all_paths if idx % 5 == 0 else safe_paths
+            result.append({field: rand.sample(cur_paths, rand.randint(0, 3)) for field in QUERY_FIELDS})
+        return result
+
+    def assert_same_results(self, type_format, query, paths):
+        read_data = self.om._OCIManager__read_api_data
+        read_fields = self.om._OCIManager__read_api_fields
+        data = get_data(type_format)
+        for cur_query in self.get_queries(type_format, query, paths):
+            for citing, cited in ((CITING, CITED), (CITED, CITING)):
+                with self.subTest(query=cur_query, citing=citing, cited=cited):
+                    # The same data are used by all the fields, as in the responses of the services
+                    expected = get_outcome(lambda: tuple(read_data(
+                        get_data(type_format), type_format, cur_query.get(field),
+                        citing, cited, API) for field in QUERY_FIELDS))
+                    self.assertEqual(expected, get_outcome(
+                        read_fields, data, type_format, cur_query, citing, cited, API))
+                    self.assertEqual(expected, get_outcome(lambda: tuple(read_api_data(
+                        self.om, data, type_format, cur_query.get(field), citing, cited, API)
+                        for field in QUERY_FIELDS)))
+
+    def test_json(self):
+        self.assert_same_results("json", JSON_QUERY, JSON_PATHS)
+
+    def test_xml(self):
+        self.assert_same_results("xml", XML_QUERY, XML_PATHS)
+
+    def test_values(self):
+        read_fields = self.om._OCIManager__read_api_fields
+        self.assertEqual(("http://dx.doi.org/10.1000/A", "http://dx.doi.org/10.1000/B", "2019-03-01", "2005-12",
+                          "2019-03-05100000", None),
+                         read_fields(loads(JSON_DATA), "json", JSON_QUERY, CITING, CITED, API))
+        self.assertEqual(("http://dx.doi.org/10.1000/a", "10.1000/c", "2019-03-01", None, "2019-03-01", None),
+                         read_fields(ElementTree.fromstring(XML_DATA), "xml", XML_QUERY, CITING, CITED, API))
+
+
+class OCICodecTest(unittest.TestCase):
+    def assert_encoded(self, codec, inverse_lookup, dois):
+        expected = [get_outcome(encode, inverse_lookup, doi) for doi in dois]
+        self.assertEqual(expected, [get_outcome(codec.encode, doi) for doi in dois])
+        if all(outcome[0] == "value" for outcome in expected):
+            self.assertEqual([value for outcome, value in expected], codec.encode_many(dois))
+        else:  # As for a single identifier, it raises an error for the first character without a code
+            self.assertRaises(KeyError, codec.encode_many, dois)
+
+    def assert_decoded(self, codec, lookup, l):
+        expected = [decode(lookup, s) for s in l]
+        self.assertEqual(expected, [codec.decode(s) for s in l])
+        self.assertEqual(expected, codec.decode_many(l))
+
+    def test_round_trip(self):
+        for idx, (lookup, inverse_lookup) in enumerate(get_lookups()):
+            with self.subTest(lookup=idx):
+                codec = OCICodec(lookup, inverse_lookup)
+                dois = get_dois([char for char in inverse_lookup if char != "\n"], 1000, idx)
+                encoded = codec.encode_many(dois)
+                # Only the codes made of digits can be decoded
+                if all(fullmatch("9*[0-8][0-9]", code) for code in lookup):
+                    self.assertEqual(["10." + doi.replace("10.", "") for doi in dois], codec.decode_many(encoded))
+                self.assertEqual([codec.decode(codec.encode(doi)) for doi in dois], codec.decode_many(encoded))
+
+    def test_encode(self):
+        for idx, (lookup, inverse_lookup) in enumerate(get_lookups()):
+            codec = OCICodec(lookup, inverse_lookup)
+            chars = list(inverse_lookup)
+            for other in (0.0, 0.01, 0.1):
+                with self.subTest(lookup=idx, other=other):
+                    dois = get_dois(chars, 500, idx, other)
+                    self.assert_encoded(codec, inverse_lookup, dois)
+                    for doi in dois[:100]:
+                        self.assert_encoded(codec, inverse_lookup, [doi])
+            with self.subTest(lookup=idx, other=None):
+                self.assert_encoded(codec, inverse_lookup, [])
+                self.assert_encoded(codec, inverse_lookup, ["10.", "10.1000/", "10.10.10.", "", "1", "0."])
+                self.assert_encoded(codec, inverse_lookup, ["10.1000/a\n10.1000/b", "10.1000/c"])
+
+    def test_decode(self):
+        for idx, (lookup, inverse_lookup) in enumerate(get_lookups()):
+            codec = OCICodec(lookup, inverse_lookup)
+            codes = list(lookup) + ["99", "9999", "989", "98", "a1", "x", "\n", "\u00e9", "0"]
+            rand = Random(idx)
+            for length in (0, 1, 5, 20):
+                with self.subTest(lookup=idx, length=length):
+                    self.assert_decoded(codec, lookup, ["".join(rand.choice(list(lookup)) for code_idx in range(
+                        rand.randint(0, length))) for s_idx in range(200)])
+                    self.assert_decoded(codec, lookup, ["".join(rand.choice(codes) for code_idx in range(
+                        rand.randint(0, length))) for s_idx in range(200)])
+                    self.assert_decoded(codec, lookup, ["".join(rand.choice("0123456789") for code_idx in range(
+                        rand.randint(0, length * 2))) for s_idx in range(200)])
+            with self.subTest(lookup=idx, length=None):
+                self.assert_decoded(codec, lookup, [])
+                self.assert_decoded(codec, lookup, ["", "", "0"])
+                self.assert_decoded(codec, lookup, ["0102\n03", "04"])
+
+
+class IdExtractorTest(unittest.TestCase):
+    def test_extractor(self):
+        for id_shape, entity_url in product(ID_SHAPES, ENTITY_URLS):
+            with self.subTest(id_shape=id_shape, entity_url=entity_url):
+                expected = get_outcome(get_id, id_shape, entity_url)
+                self.assertEqual(expected, get_outcome(Citation.get_id_extractor(id_shape), entity_url))
+                # Again, with the extractor already in the cache
+                self.assertEqual(expected, get_outcome(Citation.get_id_extractor(id_shape), entity_url))
+
+    def test_cached(self):
+        for id_shape in ID_SHAPES:
+            self.assertIs(Citation.get_id_extractor(id_shape), Citation.get_id_extractor(id_shape))
+
+    def test_serialisations(self):
+        for id_shape in ID_SHAPES[:-1]:
+            with self.subTest(id_shape=id_shape):
+                for citation, uncached_citation in zip(get_citations(Citation, id_shape),
+                                                       get_citations(UncachedCitation, id_shape)):
+                    self.assertEqual(uncached_citation.get_citation_json(), citation.get_citation_json())
+                    self.assertEqual(uncached_citation.get_citation_csv(), citation.get_citation_csv())
+                    self.assertEqual(uncached_citation.get_citation_scholix(), citation.get_citation_scholix())
+
+
+if __name__ == "__main__":
+    unittest.main()
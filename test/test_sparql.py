@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from json import dump
+from os import sep
+from tempfile import TemporaryDirectory
+from rdflib import Graph, Namespace, URIRef, Literal, XSD
+from script.oci import OCIResolver
+from script.sparql import GraphExecutor, BatchQuery, CITING_PLACEHOLDER, CITED_PLACEHOLDER, ROW_VARIABLE
+from test.test_oci import LOOKUP_CHARS
+
+ENDPOINT = "http://localhost/sparql"
+CITO = Namespace("http://purl.org/spar/cito/")
+LITERAL = Namespace("http://www.essepuntato.it/2010/06/literalreification/")
+DOI_BASE = "http://dx.doi.org/"
+N_DOIS = 8
+PREFIXES = "PREFIX cito: <http://purl.org/spar/cito/> " \
+           "PREFIX literal: <http://www.essepuntato.it/2010/06/literalreification/> "
+# The queries of the services, as in the configuration file
+QUERIES = [
+    PREFIXES + "SELECT ?citing ?cited ?creation ?timespan WHERE { "
+               "?oci cito:hasCitingEntity <http://dx.doi.org/[[CITING]]> ; "
+               "cito:hasCitedEntity <http://dx.doi.org/[[CITED]]> . "
+               "BIND(<http://dx.doi.org/[[CITING]]> AS ?citing) BIND(<http://dx.doi.org/[[CITED]]> AS ?cited) "
+               "OPTIONAL { ?oci cito:hasCitationCreationDate ?creation } "
+               "OPTIONAL { ?oci cito:hasCitationTimeSpan ?timespan } } LIMIT 1",
+    PREFIXES + "SELECT DISTINCT ?citing ?cited ?creation WHERE { "
+               "?citing literal:hasLiteralValue \"[[CITING]]\" . ?cited literal:hasLiteralValue \"[[CITED]]\" . "
+               "?oci cito:hasCitingEntity ?citing ; cito:hasCitedEntity ?cited ; "
+               "cito:hasCitationCreationDate ?creation } ORDER BY DESC(?creation)",
+    PREFIXES + "SELECT * WHERE { "
+               "?oci cito:hasCitingEntity <http://dx.doi.org/[[CITING]]> ; "
+               "cito:hasCitedEntity ?cited . ?cited literal:hasLiteralValue \"[[CITED]]\"^^<%s> }" % XSD.string
+]
+
+
+def get_doi(idx):
+    return "10.1000/%s" % idx
+
+
+def create_graph():
+    # A citation for the pairs of DOIs whose indexes are not multiple of three when summed, some of them having
+    # two creation dates
+    graph = Graph()
+    for idx in range(N_DOIS):
+        doi = URIRef(DOI_BASE + get_doi(idx))
+        graph.add((doi, LITERAL.hasLiteralValue, Literal(get_doi(idx))))
+        graph.add((doi, LITERAL.hasLiteralValue, Literal(get_doi(idx), datatype=XSD.string)))
+    for citing_idx in range(N_DOIS):
+        for cited_idx in range(N_DOIS):
+            if (citing_idx + cited_idx) % 3:
+                oci = URIRef("https://w3id.org/oc/index/ci/%s-%s" % (citing_idx, cited_idx))
+                graph.add((oci, CITO.hasCitingEntity, URIRef(DOI_BASE + get_doi(citing_idx))))
+                graph.add((oci, CITO.hasCitedEntity, URIRef(DOI_BASE + get_doi(cited_idx))))
+                graph.add((oci, CITO.hasCitationCreationDate, Literal("20%02d" % citing_idx, datatype=XSD.gYear)))
+                if citing_idx % 2:
+                    graph.add((oci, CITO.hasCitationCreationDate, Literal("19%02d" % citing_idx, datatype=XSD.gYear)))
+                if cited_idx % 2:
+                    graph.add((oci, CITO.hasCitationTimeSpan, Literal("P%sY" % cited_idx, datatype=XSD.duration)))
+    return graph
+
+
+class CountingExecutor(GraphExecutor):
+    def __init__(self, graph):
+        super(CountingExecutor, self).__init__(graph)
+        self.queries = []
+
+    def __call__(self, endpoint, query):
+        self.queries.append(query)
+        return super(CountingExecutor, self).__call__(endpoint, query)
+
+
+class BatchQueryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sparql = GraphExecutor(create_graph())
+
+    def get_answer(self, query, citing, cited):
+        # The first answer of the query of a single citation
+        answers = self.sparql(ENDPOINT, CITED_PLACEHOLDER.sub(cited, CITING_PLACEHOLDER.sub(citing, query)))
+        return answers[0] if answers else None
+
+    def test_demultiplex(self):
+        # All the pairs of DOIs, also those without any citation or not in the graph at all
+        pairs = [(get_doi(citing_idx), get_doi(cited_idx))
+                 for citing_idx in range(N_DOIS + 1) for cited_idx in range(N_DOIS + 1)]
+        self.assertIsNone(self.get_answer(QUERIES[0], get_doi(0), get_doi(0)))
+        self.assertIsNotNone(self.get_answer(QUERIES[0], get_doi(0), get_doi(1)))
+        for query in QUERIES:
+            batch_query = BatchQuery.get_batch_query(query)
+            self.assertIsNotNone(batch_query)
+            for start, size in ((0, 1), (0, 10), (10, 50), (0, len(pairs))):
+                with self.subTest(query=query, start=start, size=size):
+                    cur_pairs = pairs[start:start + size]
+                    bindings = self.sparql(ENDPOINT, batch_query.get_query(
+                        [batch_query.get_values(citing, cited) for citing, cited in cur_pairs]))
+                    answers = BatchQuery.demultiplex(bindings, len(cur_pairs))
+
+                    expected = [self.get_answer(query, citing, cited) for citing, cited in cur_pairs]
+                    for answer, expected_answer in zip(answers, expected):
+                        if expected_answer is None:
+                            self.assertIsNone(answer)
+                        else:
+                            # The variables of the batch are returned as well
+                            self.assertIn(ROW_VARIABLE, answer)
+                            self.assertEqual(expected_answer, dict(
+                                (variable, value) for variable, value in answer.items()
+                                if variable in expected_answer))
+
+    def test_values(self):
+        batch_query = BatchQuery.get_batch_query(QUERIES[0])
+        self.assertEqual(["<http://dx.doi.org/10.1000/1>", "<http://dx.doi.org/10.1000/2>"],
+                         batch_query.get_values("10.1000/1", "10.1000/2"))
+        # The identifiers breaking the terms of the query are not retrieved in batch
+        self.assertIsNone(batch_query.get_values("10.1000/<1>", "10.1000/2"))
+        self.assertIsNone(BatchQuery.get_batch_query(QUERIES[1]).get_values("10.1000/\"1", "10.1000/2"))
+        self.assertIsNone(BatchQuery.get_batch_query("SELECT ?s WHERE { ?s ?p ?o }"))
+
+
+class ResolverTest(unittest.TestCase):
+    def test_resolver(self):
+        graph = create_graph()
+        with TemporaryDirectory() as tmp:
+            with open(tmp + sep + "lookup.csv", "w") as f:
+                f.write("c,code\n")
+                for idx, c in enumerate(LOOKUP_CHARS):
+                    f.write("%s,%02d\n" % (c, idx))
+            with open(tmp + sep + "oci.json", "w") as f:
+                dump({"services": [
+                    {"name": "Local", "prefix": ["020"], "use_it": "yes", "id_type": "doi",
+                     "id_shape": "http://dx.doi.org/([[XXX__decode]])", "preprocess": ["decode"],
+                     "tp": ENDPOINT, "query": QUERIES[0]}]}, f)
+
+            executors = [CountingExecutor(graph) for idx in range(4)]
+            resolvers = [OCIResolver(tmp + sep + "lookup.csv", tmp + sep + "oci.json", workers=2, batch_size=30,
+                                     sparql=sparql, sparql_batch_size=sparql_batch_size)
+                         for sparql, sparql_batch_size in zip(executors, (0, 1, 7, 100))]
+            codec = resolvers[0].om.codec
+            ocis = ["oci:020%s-020%s" % (codec.encode(get_doi(citing_idx)), codec.encode(get_doi(cited_idx)))
+                    for citing_idx in range(N_DOIS + 1) for cited_idx in range(N_DOIS + 1)]
+
+            results = []
+            for resolver in resolvers:
+                results.append([(citation.oci, citation.citing_url, citation.cited_url, citation.creation_date,
+                                 citation.duration) if citation else None
+                                for om, citation in resolver.get_citation_objects(ocis)])
+            self.assertIn(None, results[0])
+            self.assertNotEqual([None] * len(ocis), results[0])
+            for result in results[1:]:
+                self.assertEqual(results[0], result)
+
+            # The OCIs are retrieved one by one only when they are not retrieved in batch
+            self.assertEqual(len(ocis), len(executors[0].queries))
+            self.assertEqual(len(ocis), len(executors[1].queries))
+            self.assertEqual(sum(-(-min(30, len(ocis) - start) // 7) for start in range(0, len(ocis), 30)),
+                             len(executors[2].queries))
+            self.assertEqual(-(-len(ocis) // 30), len(executors[3].queries))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019, Silvio Peroni <essepuntato@gmail.com>
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose
+# with or without fee is hereby granted, provided that the above copyright notice
+# and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT,
+# OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from os import sep
+from tempfile import TemporaryDirectory
+from threading import Lock
+from unittest.mock import patch
+from urllib.parse import urlparse, parse_qs
+from rdflib import Dataset, Graph, URIRef
+from script.sparql import GraphUpdater
+from script.compact import open_text
+from script.updatetp import LoadJournal, get_to_upload, upload, upload_stream
+
+SERVER = "http://localhost/sparql"
+GRAPH_URL = "https://w3id.org/oc/index/croci/"
+# The number of triples of each file
+SIZES = [5, 1, 0, 7, 4, 3]
+# The extensions of the files, including the ones of the shards created by compact.py
+EXTENSIONS = ["nt", "ttl", "nt", "ttl", "nt.gz", "ttl.gz"]
+
+
+class Response(object):
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class Session(object):
+    # It sends the requests of the modes 'insert' and 'graph_store' to a local dataset, and the requests whose
+    # number is among the failures specified are answered with the status associated to it
+    def __init__(self, dataset, failures=None):
+        self.dataset = dataset
+        self.updater = GraphUpdater(dataset)
+        self.failures = failures or {}
+        self.requests = 0
+        self.lock = Lock()
+
+    def post(self, url, data=None, headers=None):
+        with self.lock:
+            self.requests += 1
+            status = self.failures.get(self.requests)
+        if status is not None:
+            return Response(status, "Failure")
+
+        if headers["Content-Type"].startswith("application/sparql-update"):
+            self.updater(url, data.decode("utf-8"))
+        else:
+            g_url = parse_qs(urlparse(url).query)["graph"][0]
+            with self.updater.lock:
+                self.dataset.graph(URIRef(g_url)).parse(data=data.decode("utf-8"), format="nt")
+        return Response(204)
+
+
+class FailingUpdater(GraphUpdater):
+    # The updates whose number is among the failures specified raise an exception
+    def __init__(self, dataset, failures=()):
+        super(FailingUpdater, self).__init__(dataset)
+        self.failures = failures
+        self.updates = 0
+
+    def __call__(self, endpoint, update):
+        self.updates += 1
+        if self.updates in self.failures:
+            raise Exception("The triplestore cannot load the file.")
+        super(FailingUpdater, self).__call__(endpoint, update)
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.name + sep
+        self.files = []
+        for idx, size in enumerate(SIZES):
+            f_path = self.dir + "%s.%s" % (idx, EXTENSIONS[idx])
+            with open_text(f_path, "w", "utf-8") as f:
+                for triple_idx in range(size):
+                    f.write("<https://w3id.org/oc/index/croci/ci/%s-%s> <http://purl.org/spar/cito/hasCitingEntity> "
+                            "\"%s\" .\n" % (idx, triple_idx, "value with é %s" % triple_idx))
+            self.files.append(f_path)
+        self.journal_path = self.dir + "journal.json"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get_to_upload(self, journal=None):
+        # As at the beginning of each run of the script
+        return get_to_upload(self.files, journal or LoadJournal(self.journal_path))
+
+    @staticmethod
+    def get_triples(files):
+        graph = Graph()
+        for f_path in files:
+            with open_text(f_path, encoding="utf-8") as f:
+                graph.parse(data=f.read(), format="nt")
+        return set(graph)
+
+    def assert_uploaded(self, dataset, files=None):
+        self.assertEqual(self.get_triples(self.files if files is None else files),
+                         set(dataset.graph(URIRef(GRAPH_URL))))
+
+    def upload_load(self, updater, workers=1, batch_size=0):
+        journal = LoadJournal(self.journal_path)
+        to_upload = self.get_to_upload(journal)
+        with redirect_stdout(StringIO()):
+            return upload(SERVER, GRAPH_URL, to_upload, journal, workers, batch_size, self.tmp.name, updater)
+
+    def upload_stream(self, mode, session, workers=1, chunk_size=2, retries=0):
+        journal = LoadJournal(self.journal_path)
+        to_upload = self.get_to_upload(journal)
+        with redirect_stdout(StringIO()):
+            return upload_stream(SERVER, GRAPH_URL, to_upload, journal, workers, chunk_size, mode, session, retries)
+
+    def test_load(self):
+        for batch_size in (0, 100, 1000000):
+            with self.subTest(batch_size=batch_size):
+                dataset = Dataset()
+                self.assertEqual(0, self.upload_load(GraphUpdater(dataset), 3, batch_size))
+                self.assert_uploaded(dataset)
+                self.assertEqual([], self.get_to_upload())
+                # The next upload starts from scratch
+                self.journal_path += "_"
+
+    def test_load_resume(self):
+        dataset = Dataset()
+        self.assertEqual(2, self.upload_load(FailingUpdater(dataset, (2, 4))))
+        self.assert_uploaded(dataset, [self.files[0], self.files[2]] + self.files[4:])
+        self.assertEqual([self.files[1], self.files[3]], [f_path for f_path, checksum in self.get_to_upload()])
+
+        self.assertEqual(0, self.upload_load(GraphUpdater(dataset)))
+        self.assert_uploaded(dataset)
+        # The files unchanged since their upload are not read again
+        with patch("script.updatetp.get_checksum", side_effect=AssertionError):
+            self.assertEqual([], self.get_to_upload())
+
+        # A file changed after its upload is uploaded again
+        with open(self.files[2], "a", encoding="utf-8") as f:
+            f.write("<https://w3id.org/oc/index/croci/ci/new> <http://purl.org/spar/cito/hasCitingEntity> \"x\" .\n")
+        self.assertEqual([self.files[2]], [f_path for f_path, checksum in self.get_to_upload()])
+        self.assertEqual(0, self.upload_load(GraphUpdater(dataset)))
+        self.assert_uploaded(dataset)
+
+    def test_stream(self):
+        for mode in ("insert", "graph_store"):
+            for chunk_size in (1, 2, 100):
+                with self.subTest(mode=mode, chunk_size=chunk_size):
+                    dataset = Dataset()
+                    session = Session(dataset)
+                    self.assertEqual(0, self.upload_stream(mode, session, 3, chunk_size))
+                    self.assert_uploaded(dataset)
+                    # Each chunk is sent with one request, and the empty files are not sent at all
+                    self.assertEqual(sum(-(-size // chunk_size) for size in SIZES), session.requests)
+                    self.assertEqual([], self.get_to_upload())
+                    self.journal_path += "_"
+
+    def test_stream_resume(self):
+        for mode in ("insert", "graph_store"):
+            with self.subTest(mode=mode):
+                dataset = Dataset()
+                # The third chunk of the first file and the fourth one of the fourth file fail, while the only
+                # chunk of the second file and the first one of the fifth file succeed when sent again
+                session = Session(dataset, {3: 400, 4: 500, 9: 400, 10: 503})
+                self.assertEqual(2, self.upload_stream(mode, session, retries=1))
+                self.assertEqual([self.files[0], self.files[3]],
+                                 [f_path for f_path, checksum in self.get_to_upload()])
+                self.assertTrue(set(dataset.graph(URIRef(GRAPH_URL))) >=
+                                self.get_triples(self.files[1:3] + self.files[4:]))
+
+                self.assertEqual(0, self.upload_stream(mode, Session(dataset)))
+                self.assert_uploaded(dataset)
+                self.assertEqual([], self.get_to_upload())
+                self.journal_path += "_"
+
+
+if __name__ == "__main__":
+    unittest.main()